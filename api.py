@@ -0,0 +1,103 @@
+# JSON API.
+#
+# /api/v1/venues, /api/v1/artists and /api/v1/shows return the same rows as
+# the HTML pages, read through queries.api_rows: only the columns named in
+# ?fields= are selected, result tuples go straight to the serializer, and
+# nothing is rendered. Lists are paged with ?after= cursors; ?ids=1,2,3
+# fetches several rows in one statement. orjson serializes when installed.
+import json
+from flask import Blueprint, Response, request, url_for
+from model import Venue, Artist, Show
+from queries import API_FIELDS, API_PAGE_SIZE, FEED_MAX_PAGE_SIZE, api_rows, listing_version, feed_version, \
+    encode_cursor, decode_cursor
+from cache import conditional
+from profiler import query_budget
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+api = Blueprint('api', __name__, url_prefix='/api/v1')
+
+
+def dumps(payload):
+    if orjson is not None:
+        return orjson.dumps(payload)
+    return json.dumps(payload, default=lambda value: value.isoformat(), separators=(',', ':'))
+
+
+def json_response(payload, status=200):
+    return Response(dumps(payload), status=status, mimetype='application/json')
+
+
+class BadRequest(Exception):
+    pass
+
+
+@api.errorhandler(BadRequest)
+def bad_request(error):
+    return json_response({'error': str(error)}, 400)
+
+
+def _fields(model):
+    if not request.args.get('fields'):
+        return list(API_FIELDS[model])
+    fields = [field.strip() for field in request.args['fields'].split(',') if field.strip()]
+    unknown = [field for field in fields if field not in API_FIELDS[model]]
+    if unknown:
+        raise BadRequest('Unknown fields: %s. Available: %s.' % (', '.join(unknown), ', '.join(API_FIELDS[model])))
+    return fields
+
+
+def _ids():
+    if 'ids' not in request.args:
+        return None
+    try:
+        ids = [int(id) for id in request.args['ids'].split(',') if id.strip()]
+    except ValueError:
+        raise BadRequest('ids must be a comma-separated list of integers.')
+    if len(ids) > FEED_MAX_PAGE_SIZE:
+        raise BadRequest('At most %d ids at a time.' % FEED_MAX_PAGE_SIZE)
+    return ids
+
+
+def _after(model):
+    cursor = request.args.get('after')
+    if not cursor:
+        return None
+    after = decode_cursor(cursor) if model is Show else (int(cursor) if cursor.isdigit() else None)
+    if after is None:
+        raise BadRequest('Malformed cursor.')
+    return after
+
+
+def _page(model, endpoint):
+    limit = max(1, min(request.args.get('limit', API_PAGE_SIZE, type=int), FEED_MAX_PAGE_SIZE))
+    rows, next_after = api_rows(model, _fields(model), after=_after(model), limit=limit, ids=_ids())
+    payload = {'data': rows, 'next': None}
+    if next_after is not None:
+        cursor = encode_cursor(*next_after) if model is Show else str(next_after)
+        payload['next'] = url_for(endpoint, **dict(request.args.to_dict(), after=cursor))
+    return json_response(payload)
+
+
+@api.route('/venues')
+@query_budget(3)
+@conditional(lambda: listing_version(Venue))
+def venues():
+    return _page(Venue, 'api.venues')
+
+
+@api.route('/artists')
+@query_budget(3)
+@conditional(lambda: listing_version(Artist))
+def artists():
+    return _page(Artist, 'api.artists')
+
+
+@api.route('/shows')
+@query_budget(2)
+@conditional(feed_version)
+def shows():
+    return _page(Show, 'api.shows')
@@ -1,36 +1,75 @@
-import json
-import dateutil.parser
-import babel
-from flask import Flask, render_template, request, flash, redirect, url_for
-from flask_migrate import Migrate
-from flask_moment import Moment
-import logging
-from logging import Formatter, FileHandler
-from sqlalchemy import distinct
-from forms import *
-from model import db, Show, Venue, Artist
+import functools
+from calendar import Calendar
+from datetime import date, datetime, timedelta
+from flask import Flask, Blueprint, render_template, request, flash, redirect, url_for, abort, Response, \
+    stream_with_context, jsonify, current_app
+from sqlalchemy.exc import IntegrityError, SQLAlchemyError
+from model import db, Venue, Artist, default_end_time, live
+from queries import venue_areas, artist_list, LISTING_SORTS, venue_detail, artist_detail, browse_genre, ShowFeed, FEED_PAGE_SIZE, decode_cursor, \
+    entity_version, listing_version, feed_version, calendar_days, calendar_counts, CALENDAR_MAX_DAYS, \
+    show_conflicts, booking_parties
+from search import MemoryIndexes, search
+from cache import PageCache, cached, conditional
+from commands import fyyur_cli
+from api import api, json_response
+import ical
+import writes
+from profiler import SQLProfiler, query_budget
+from request_log import RequestLog
+from replicas import ReplicaRouter
+from templating import init_templates
+from assets import Assets
+from compression import Compression
 
 # App Config.
-app = Flask(__name__)
-moment = Moment(app)
-app.config.from_object('config')
-def init_db():
+#
+# create_app() builds an app with its own extensions, kept in
+# app.extensions and looked up through current_app, and registers the
+# pages blueprint below on it. Nothing here touches the database, so a
+# worker starts even while it is down, and the schema is left to the
+# migrations (`flask db upgrade`). The forms, Babel and dateutil are
+# imported by the code that first needs them, and Flask-Migrate only for
+# the `flask` command.
+pages = Blueprint('pages', __name__)
+
+
+def route(rule, **options):
+    """Like pages.route, but registers the view under its own name rather
+    than 'pages.<name>', so url_for('show_venue') and the templates' links
+    work unchanged."""
+    def decorator(view):
+        pages.record(lambda state: state.app.add_url_rule(rule, view.__name__, view, **options))
+        return view
+    return decorator
+
+
+def create_app(config='config', **settings):
+    """A Fyyur app configured from config (an import name or object for
+    app.config.from_object), then from settings."""
+    app = Flask(__name__)
+    app.config.from_object(config)
+    app.config.update(settings)
+    PageCache(app)
+    MemoryIndexes(app)
+    writes.WriteStats(app)
+    # Before the profiler, so its replica lag checks are not billed to requests.
+    ReplicaRouter(db, app)
+    SQLProfiler(app)
+    RequestLog(app)
+    init_templates(app)
+    Assets(app)
     db.init_app(app)
-    db.app = app
-    db.create_all()
+    if app.config.get('DB_MIGRATIONS'):
+        from flask_migrate import Migrate
+        Migrate(app, db)
+    app.cli.add_command(fyyur_cli)
+    app.register_blueprint(api)
+    app.register_blueprint(pages)
+    # Last: it wraps the finished app's wsgi_app.
+    Compression(app)
+    return app
 
 
-migrate = Migrate(app, db)
-init_db()
-
-def format_datetime(value, format ='medium'):
-    date = dateutil.parser.parse(value)
-    if format == 'full':
-        format = "EEEE MMMM, d, y 'at' h:mma"
-    elif format == 'medium':
-        format = "EE MM, dd, y h:mma"
-    return babel.dates.format_datetime(date, format)
-
 def flash_errors(form):
     """Flashes form errors"""
     for field, errors in form.errors.items():
@@ -41,14 +80,60 @@ def flash_errors(form):
             ), 'error')
 
 
-app.jinja_env.filters['datetime'] = format_datetime
+def listing_options():
+    """The "has upcoming shows" filter and sort order of a listing page."""
+    sort = request.args.get('sort', 'name')
+    if sort not in LISTING_SORTS:
+        abort(400)
+    return bool(request.args.get('upcoming', 0, type=int)), sort
+
+
+def calendar_filters():
+    """The city, state and genre filters of the calendar views."""
+    return dict((key, request.args.get(key) or None) for key in ('city', 'state', 'genre'))
+
+
+def calendar_range(default_days=31):
+    """The [start, end) a calendar request asks for: ?month=YYYY-MM, or
+    ?start= and ?end= dates or datetimes (from today for default_days).
+    Show times are local wall-clock times, so datetimes with a UTC offset
+    are refused."""
+    try:
+        if request.args.get('month'):
+            start = datetime.strptime(request.args['month'], '%Y-%m')
+            end = (start + timedelta(days=32)).replace(day=1)
+        else:
+            start = datetime.fromisoformat(request.args['start']) if request.args.get('start') \
+                else datetime.combine(date.today(), datetime.min.time())
+            end = datetime.fromisoformat(request.args['end']) if request.args.get('end') \
+                else start + timedelta(days=default_days)
+    except ValueError:
+        abort(400)
+    if start.tzinfo is not None or end.tzinfo is not None:
+        abort(400)
+    if not start < end <= start + timedelta(days=CALENDAR_MAX_DAYS):
+        abort(400)
+    return start, end
+
+
+def stream_template(template_name, **context):
+    """Renders a template as a generator so the response can be streamed."""
+    current_app.update_template_context(context)
+    template = current_app.jinja_env.get_template(template_name)
+    stream = template.stream(context)
+    stream.enable_buffering(5)
+    return stream
 
 
 # ----------------------------------------------------------------------------#
 # Controllers.
 # ----------------------------------------------------------------------------#
 
-@app.route('/')
+# Read views declare how many statements they may send with @query_budget,
+# ETag validator included; benchmarks/query_budgets.py enforces them.
+
+@route('/')
+@query_budget(0)
 def index():
     return render_template('pages/home.html')
 
@@ -56,341 +141,231 @@ def index():
 #  Venues
 #  ----------------------------------------------------------------
 
-@app.route('/venues')
+@route('/venues')
+@query_budget(2)
+@conditional(lambda: listing_version(Venue))
+@cached('venues')
 def venues():
-    data = []
+    upcoming_only, sort = listing_options()
     try:
-        fcity_state = db.session.query(distinct(Venue.city), Venue.state).all()# format (city, state)
-        for places in fcity_state:
-            city, state = places[0], places[1]
-            listed_data = {"city": city, "state": state, "venues": []}
-            venues = Venue.query.filter_by(city=city, state=state).all()
-            for venue in venues:
-                upcoming_shows = [Show.query.filter_by(venue_id=venue.id).filter(Show.start_time > datetime.now()).all()]
-                venue_data = {"id": venue.id, "name": venue.name, "num_upcoming_shows": len(upcoming_shows)}
-                listed_data["venues"].append(venue_data)
-            data.append(listed_data)
-    except:
+        data = venue_areas(upcoming_only=upcoming_only, sort=sort)
+    except SQLAlchemyError:
         db.session.rollback()
         flash("An error has occurred while loading the Venues")
         return render_template("pages/home.html")
-    finally:
-        return render_template('pages/venues.html', areas=data)
+    return render_template('pages/venues.html', areas=data, upcoming_only=upcoming_only, sort=sort)
 
 
-@app.route('/venues/search', methods=['POST'])
+@route('/venues/search', methods=['GET', 'POST'])
+@query_budget(3)
+@conditional(lambda: listing_version(Venue))
+@cached('venues')
 def search_venues():
-    search = "%{}%".format(request.form["search_term"])
-    result_q = Venue.query.filter(Venue.name.ilike(f'%{search}%')).all()
-    response={}
-    response['count'] = len(result_q)
-    response['data'] = result_q
-    return render_template('pages/search_venues.html', results=response, search_term=request.form.get('search_term', '') )
-
-
-def format_json(x):
-    for i in ['[', ']', '{', '}', '"']:
-        x = x.replace(i,'')
-    return x.split(',')
-
-
-@app.route('/venues/<int:venue_id>')
+    search_term = request.values.get('search_term', '')
+    response = search(Venue, search_term, page=request.values.get('page', 1, type=int))
+    return render_template('pages/search_venues.html', results=response, search_term=search_term)
+
+
+@route('/venues/genres/<genre>')
+@query_budget(3)
+@conditional(lambda genre: listing_version(Venue))
+@cached('venues')
+def browse_venue_genre(genre):
+    state = request.args.get('state')
+    response = browse_genre(Venue, genre, state=state, page=request.args.get('page', 1, type=int))
+    return render_template('pages/browse_genre.html', results=response, genre=genre, state=state,
+                           endpoint='browse_venue_genre', entity='venues')
+
+
+@route('/venues/<int:venue_id>')
+@query_budget(5)
+@conditional(lambda venue_id: entity_version(Venue, venue_id))
+@cached('venue:{venue_id}')
 def show_venue(venue_id):
-    venue = Venue.query.get(venue_id)
-    shows = Show.query.filter_by(venue_id=venue_id)
-    past_shows = []
-    for show in shows.filter(Show.start_time < datetime.now()).all():
-        artist = Artist.query.get(show.artist_id)
-        response = {
-            "artist_id": artist.id,
-            "artist_name": artist.name,
-            "artist_image_link": artist.image_link,
-            "start_time": str( show.start_time),
-        }
-        past_shows.append(response)
-
-    upcoming_shows = []
-    for show in shows.filter(Show.start_time > datetime.now()).all():
-        artist = Artist.query.get(show.artist_id)
-        response = {
-            "artist_id": artist.id,
-            "artist_name": artist.name,
-            "artist_image_link": artist.image_link,
-            "start_time": str(show.start_time),
-        }
-        upcoming_shows.append(response)
-
-    data = {
-        "id": venue.id,
-        "name": venue.name,
-        "genres": format_json(venue.genres),
-        "address": venue.address,
-        "city": venue.city,
-        "state": venue.city,
-        "phone": venue.phone,
-        "website": venue.website,
-        "facebook_link": venue.facebook_link,
-        "seeking_talent": venue.seeking_talent,
-        "image_link": venue.image_link,
-        "upcoming_shows": upcoming_shows,
-        "past_shows": past_shows,
-        "past_shows_count": len(past_shows),
-        "upcoming_shows_count": len(upcoming_shows),
-    }
+    data = venue_detail(venue_id,
+                        upcoming_page=request.args.get('upcoming_page', 1, type=int),
+                        past_page=request.args.get('past_page', 1, type=int))
+    if data is None:
+        abort(404)
     return render_template('pages/show_venue.html', venue=data)
 
 
 #  Create Venue
 #  ----------------------------------------------------------------
 
-@app.route('/venues/create', methods=['GET'])
+@route('/venues/create', methods=['GET'])
 def create_venue_form():
+    from forms import VenueForm
     form = VenueForm()
     return render_template('forms/new_venue.html', form=form)
 
 
-@app.route('/venues/create', methods=['POST'])
+@route('/venues/create', methods=['POST'])
 def create_venue_submission():
+    from forms import VenueForm
     form = VenueForm(request.form)
     if form.validate():
         try:
-            name = request.form['name']
-            city = request.form['city']
-            state = request.form['state']
-            address = request.form['state']
-            phone = request.form['phone']
-            image_link = request.form['image_link']
-            facebook_link = request.form['facebook_link']
-            genres = json.dumps(request.form.getlist('genres'))
-            website = request.form['website']
-            seeking_talent = True if request.form['seeking_talent'] == 'True' else False
-            seeking_description = request.form['seeking_description']
-            venue = Venue(name=name, genres=genres, city=city, state=state, address=address,
-                          phone=phone, website=website,
-                          seeking_talent=seeking_talent, seeking_description=seeking_description,
-                          facebook_link=facebook_link, image_link=image_link)
-            db.session.add(venue)
-            db.session.commit()
-            flash('Venue ' + request.form['name'] + ' was successfully listed!')
-        except:
-            db.session.rollback()
-            flash('An error occurred. Venue ' + request.form['name'] + ' could not be listed.')
-        finally:
-            db.session.close()
+            writes.run(lambda work: work.save_venue(form))
+            flash('Venue ' + form.name.data + ' was successfully listed!')
+        except SQLAlchemyError:
+            current_app.logger.exception('Could not create a venue')
+            flash('An error occurred. Venue ' + form.name.data + ' could not be listed.')
         return render_template('pages/home.html')
     else:
         flash_errors(form)
-        return redirect(url_for('create_venue_form', form=form))
+        return redirect(url_for('create_venue_form'))
 
 
-@app.route('/venues/<venue_id>', methods=['DELETE'])
-def delete_venue(venue_id):
+def delete_entity(model, entity_id):
+    """Deletes a venue or an artist; answers the URL to go to next."""
     try:
-        venue = Venue.query.filter_by(id=venue_id).first()
-        db.session.delete(venue)
-        db.session.commit()
-        flash('Venue was successfully DELETED  ')
-    except:
-        db.session.rollback()
+        deleted = writes.run(lambda work: work.delete(model, entity_id))
+    except SQLAlchemyError:
+        current_app.logger.exception('Could not delete %s %s', model.__tablename__, entity_id)
         flash('An error occurred')
-    finally:
-        db.session.close()
         return url_for("index")
+    if not deleted:
+        abort(404)
+    flash('%s was successfully deleted.' % model.__name__)
+    return url_for("index")
+
+
+@route('/venues/<int:venue_id>', methods=['DELETE'])
+def delete_venue(venue_id):
+    return delete_entity(Venue, venue_id)
 
 #  Artists
 
-@app.route('/artists')
+@route('/artists')
+@query_budget(2)
+@conditional(lambda: listing_version(Artist))
+@cached('artists')
 def artists():
-    return render_template('pages/artists.html', artists=Artist.query.all())
+    upcoming_only, sort = listing_options()
+    return render_template('pages/artists.html', artists=artist_list(upcoming_only=upcoming_only, sort=sort),
+                           upcoming_only=upcoming_only, sort=sort)
 
 
-@app.route('/artists/search', methods=['POST'])
+@route('/artists/search', methods=['GET', 'POST'])
+@query_budget(3)
+@conditional(lambda: listing_version(Artist))
+@cached('artists')
 def search_artists():
-    tag = request.form["search_term"]
-    search = "%{}%".format(tag)
-    result_q = Artist.query.filter(Artist.name.ilike(f'%{search}%')).all()
-    response = {}
-    response['count'] = len(result_q)
-    response['data'] = result_q
-    return render_template('pages/search_artists.html', results=response, search_term=request.form.get('search_term', ''))
-
-
-@app.route('/artists/<int:artist_id>')
+    search_term = request.values.get('search_term', '')
+    response = search(Artist, search_term, page=request.values.get('page', 1, type=int))
+    return render_template('pages/search_artists.html', results=response, search_term=search_term)
+
+
+@route('/artists/genres/<genre>')
+@query_budget(3)
+@conditional(lambda genre: listing_version(Artist))
+@cached('artists')
+def browse_artist_genre(genre):
+    state = request.args.get('state')
+    response = browse_genre(Artist, genre, state=state, page=request.args.get('page', 1, type=int))
+    return render_template('pages/browse_genre.html', results=response, genre=genre, state=state,
+                           endpoint='browse_artist_genre', entity='artists')
+
+
+@route('/artists/<int:artist_id>')
+@query_budget(5)
+@conditional(lambda artist_id: entity_version(Artist, artist_id))
+@cached('artist:{artist_id}')
 def show_artist(artist_id):
-    query = db.session.query(Show).join(Artist, Artist.id == artist_id).join(Venue, Venue.id == Show.venue_id).all()
-    past_shows, upcoming_shows = [], []
-
-    for show in query:
-        if show.start_time > datetime.now():
-            response = {
-                "venue_id": show.venue.id,
-                "venue_name": show.venue.name,
-                "venue_image_link": show.venue.image_link,
-                "start_time": str(show.start_time)}
-            past_shows.append(response)
-        else:
-             response = {
-                "venue_id": show.venue.id,
-                "venue_name": show.venue.name,
-                "venue_image_link": show.venue.image_link,
-                "start_time": str(show.start_time)}
-             upcoming_shows.append(response)
-
-        data = {
-            "id": artist_id,
-            "name": show.artist.name,
-            "city": show.artist.city,
-            "state": show.artist.state,
-            "phone": show.artist.phone,
-            "website": show.artist.website,
-            "facebook_link": show.artist.facebook_link,
-            "seeking_venue": show.artist.seeking_venue,
-            "seeking_description": show.artist.seeking_description,
-            "image_link": show.artist.image_link,
-            "upcoming_shows": upcoming_shows,
-            "past_shows": past_shows,
-            "past_shows_count": len(past_shows),
-             "upcoming_shows_count": len(upcoming_shows),}
-
+    data = artist_detail(artist_id,
+                         upcoming_page=request.args.get('upcoming_page', 1, type=int),
+                         past_page=request.args.get('past_page', 1, type=int))
+    if data is None:
+        abort(404)
     return render_template('pages/show_artist.html', artist=data)
 
 
+@route('/artists/<int:artist_id>', methods=['DELETE'])
+def delete_artist(artist_id):
+    return delete_entity(Artist, artist_id)
+
+
 #  Update
 #  ----------------------------------------------------------------
-@app.route('/artists/<int:artist_id>/edit', methods=['GET'])
+@route('/artists/<int:artist_id>/edit', methods=['GET'])
+@query_budget(2)
 def edit_artist(artist_id):
-    form = ArtistForm()
-    artist = Artist.query.get(artist_id)
-    form.name.data = artist.name
-    form.genres.data = artist.genres
-    form.city.data = artist.city
-    form.state.data = artist.state
-    form.phone.data = artist.phone
-    form.facebook_link.data = artist.facebook_link
-    form.state.data = artist.state
-    form.image_link.data = artist.image_link
-    form.website.data = artist.website
-    form.seeking_venue.data = artist.seeking_venue
-    form.seeking_description.data = artist.seeking_description
+    from forms import ArtistForm
+    artist = Artist.query.filter(Artist.id == artist_id, live(Artist)).first_or_404()
+    form = ArtistForm(obj=artist)
     return render_template('forms/edit_artist.html', form=form, artist=artist)
 
 
-@app.route('/artists/<int:artist_id>/edit', methods=['POST'])
+@route('/artists/<int:artist_id>/edit', methods=['POST'])
 def edit_artist_submission(artist_id):
+    from forms import ArtistForm
+    artist = Artist.query.filter(Artist.id == artist_id, live(Artist)).first_or_404()
     form = ArtistForm(request.form)
     if form.validate():
         try:
-            artist = Artist.query.get(artist_id)
-            artist.name = request.form['name']
-            artist.genres = json.dumps(request.form.getlist('genres'))
-            artist.city = request.form['city']
-            artist.state = request.form['state']
-            artist.phone = request.form['phone']
-            artist.website = request.form['website']
-            artist.facebook_link = request.form['facebook_link']
-            artist.seeking_venue = True if request.form['seeking_venue'] == 'True' else False
-            artist.seeking_description = request.form['seeking_description']
-            artist.image_link = request.form['image_link']
-            db.session.add(artist)
-            db.session.commit()
-        except:
-            db.session.rollback()
+            writes.run(lambda work: work.save_artist(form, artist))
+        except SQLAlchemyError:
+            current_app.logger.exception('Could not edit artist %s', artist_id)
             flash('An error occurred edit venues' + str(artist_id))
-        finally:
-            db.session.close()
-            return redirect(url_for('show_artist', artist_id=artist_id))
+        return redirect(url_for('show_artist', artist_id=artist_id))
     else:
         flash_errors(form)
-        return redirect(url_for('edit_artist', form=form))
+        return render_template('forms/edit_artist.html', form=form, artist=artist)
 
 
 
-@app.route('/venues/<int:venue_id>/edit', methods=['GET'])
+@route('/venues/<int:venue_id>/edit', methods=['GET'])
+@query_budget(2)
 def edit_venue(venue_id):
-    form = VenueForm()
-    venue = Venue.query.get(venue_id)
-    form.name.data = venue.name
-    form.genres.data = venue.genres
-    form.city.data = venue.city
-    form.state.data = venue.state
-    form.address.data = venue.address
-    form.phone.data = venue.phone
-    form.facebook_link.data = venue.facebook_link
-    form.state.data = venue.state
-    form.image_link.data = venue.image_link
-    form.website.data = venue.website
-    form.seeking_talent.data = venue.seeking_talent
-    form.seeking_description.data = venue.seeking_description
+    from forms import VenueForm
+    venue = Venue.query.filter(Venue.id == venue_id, live(Venue)).first_or_404()
+    form = VenueForm(obj=venue)
     return render_template('forms/edit_venue.html', form=form, venue=venue)
 
 
-@app.route('/venues/<int:venue_id>/edit', methods=['POST'])
+@route('/venues/<int:venue_id>/edit', methods=['POST'])
 def edit_venue_submission(venue_id):
+    from forms import VenueForm
+    venue = Venue.query.filter(Venue.id == venue_id, live(Venue)).first_or_404()
     form = VenueForm(request.form)
     if form.validate():
         try:
-            venue = Venue.query.get(venue_id)
-            venue.name = request.form['name']
-            venue.city = request.form['city']
-            venue.state = request.form['state']
-            venue.genres = json.dumps(request.form.getlist('genres'))
-            venue.address = request.form['address']
-            venue.phone = request.form['phone']
-            venue.facebook_link = request.form['facebook_link']
-            venue.website = request.form['website']
-            venue.image_link = request.form['image_link']
-            db.session.add(venue)
-            db.session.commit()
-        except:
-            db.session.rollback()
+            writes.run(lambda work: work.save_venue(form, venue))
+        except SQLAlchemyError:
+            current_app.logger.exception('Could not edit venue %s', venue_id)
             flash('An error occurred edit venues' + str(venue_id))
-        finally:
-            db.session.close()
         return redirect(url_for('show_venue', venue_id=venue_id))
     else:
         flash_errors(form)
-        return redirect(url_for('edit_venue', form=form))
+        return render_template('forms/edit_venue.html', form=form, venue=venue)
 
 #  Create Artist
 #  ----------------------------------------------------------------
 
-@app.route('/artists/create', methods=['GET'])
+@route('/artists/create', methods=['GET'])
 def create_artist_form():
+    from forms import ArtistForm
     form = ArtistForm()
     return render_template('forms/new_artist.html', form=form)
 
 
 
-@app.route('/artists/create', methods=['POST'])
+@route('/artists/create', methods=['POST'])
 def create_artist_submission():
+    from forms import ArtistForm
     form = ArtistForm(request.form)
     if form.validate():
         try:
-            name = request.form['name']
-            city = request.form['city']
-            state = request.form['state']
-            phone = request.form['phone']
-            facebook_link = request.form['facebook_link']
-            seeking_venue = True if request.form['seeking_venue'] == 'True' else False
-            seeking_description = request.form['seeking_description']
-            website = request.form['website']
-            image_link = request.form['image_link']
-            genres = request.form['genres']
-            artist = Artist(name=name, city=city, state=state, phone=phone, website=website
-                                , genres=genres, facebook_link=facebook_link, seeking_venue=seeking_venue
-                                , seeking_description=seeking_description, image_link=image_link)
-            db.session.add(artist)
-            db.session.commit()
-            flash('Artist ' + request.form['name'] + ' was successfully listed!')
-        except:
-            db.session.rollback()
-            flash('An error occurred. Artist ' + request.form['name'] + ' could not be listed.')
-        finally:
-            db.session.close()
-            return render_template('pages/home.html')
+            writes.run(lambda work: work.save_artist(form))
+            flash('Artist ' + form.name.data + ' was successfully listed!')
+        except SQLAlchemyError:
+            current_app.logger.exception('Could not create an artist')
+            flash('An error occurred. Artist ' + form.name.data + ' could not be listed.')
+        return render_template('pages/home.html')
     else:
         flash_errors(form)
-        return redirect(url_for('create_artist_form', form=form))
+        return redirect(url_for('create_artist_form'))
 
 
 
@@ -398,78 +373,159 @@ def create_artist_submission():
 #  Shows
 #  ----------------------------------------------------------------
 
-@app.route('/shows')
+@route('/shows')
+@query_budget(2)
+@conditional(feed_version)
+@cached('shows')
 def shows():
-    response = []
-    for show in Show.query.all():
-        response.append({
-            'venue_id': show.venue.id,
-            'venue_name': show.venue.name,
-            'artist_id': show.artist.id,
-            'artist_name': show.artist.name,
-            'artist_image_link': show.artist.image_link,
-            'start_time': show.start_time.strftime("%Y-%m-%dT%H:%M:%SZ")
-        })
-    return render_template('pages/shows.html', shows=response)
-
-
-@app.route('/shows/create')
+    after = None
+    if request.args.get('after'):
+        after = decode_cursor(request.args['after'])
+        if after is None:
+            abort(400)
+    feed = ShowFeed(after=after, limit=request.args.get('limit', FEED_PAGE_SIZE, type=int))
+    if request.args.get('stream', 0, type=int):
+        return Response(stream_with_context(stream_template('pages/shows.html', shows=feed)))
+    return render_template('pages/shows.html', shows=feed)
+
+
+@route('/calendar')
+@query_budget(3)
+@conditional(feed_version)
+@cached('shows')
+def calendar_month():
+    # A month grid with the number of shows per day from one aggregate
+    # query, plus the shows of ?day= when one is picked.
+    if not request.args.get('month'):
+        args = dict(request.args.to_dict(), month=date.today().strftime('%Y-%m'))
+        return redirect(url_for('calendar_month', **args))
+    start, end = calendar_range()
+    filters = calendar_filters()
+    day = None
+    if request.args.get('day'):
+        try:
+            day = date.fromisoformat(request.args['day'])
+        except ValueError:
+            abort(400)
+    days = calendar_days(day, day + timedelta(days=1), **filters) if day else []
+    return render_template(
+        'pages/calendar.html', month=start, filters=filters, counts=calendar_counts(start, end, **filters),
+        weeks=Calendar(firstweekday=6).monthdatescalendar(start.year, start.month),
+        previous_month=(start - timedelta(days=1)).strftime('%Y-%m'), next_month=end.strftime('%Y-%m'),
+        day=day, shows=days[0]['shows'] if days else [])
+
+
+@route('/calendar.<any(json, ics):format>')
+@query_budget(2)
+@conditional(lambda format: feed_version())
+@cached('shows')
+def calendar_feed(format):
+    start, end = calendar_range()
+    days = calendar_days(start, end, **calendar_filters())
+    if format == 'ics':
+        return Response(ical.calendar(ical.show_events(days, request.url_root, host=request.host)),
+                        mimetype='text/calendar')
+    return json_response({'start': start, 'end': end, 'days': days})
+
+
+@route('/shows/create')
 def create_shows():
+    from forms import ShowForm
     form = ShowForm()
     return render_template('forms/new_show.html', form=form)
 
 
-@app.route('/shows/create', methods=['POST'])
+@route('/shows/create', methods=['POST'])
 def create_show_submission():
+    from forms import ShowForm
     form = ShowForm(request.form)
     if form.validate():
+        artist_id, venue_id = int(form.artist_id.data), int(form.venue_id.data)
+        start_time = form.start_time.data
+        end_time = form.end_time.data or default_end_time(start_time)
+        artist_exists, venue_exists = booking_parties(artist_id, venue_id)
+        if not artist_exists or not venue_exists:
+            flash('There is no artist with id {}.'.format(artist_id) if not artist_exists
+                  else 'There is no venue with id {}.'.format(venue_id))
+            return redirect(url_for('create_shows'))
+        conflicts = show_conflicts(artist_id, venue_id, start_time, end_time)
+        if conflicts:
+            flash('The {} is already booked from {} to {}.'.format(
+                'artist' if conflicts[0].artist_id == artist_id else 'venue',
+                conflicts[0].start_time, conflicts[0].end_time))
+            return redirect(url_for('create_shows'))
         try:
-            show = Show(artist_id=int(request.form['artist_id']), venue_id=int(request.form['venue_id'])
-                        , start_time=request.form['start_time'])
-            db.session.add(show)
-            db.session.commit()
+            writes.run(lambda work: work.add_show(artist_id, venue_id, start_time, end_time))
             flash('Show was successfully listed!')
-
-        except:
-            db.session.rollback()
+        except IntegrityError as error:
+            if not writes.double_booking(error):
+                current_app.logger.exception('Could not create a show')
+                flash('An error occurred. Show could not be listed.')
+            else:
+                # Booked by a concurrent request since the check above.
+                flash('The artist or the venue is already booked at that time.')
+        except SQLAlchemyError:
+            current_app.logger.exception('Could not create a show')
             flash('An error occurred. Show could not be listed.')
-        finally:
-            db.session.close()
         return render_template('pages/home.html')
     else:
-       flash_errors(form)
-       return redirect(url_for('create_shows', form=form ))
-
-
-@app.errorhandler(404)
+        flash_errors(form)
+        return redirect(url_for('create_shows'))
+
+
+def stats_endpoint(view):
+    """Hides an operational report unless STATS_ENDPOINTS is set or the app
+    runs in debug mode."""
+    @functools.wraps(view)
+    def wrapper(**view_args):
+        if not (current_app.debug or current_app.config.get('STATS_ENDPOINTS')):
+            abort(404)
+        return view(**view_args)
+    return wrapper
+
+
+@route('/cache/stats')
+@stats_endpoint
+def cache_stats():
+    report = current_app.extensions['page_cache'].report()
+    compression = current_app.extensions['compression']
+    if compression.enabled:
+        report['compression'] = compression.report()
+    return jsonify(report)
+
+
+@route('/db/stats')
+@stats_endpoint
+def db_stats():
+    metrics = getattr(db.engine.pool, 'metrics', None)
+    report = {'status': db.engine.pool.status()} if metrics is None else metrics.report()
+    report['writes'] = current_app.extensions['write_stats'].report()
+    replica_router = current_app.extensions['replica_router']
+    if replica_router.enabled:
+        report['replica'] = replica_router.report()
+    return jsonify(report)
+
+
+@pages.app_errorhandler(404)
 def not_found_error(error):
     return render_template('errors/404.html'), 404
 
 
-@app.errorhandler(500)
+@pages.app_errorhandler(500)
 def server_error(error):
     return render_template('errors/500.html'), 500
 
 
-if not app.debug:
-    file_handler = FileHandler('error.log')
-    file_handler.setFormatter(
-        Formatter('%(asctime)s %(levelname)s: %(message)s [in %(pathname)s:%(lineno)d]')
-    )
-    app.logger.setLevel(logging.INFO)
-    file_handler.setLevel(logging.INFO)
-    app.logger.addHandler(file_handler)
-    app.logger.info('errors')
 # Launch.
 
 
 # Default port:
 if __name__ == '__main__':
-    app.run()
+    create_app().run()
 
 # Or specify port manually:
 '''
 if __name__ == '__main__':
     port = int(os.environ.get('PORT', 5000))
-    app.run(host='0.0.0.0', port=port)
+    create_app().run(host='0.0.0.0', port=port)
 '''
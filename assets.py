@@ -0,0 +1,185 @@
+# Static asset bundles.
+#
+# `flask fyyur build-assets` concatenates the stylesheets and scripts of
+# each bundle in BUNDLES, minifies them and writes them to static/dist/
+# under a name carrying a hash of their content, next to gzip and (with the
+# brotli package installed) brotli copies and a manifest.json mapping bundle
+# names to the hashed files. A changed file gets a new name, so the bundles
+# are served with a one-year immutable Cache-Control and browsers never
+# revalidate them. Earlier builds are left in place for pages that still
+# link to them.
+#
+# Templates link bundles with asset_urls(name): the hashed bundle when
+# ASSETS_BUNDLES is on (outside debug mode) and the manifest is there, the
+# source files otherwise. Scripts are minified when rjsmin is installed;
+# the vendored libraries already are.
+import gzip
+import hashlib
+import json
+import logging
+import mimetypes
+import os
+import posixpath
+import re
+from flask import abort, request, send_from_directory, url_for
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+try:
+    import rjsmin
+except ImportError:
+    rjsmin = None
+
+DIST = 'dist'
+MANIFEST = 'manifest.json'
+IMMUTABLE_MAX_AGE = 365 * 24 * 3600
+ENCODINGS = (('br', '.br'), ('gzip', '.gz'))
+
+# Bundle name -> source files, relative to the static folder, in load order.
+BUNDLES = {
+    'main.css': ('css/bootstrap.min.css', 'css/layout.main.css', 'css/main.css', 'css/main.responsive.css',
+                 'css/main.quickfix.css'),
+    'head.js': ('js/libs/modernizr-2.8.2.min.js', 'js/libs/moment.min.js'),
+    # Loaded after jQuery; script.js ran first when it was deferred on its own.
+    'main.js': ('js/script.js', 'js/libs/bootstrap-3.1.1.min.js', 'js/plugins.js'),
+    'jquery.js': ('js/libs/jquery-1.11.1.min.js',),
+    'respond.js': ('js/libs/respond-1.4.2.min.js',),
+}
+
+logger = logging.getLogger('fyyur.assets')
+
+_CSS_TOKENS = re.compile(r'''("(?:\\.|[^"\\])*"|'(?:\\.|[^'\\])*')|(/\*.*?\*/)''', re.S)
+_CSS_URL = re.compile(r'''url\(\s*(['"]?)([^'")]+)\1\s*\)''')
+_SOURCE_MAP = re.compile(r'^\s*//[#@] sourceMappingURL=.*$', re.M)
+
+
+def _squeeze_css(text):
+    text = re.sub(r'\s+', ' ', text)
+    text = re.sub(r'\s*([{};,>])\s*', r'\1', text)
+    return re.sub(r':\s+', ':', text).replace(';}', '}')
+
+
+def minify_css(text):
+    """Drops comments (but /*! notices) and whitespace outside strings."""
+    text = _CSS_TOKENS.sub(lambda match: '' if match.group(2) and not match.group(2).startswith('/*!')
+                           else match.group(0), text)
+    parts, position = [], 0
+    for match in _CSS_TOKENS.finditer(text):
+        parts.append(_squeeze_css(text[position:match.start()]))
+        parts.append(match.group(0))
+        position = match.end()
+    parts.append(_squeeze_css(text[position:]))
+    return ''.join(parts).strip()
+
+
+def minify_js(text):
+    text = _SOURCE_MAP.sub('', text)
+    return rjsmin.jsmin(text) if rjsmin is not None else text.strip()
+
+
+def _rebase_urls(text, source, target_dir):
+    """Points the relative url()s of source at the same files from target_dir."""
+    def rebase(match):
+        url = match.group(2)
+        if re.match(r'^(?:[a-z]+:|/|#)', url):
+            return match.group(0)
+        path = posixpath.normpath(posixpath.join(posixpath.dirname(source), url))
+        return 'url(%s%s%s)' % (match.group(1), posixpath.relpath(path, target_dir), match.group(1))
+    return _CSS_URL.sub(rebase, text)
+
+
+def bundle(static_folder, name, sources):
+    """The minified contents of bundle name, as bytes."""
+    pieces = []
+    for source in sources:
+        with open(os.path.join(static_folder, source), encoding='utf-8') as stream:
+            text = stream.read()
+        if name.endswith('.css'):
+            pieces.append(minify_css(_rebase_urls(text, source, DIST)))
+        else:
+            pieces.append(minify_js(text))
+    # A script without a trailing semicolon must not run into the next one.
+    return ('\n' if name.endswith('.css') else ';\n').join(pieces).encode('utf-8')
+
+
+def hashed_name(name, data):
+    stem, extension = os.path.splitext(name)
+    return '%s.%s%s' % (stem, hashlib.sha256(data).hexdigest()[:12], extension)
+
+
+def build(static_folder, bundles=BUNDLES):
+    """Writes the bundles, their compressed copies and the manifest to
+    static_folder/dist; returns the manifest."""
+    target = os.path.join(static_folder, DIST)
+    os.makedirs(target, exist_ok=True)
+    manifest = {}
+    for name, sources in sorted(bundles.items()):
+        data = bundle(static_folder, name, sources)
+        filename = manifest[name] = hashed_name(name, data)
+        variants = [('', data), ('.gz', gzip.compress(data, 9, mtime=0))]
+        if brotli is not None:
+            variants.append(('.br', brotli.compress(data, quality=11)))
+        for suffix, content in variants:
+            with open(os.path.join(target, filename + suffix), 'wb') as stream:
+                stream.write(content)
+    path = os.path.join(target, MANIFEST)
+    with open(path + '.tmp', 'w') as stream:
+        json.dump(manifest, stream, indent=2, sort_keys=True)
+    # Workers starting mid-build see the old manifest or the new one.
+    os.replace(path + '.tmp', path)
+    return manifest
+
+
+class Assets(object):
+    """Serves the built bundles and gives templates asset_urls().
+
+    Configured from ASSETS_BUNDLES.
+    """
+
+    def __init__(self, app=None):
+        self.app = None
+        self.manifest = {}
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.app = app
+        self.directory = os.path.join(app.static_folder, DIST)
+        self.manifest = {}
+        if app.config.get('ASSETS_BUNDLES', not app.debug):
+            try:
+                with open(os.path.join(self.directory, MANIFEST)) as stream:
+                    self.manifest = json.load(stream)
+            except FileNotFoundError:
+                logger.warning('No %s; serving the source assets. Run `flask fyyur build-assets`.',
+                               os.path.join(self.directory, MANIFEST))
+        app.add_url_rule(app.static_url_path + '/' + DIST + '/<path:filename>', 'assets', self.send)
+        app.jinja_env.globals['asset_urls'] = self.asset_urls
+        app.extensions['assets'] = self
+
+    def asset_urls(self, name):
+        """The URLs to load bundle name from."""
+        if name in self.manifest:
+            return [url_for('assets', filename=self.manifest[name])]
+        return [url_for('static', filename=source) for source in BUNDLES[name]]
+
+    def send(self, filename):
+        if filename == MANIFEST:
+            abort(404)
+        accepted = request.accept_encodings
+        for encoding, suffix in ENCODINGS:
+            if accepted[encoding] and os.path.isfile(os.path.join(self.directory, filename + suffix)):
+                response = send_from_directory(self.directory, filename + suffix,
+                                               mimetype=mimetypes.guess_type(filename)[0])
+                response.headers['Content-Encoding'] = encoding
+                break
+        else:
+            response = send_from_directory(self.directory, filename)
+        response.vary.add('Accept-Encoding')
+        response.cache_control.public = True
+        response.cache_control.max_age = IMMUTABLE_MAX_AGE
+        response.cache_control.immutable = True
+        return response
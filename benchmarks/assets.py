@@ -0,0 +1,68 @@
+"""Compares loading a page's stylesheets and scripts from the source files
+and from the built bundles.
+
+    python -m benchmarks.assets
+
+Builds the bundles into static/dist/ (as `flask fyyur build-assets` does),
+then fetches the CSS and scripts every page loads, once as the separate
+source files and once as bundles, through the app's test client, and prints
+the requests, the bytes sent for each Accept-Encoding and the Cache-Control
+of each approach. A bundle is fetched again with If-None-Match to check
+revalidation still works. No database is needed.
+"""
+import os
+import sys
+import tempfile
+
+# config.py reads these when create_app() loads it.
+_handle, DATABASE_PATH = tempfile.mkstemp(suffix='.db')
+os.close(_handle)
+os.environ['DATABASE_URL'] = 'sqlite:///' + DATABASE_PATH
+os.environ['TEMPLATE_PRECOMPILE'] = '0'
+
+import assets  # noqa: E402
+from app import create_app  # noqa: E402
+
+# Loaded by every page; jquery.js and respond.js are fallbacks.
+PAGE_BUNDLES = ('main.css', 'head.js', 'main.js')
+ACCEPT = (('identity', ''), ('gzip', 'gzip'), ('br', 'br, gzip'))
+
+
+def fetch_all(app):
+    client = app.test_client()
+    with app.test_request_context('/'):
+        urls = [url for name in PAGE_BUNDLES for url in app.extensions['assets'].asset_urls(name)]
+    sizes, cache_control = {}, set()
+    for label, accept in ACCEPT:
+        sizes[label] = 0
+        for url in urls:
+            response = client.get(url, headers={'Accept-Encoding': accept})
+            assert response.status_code == 200, (url, response.status_code)
+            sizes[label] += len(response.get_data())
+            cache_control.add(response.headers.get('Cache-Control'))
+    return urls, sizes, cache_control
+
+
+def main(argv=None):
+    failures = 0
+    try:
+        manifest = assets.build(create_app().static_folder)
+        print('Built %d bundles%s' % (len(manifest), '' if assets.brotli else ' (no brotli: pip install brotli)'))
+        print('%-10s %5s %10s %10s %10s  %s' % ('', 'reqs', 'identity', 'gzip', 'br', 'Cache-Control'))
+        for label, bundles in (('sources', False), ('bundles', True)):
+            app = create_app(ASSETS_BUNDLES=bundles)
+            urls, sizes, cache_control = fetch_all(app)
+            print('%-10s %5d %10d %10d %10d  %s' % (
+                label, len(urls), sizes['identity'], sizes['gzip'], sizes['br'], ' | '.join(sorted(cache_control))))
+        response = app.test_client().get(urls[0])
+        revalidated = app.test_client().get(urls[0], headers={'If-None-Match': response.headers['ETag']})
+        if revalidated.status_code != 304:
+            print('FAIL: If-None-Match on a bundle answered %d' % revalidated.status_code)
+            failures += 1
+    finally:
+        os.remove(DATABASE_PATH)
+    return 1 if failures else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
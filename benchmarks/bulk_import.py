@@ -0,0 +1,109 @@
+"""Measures show import throughput and checks double bookings are rejected
+row by row.
+
+    python -m benchmarks.bulk_import [--shows 1k] [--rows 10000] [--chunk-size 1000]
+                                     [--clash-every 500] [--database-uri postgresql://.../scratch_db]
+
+Seeds a dataset as benchmarks.load_test does (into a throwaway SQLite file
+by default; a PostgreSQL database is wiped first, so only point it at a
+scratch one), then imports --rows shows through bulk.Importer, as
+`flask fyyur import shows` does. Every --clash-every-th row books its
+artist again at the time of the row before it, and the first row books a
+show that was seeded, so some chunks are refused by the database: on
+PostgreSQL by the exclusion constraints during the COPY, on SQLite by the
+overlap triggers. Those chunks are bisected; the run fails unless exactly
+the clashing rows are rejected and every other row is imported.
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+from datetime import date, datetime, timedelta
+
+
+def import_rows(n_rows, clash_every, n_venues, n_artists, start, seeded):
+    """The rows to import and the line numbers of the clashing ones."""
+    rows, clashes = [], set()
+    # Line 1: the first seeded show's artist at its start time.
+    rows.append((1, {'venue_id': str(n_venues), 'artist_id': str(seeded.artist_id),
+                     'start_time': seeded.start_time.strftime('%Y-%m-%d %H:%M:%S')}))
+    clashes.add(1)
+    for i in range(n_rows):
+        line = i + 2
+        if clash_every and i and i % clash_every == 0:
+            previous = dict(rows[-1][1], venue_id=str(1 + (i + 1) % n_venues))
+            rows.append((line, previous))
+            clashes.add(line)
+            continue
+        # Three hours apart per artist and per venue: never double-booked.
+        when = start + timedelta(hours=3 * i)
+        rows.append((line, {'venue_id': str(1 + i % n_venues), 'artist_id': str(1 + i % n_artists),
+                            'start_time': when.strftime('%Y-%m-%d %H:%M:%S')}))
+    return rows, clashes
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--database-uri')
+    parser.add_argument('--shows', default='1k', help='Seeded dataset size, e.g. 1000 or 100k.')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--rows', type=int, default=10000, help='Shows to import.')
+    parser.add_argument('--chunk-size', type=int, default=1000)
+    parser.add_argument('--clash-every', type=int, default=500, help='0 imports no clashing rows but the first.')
+    args = parser.parse_args(argv)
+
+    path = None
+    database_uri = args.database_uri
+    if database_uri is None:
+        handle, path = tempfile.mkstemp(suffix='.db')
+        os.close(handle)
+        database_uri = 'sqlite:///' + path
+    # config.py reads these when create_app() loads it.
+    os.environ.update(DATABASE_URL=database_uri, DEBUG='0', LOG_FILE='', DB_REPLICA_URL='')
+
+    import bulk
+    from app import create_app
+    from benchmarks.common import reset_schema, QueryCounter
+    from dataset import generate, parse_count
+    from model import db, Show
+
+    app = create_app(WTF_CSRF_ENABLED=False, DB_MIGRATIONS=True)
+    anchor = datetime.combine(date.today(), datetime.min.time())
+    failures = 0
+    try:
+        with app.app_context():
+            reset_schema()
+            counts = generate(parse_count(args.shows), seed=args.seed, anchor=anchor)
+            seeded = Show.query.order_by(Show.id).first()
+            rows, clashes = import_rows(args.rows, args.clash_every, counts['venues'], counts['artists'],
+                                        anchor + timedelta(days=800), seeded)
+            before = Show.query.count()
+            db.session.remove()
+
+            with QueryCounter(db.engine) as counter:
+                started = time.perf_counter()
+                importer = bulk.Importer('shows', args.chunk_size).run(rows)
+                elapsed = time.perf_counter() - started
+            imported = Show.query.count() - before
+            rejected = set(rejected.line for rejected in importer.rejected)
+            path_name = 'COPY' if db.engine.dialect.name == 'postgresql' else 'INSERT'
+
+        print('%s of %d rows in chunks of %d: %d imported, %d rejected in %.2fs (%.0f rows/s, %d statements)' % (
+            path_name, len(rows), args.chunk_size, importer.imported, len(rejected), elapsed,
+            len(rows) / elapsed, len(counter.executed)))
+        if rejected != clashes:
+            print('FAIL rejected lines %s, expected %s' % (sorted(rejected ^ clashes)[:10], sorted(clashes)[:10]))
+            failures += 1
+        if imported != importer.imported or imported != len(rows) - len(clashes):
+            print('FAIL %d shows imported (%d reported), expected %d' % (
+                imported, importer.imported, len(rows) - len(clashes)))
+            failures += 1
+    finally:
+        if path:
+            os.remove(path)
+    return 1 if failures else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
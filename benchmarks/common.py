@@ -0,0 +1,77 @@
+# Shared helpers for the benchmark scripts.
+#
+# Benchmarks build their own Flask app on top of model.py so they can run
+# against a throwaway SQLite database instead of the configured Postgres.
+import os
+import time
+from contextlib import contextmanager
+from flask import Flask
+from flask_migrate import Migrate, upgrade
+from sqlalchemy import event
+from model import db
+
+MIGRATIONS_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'migrations')
+
+
+def make_app(database_uri='sqlite://', **config):
+    app = Flask(__name__)
+    app.config['SQLALCHEMY_DATABASE_URI'] = database_uri
+    app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+    app.config.update(config)
+    db.init_app(app)
+    Migrate(app, db, directory=MIGRATIONS_DIR)
+    return app
+
+
+def reset_schema():
+    """Recreates an empty schema in the current app's database.
+
+    PostgreSQL goes through the migrations so it also gets the objects that
+    are not declared on the models (search vectors, indexes, triggers); only
+    point benchmarks at a scratch database.
+    """
+    db.session.remove()
+    if db.engine.dialect.name == 'postgresql':
+        # Dropping the schema also clears tables create_all() made outside
+        # the migrations.
+        with db.engine.begin() as connection:
+            connection.execute('DROP SCHEMA public CASCADE')
+            connection.execute('CREATE SCHEMA public')
+        upgrade(directory=MIGRATIONS_DIR)
+    else:
+        db.drop_all()
+        db.create_all()
+
+
+class QueryCounter(object):
+    """Records the statements sent to the database while active."""
+
+    def __init__(self, engine):
+        self.engine = engine
+        self.executed = []  # (statement, parameters)
+
+    def _before_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        self.executed.append((statement, parameters))
+
+    def __enter__(self):
+        event.listen(self.engine, 'before_cursor_execute', self._before_cursor_execute)
+        return self
+
+    def __exit__(self, *exc):
+        event.remove(self.engine, 'before_cursor_execute', self._before_cursor_execute)
+
+    @property
+    def count(self):
+        return len(self.executed)
+
+
+@contextmanager
+def timed(results, key):
+    start = time.perf_counter()
+    yield
+    results[key] = time.perf_counter() - start
+
+
+def percentile(values, fraction):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * fraction))] if values else 0.0
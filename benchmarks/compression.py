@@ -0,0 +1,129 @@
+"""Reports, per route, the bytes compression saves and the CPU it costs.
+
+    python -m benchmarks.compression [--shows 1k] [--seed 0] [--requests 20]
+
+Seeds a dataset into a throwaway SQLite file, as benchmarks.load_test does,
+and fetches every GET route of its scenarios (plus the streamed /shows).
+For each it prints the uncompressed size, the gzip and (with the brotli
+package installed) brotli sizes at the configured levels, the share of the
+bytes saved, the CPU time one compression takes, and the median latency of
+a request with no Accept-Encoding, with gzip and with a browser's (gzip,
+deflate, br), which must get brotli when it is installed. A page with an
+ETag is revalidated, and its 304 must carry the ETag the compressed 200
+did. Page cache hits send the compressed body kept with the page; the
+compression counters at the end show how many responses were compressed,
+reused or streamed.
+"""
+import argparse
+import os
+import statistics
+import sys
+import tempfile
+import time
+import timeit
+from datetime import date, datetime
+
+# What a browser sends: brotli when the server has it, gzip otherwise.
+ACCEPT = {'identity': {}, 'gzip': {'Accept-Encoding': 'gzip'}, 'browser': {'Accept-Encoding': 'gzip, deflate, br'}}
+
+
+def cpu_us(function, data, number=20):
+    return min(timeit.repeat(lambda: function(data), number=number, repeat=3)) / number * 1e6
+
+
+def median_ms(client, url, headers, requests):
+    times = []
+    for _ in range(requests):
+        start = time.perf_counter()
+        client.get(url, headers=headers).get_data()
+        times.append(time.perf_counter() - start)
+    return statistics.median(times) * 1e3
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--shows', default='1k', help='Dataset size, e.g. 1000 or 100k.')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--requests', type=int, default=20, help='Requests per route and encoding.')
+    args = parser.parse_args(argv)
+
+    handle, path = tempfile.mkstemp(suffix='.db')
+    os.close(handle)
+    # config.py reads these when create_app() loads it.
+    os.environ.update(DATABASE_URL='sqlite:///' + path, DEBUG='0', LOG_FILE='', DB_REPLICA_URL='')
+
+    from app import create_app
+    from assets import build
+    from benchmarks.common import reset_schema
+    from benchmarks.load_test import scenarios
+    from compression import ENCODINGS
+    from dataset import generate, parse_count
+    from model import db
+
+    app = create_app(WTF_CSRF_ENABLED=False, STATS_ENDPOINTS=True)
+    compression = app.extensions['compression']
+    anchor = datetime.combine(date.today(), datetime.min.time())
+    failures = 0
+    try:
+        with app.app_context():
+            reset_schema()
+            counts = generate(parse_count(args.shows), seed=args.seed, anchor=anchor)
+            db.session.remove()
+        plan = [(route, url(0)) for route, method, url, _ in scenarios(counts, anchor, build(app.static_folder))
+                if method == 'GET']
+        plan.append(('GET /shows?stream=1', '/shows?stream=1'))
+
+        client = app.test_client()
+        print('%-40s %8s %8s %6s %8s %6s %8s %8s %9s %9s %9s' % (
+            'route', 'bytes', 'gzip', 'saved', 'gzip us', 'br', 'br us', 'sent', 'plain ms', 'gzip ms', 'sent ms'))
+        for route, url in plan:
+            response = client.get(url)
+            data = response.get_data()
+            if response.status_code != 200:
+                print('FAIL %s: %d' % (route, response.status_code))
+                failures += 1
+                continue
+            sent = client.get(url, headers=ACCEPT['browser'])
+            compressible = compression.compressible(response.mimetype, len(data))
+            if compressible and sent.headers.get('Content-Encoding') not in (None, ENCODINGS[0]):
+                print('FAIL %s: sent as %s, not %s' % (route, sent.headers['Content-Encoding'], ENCODINGS[0]))
+                failures += 1
+            elif compressible and sent.headers.get('Content-Encoding') is None:
+                print('FAIL %s: a %s response of %d bytes went out uncompressed' % (
+                    route, response.mimetype, len(data)))
+                failures += 1
+            etag = sent.headers.get('ETag')
+            if etag:
+                revalidated = client.get(url, headers=dict(ACCEPT['browser'], **{'If-None-Match': etag}))
+                if revalidated.status_code != 304 or revalidated.headers.get('ETag') != etag:
+                    print('FAIL %s: revalidating %s answered %d with ETag %s' % (
+                        route, etag, revalidated.status_code, revalidated.headers.get('ETag')))
+                    failures += 1
+            gzipped = compression.compress(data, 'gzip')
+            gzip_us = cpu_us(lambda body: compression.compress(body, 'gzip'), data)
+            br_size = br_us = '-'
+            if 'br' in ENCODINGS:
+                br_size = len(compression.compress(data, 'br'))
+                br_us = '%.0f' % cpu_us(lambda body: compression.compress(body, 'br'), data)
+            plain_ms = median_ms(client, url, ACCEPT['identity'], args.requests)
+            gzip_ms = median_ms(client, url, ACCEPT['gzip'], args.requests)
+            sent_ms = median_ms(client, url, ACCEPT['browser'], args.requests)
+            print('%-40s %8d %8d %5.0f%% %8.0f %6s %8s %8s %9.2f %9.2f %9.2f' % (
+                route, len(data), len(gzipped), 100.0 * (len(data) - len(gzipped)) / len(data) if data else 0,
+                gzip_us, br_size, br_us, sent.headers.get('Content-Encoding', 'plain'), plain_ms, gzip_ms, sent_ms))
+        report = compression.report()
+        print('\nResponses: %(compressed)d compressed, %(reused)d reused from the page cache, '
+              '%(streamed)d streamed, %(skipped)d sent as they were' % report)
+        if report['bytes_in']:
+            print('Compressed bytes: %d in, %d out (%.0f%% saved)' % (
+                report['bytes_in'], report['bytes_out'], 100 * (1 - report['ratio'])))
+        if not report['reused']:
+            print('FAIL page cache hits did not reuse the compressed pages')
+            failures += 1
+    finally:
+        os.remove(path)
+    return 1 if failures else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,59 @@
+"""Times the venue and artist detail pages against a venue with 10k past shows.
+
+    python -m benchmarks.detail_pages
+"""
+import sys
+from datetime import datetime, timedelta
+from benchmarks.common import make_app, QueryCounter, timed
+from model import db, Show, Venue, Artist, Genre
+from queries import venue_detail, artist_detail
+
+N_SHOWS = 10000
+N_ARTISTS = 200
+
+
+def seed():
+    now = datetime.now()
+    venue = Venue(name='Busy Venue', city='San Francisco', state='CA', genres=Genre.from_names(['Jazz']))
+    artists = [Artist(name='Artist %d' % i, city='San Francisco', state='CA') for i in range(N_ARTISTS)]
+    db.session.add(venue)
+    db.session.add_all(artists)
+    db.session.flush()
+    db.session.bulk_insert_mappings(Show, [
+        {"venue_id": venue.id, "artist_id": artists[i % N_ARTISTS].id,
+         "start_time": now - timedelta(hours=i + 1), "end_time": now - timedelta(hours=i)}
+        for i in range(N_SHOWS)
+    ] + [
+        {"venue_id": venue.id, "artist_id": artists[i % N_ARTISTS].id,
+         "start_time": now + timedelta(days=i + 1)}
+        for i in range(50)
+    ])
+    db.session.commit()
+    return venue.id, artists[0].id
+
+
+def main():
+    app = make_app()
+    failed = False
+    with app.app_context():
+        db.create_all()
+        venue_id, artist_id = seed()
+        for name, fetch, entity_id in (('venue', venue_detail, venue_id), ('artist', artist_detail, artist_id)):
+            for page in (1, 10):
+                db.session.expunge_all()
+                timings = {}
+                with QueryCounter(db.engine) as counter, timed(timings, name):
+                    data = fetch(entity_id, past_page=page)
+                print('%-6s past_page=%-3d past=%-6d shown=%-3d statements=%d %.2fms' % (
+                    name, page, data['past_shows_count'], len(data['past_shows']),
+                    counter.count, timings[name] * 1000))
+                failed = failed or counter.count > 4
+    if failed:
+        print('FAIL: a detail page issued more than 4 statements')
+        return 1
+    print('OK')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,122 @@
+"""Fails if a route's queries fall back to a sequential scan of a big table.
+
+    python -m benchmarks.explain_check [--shows 1000000] [--database-uri postgresql://.../scratch_db]
+
+Seeds the given number of shows, runs the data access behind each route,
+captures every statement it sends and checks its plan: EXPLAIN on
+PostgreSQL, EXPLAIN QUERY PLAN on SQLite.
+"""
+import argparse
+import random
+import re
+import sys
+from datetime import datetime, timedelta
+from benchmarks.common import make_app, reset_schema, QueryCounter
+from model import db, Show, Venue, Artist, Genre, venue_genres, refresh_show_counters, roll_over_shows
+from queries import venue_areas, artist_list, venue_detail, artist_detail, browse_genre, ShowFeed, \
+    entity_version, listing_version, feed_version, calendar_days, calendar_counts, show_conflicts
+
+# Tables large enough that a full scan on a request path is a bug.
+BIG_TABLES = ('show', 'venue_genres', 'artist_genres')
+SEQ_SCAN = {
+    'postgresql': re.compile(r'Seq Scan on (%s)\b' % '|'.join(BIG_TABLES)),
+    'sqlite': re.compile(r'^SCAN (%s)\b(?!.*\bINDEX\b)' % '|'.join(BIG_TABLES)),
+}
+STATES = ('CA', 'NY', 'TX', 'WA', 'IL', 'TN', 'LA', 'MA')
+GENRES = ('Jazz', 'Blues', 'Folk', 'Rock n Roll', 'Hip-Hop', 'Classical', 'Reggae', 'Soul')
+
+
+def seed(n_shows, chunk=50000):
+    rnd = random.Random(6)
+    n_venues, n_artists = max(n_shows // 200, 10), max(n_shows // 50, 10)
+    genres = Genre.from_names(GENRES)
+    db.session.flush()
+    db.session.bulk_insert_mappings(Venue, [
+        {"id": i, "name": 'Venue %d' % i, "city": 'City %d' % (i % 40), "state": rnd.choice(STATES)}
+        for i in range(1, n_venues + 1)
+    ])
+    db.session.bulk_insert_mappings(Artist, [
+        {"id": i, "name": 'Artist %d' % i, "state": rnd.choice(STATES)} for i in range(1, n_artists + 1)
+    ])
+    db.session.execute(venue_genres.insert(), [
+        {"venue_id": i, "genre_id": genre.id}
+        for i in range(1, n_venues + 1) for genre in rnd.sample(genres, 2)
+    ])
+    # Five years of history and six months ahead: roughly 10% upcoming.
+    # One-minute shows in distinct minutes, so nobody is double-booked.
+    now = datetime.now()
+    minutes = rnd.sample(range(-5 * 365 * 24 * 60, 183 * 24 * 60), n_shows)
+    for start in range(0, n_shows, chunk):
+        db.session.execute(Show.__table__.insert(), [
+            {"venue_id": rnd.randint(1, n_venues), "artist_id": rnd.randint(1, n_artists),
+             "start_time": now + timedelta(minutes=minute), "end_time": now + timedelta(minutes=minute + 1)}
+            for minute in minutes[start:start + chunk]
+        ])
+    for model in (Venue, Artist):
+        refresh_show_counters(db.session.connection(), model, now=now)
+    db.session.commit()
+    db.session.execute('ANALYZE')
+    db.session.commit()
+    return n_venues, n_artists
+
+
+def explain(statement, parameters):
+    connection = db.session.connection()
+    if db.engine.dialect.name == 'postgresql':
+        return [row[0] for row in connection.execute('EXPLAIN ' + statement, parameters)]
+    return [row[-1] for row in connection.execute('EXPLAIN QUERY PLAN ' + statement, parameters)]
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--database-uri', default='sqlite://')
+    parser.add_argument('--shows', type=int, default=1000000)
+    args = parser.parse_args()
+
+    app = make_app(args.database_uri)
+    with app.app_context():
+        reset_schema()
+        n_venues, n_artists = seed(args.shows)
+        middle = datetime.now() - timedelta(days=2 * 365)
+        routes = (
+            ('/venues', lambda: venue_areas()),
+            ('/venues?upcoming=1&sort=next_show', lambda: venue_areas(upcoming_only=True, sort='next_show')),
+            ('/artists?upcoming=1&sort=next_show', lambda: artist_list(upcoming_only=True, sort='next_show')),
+            ('ETag /venues', lambda: listing_version(Venue)),
+            ('ETag /venues/<id>', lambda: entity_version(Venue, n_venues // 2)),
+            ('ETag /shows', lambda: feed_version()),
+            ('/venues/<id>', lambda: venue_detail(n_venues // 2)),
+            ('/venues/<id>?past_page=20', lambda: venue_detail(n_venues // 2, past_page=20)),
+            ('/artists/<id>', lambda: artist_detail(n_artists // 2)),
+            ('/shows', lambda: list(ShowFeed())),
+            ('/shows?after=<cursor>', lambda: list(ShowFeed(after=(middle, 0)))),
+            ('/calendar?month=<month>', lambda: calendar_counts(middle, middle + timedelta(days=31))),
+            ('/calendar?month=<month>&city=<city>', lambda: calendar_counts(
+                middle, middle + timedelta(days=31), city='City 7', state='CA')),
+            ('/calendar.json?genre=<genre>', lambda: calendar_days(middle, middle + timedelta(days=7), genre='Jazz')),
+            ('/venues/genres/<genre>?state=<state>', lambda: browse_genre(Venue, 'Jazz', state='CA')),
+            ('POST /shows/create', lambda: show_conflicts(
+                n_artists // 2, n_venues // 2, middle, middle + timedelta(hours=2))),
+            ('flask fyyur rollover', lambda: roll_over_shows(db.session.connection(), now=middle)),
+        )
+        seq_scan = SEQ_SCAN[db.engine.dialect.name]
+        failures = 0
+        for route, fetch in routes:
+            with QueryCounter(db.engine) as counter:
+                fetch()
+            for statement, parameters in counter.executed:
+                plan = explain(statement, parameters)
+                bad = [line for line in plan if seq_scan.search(line.strip())]
+                print('%-4s %-40s %s' % ('FAIL' if bad else 'ok', route, ' '.join(statement.split())[:70]))
+                if bad:
+                    failures += 1
+                    print('\n'.join('        ' + line for line in plan))
+            db.session.remove()
+    if failures:
+        print('%d statement(s) scan a big table sequentially' % failures)
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,129 @@
+"""Times building, rendering and validating the venue and artist forms.
+
+    python -m benchmarks.form_render [--iterations 2000]
+
+Compares the forms as they were (choices copied into each field as lists,
+every <option> rendered per request, membership checked by scanning the
+list, edit forms filled one attribute at a time) with the shared Choices
+tables, cached option lists and obj= population. Fails if the two render
+the state and genre selects of a filled form differently. No database is
+needed.
+"""
+import argparse
+import os
+import sys
+import tempfile
+import timeit
+
+# config.py reads these when create_app() loads it.
+_handle, DATABASE_PATH = tempfile.mkstemp(suffix='.db')
+os.close(_handle)
+os.environ['DATABASE_URL'] = 'sqlite:///' + DATABASE_PATH
+os.environ['TEMPLATE_PRECOMPILE'] = '0'
+
+from flask import render_template  # noqa: E402
+from werkzeug.datastructures import MultiDict  # noqa: E402
+from wtforms import SelectField, SelectMultipleField  # noqa: E402
+from wtforms.validators import DataRequired  # noqa: E402
+from app import create_app  # noqa: E402
+from forms import VenueForm, ArtistForm, STATE_CHOICES, GENRE_CHOICES  # noqa: E402
+from model import Venue, Artist, Genre  # noqa: E402
+
+app = create_app()
+
+
+class LegacyVenueForm(VenueForm):
+    state = SelectField('state', validators=[DataRequired()], choices=list(STATE_CHOICES))
+    genres = SelectMultipleField('genres', validators=[DataRequired()], choices=list(GENRE_CHOICES))
+    seeking_talent = SelectField('seeking_talent', validators=[DataRequired()], choices=[(True, 'yes'), (False, 'no')])
+
+
+class LegacyArtistForm(ArtistForm):
+    state = SelectField('state', validators=[DataRequired()], choices=list(STATE_CHOICES))
+    genres = SelectMultipleField('genres', validators=[DataRequired()], choices=list(GENRE_CHOICES))
+    seeking_venue = SelectField('seeking_venue', validators=[DataRequired()], choices=[(True, 'yes'), (False, 'no')])
+
+
+def legacy_fill(form, obj):
+    # As edit_venue and edit_artist did.
+    for name in form._fields:
+        if name == 'genres':
+            form.genres.data = [genre.name for genre in obj.genres]
+        elif name != 'csrf_token':
+            getattr(form, name).data = getattr(obj, name)
+    return form
+
+
+def sample(model):
+    obj = model(id=1, name='The Blue Room', city='San Francisco', state='CA', phone='415-555-0100',
+                image_link='https://example.com/image.jpg', facebook_link='https://www.facebook.com/blue',
+                website='https://blue.example.com', seeking_description='Jazz trios')
+    obj.genres = [Genre(name='Jazz'), Genre(name='Blues'), Genre(name='Soul')]
+    if model is Venue:
+        obj.address = '1 Market St'
+        obj.seeking_talent = True
+    else:
+        obj.seeking_venue = True
+    return obj
+
+
+def submission(obj):
+    data = MultiDict((name, getattr(obj, name)) for name in (
+        'name', 'city', 'state', 'phone', 'image_link', 'facebook_link', 'website', 'seeking_description'))
+    if isinstance(obj, Venue):
+        data['address'] = obj.address
+        data['seeking_talent'] = 'True'
+    else:
+        data['seeking_venue'] = 'True'
+    data.setlist('genres', [genre.name for genre in obj.genres])
+    return data
+
+
+def render_fields(form):
+    return ''.join(str(field(class_='form-control')) for field in form if field.name != 'csrf_token')
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--iterations', type=int, default=2000)
+    args = parser.parse_args(argv)
+    n = args.iterations
+
+    failures = 0
+    cases = (
+        ('venue', Venue, LegacyVenueForm, VenueForm, 'forms/edit_venue.html'),
+        ('artist', Artist, LegacyArtistForm, ArtistForm, 'forms/edit_artist.html'),
+    )
+    print('%-8s %-16s %10s %10s %8s' % ('form', 'step', 'old us', 'new us', 'speedup'))
+    try:
+        with app.test_request_context('/'):
+            for name, model, legacy, current, template in cases:
+                obj, data = sample(model), submission(sample(model))
+                old_form, new_form = legacy_fill(legacy(), obj), current(obj=obj)
+                for field in ('state', 'genres'):
+                    if str(old_form[field]()) != str(new_form[field]()):
+                        print('FAIL %s: %s renders differently' % (name, field))
+                        failures += 1
+                if not current(formdata=data, meta={'csrf': False}).validate():
+                    print('FAIL %s: a valid submission was rejected' % name)
+                    failures += 1
+                steps = (
+                    ('fill from obj', lambda: legacy_fill(legacy(), obj), lambda: current(obj=obj)),
+                    ('render fields', lambda: render_fields(legacy_fill(legacy(), obj)),
+                     lambda: render_fields(current(obj=obj))),
+                    ('render page', lambda: render_template(template, form=legacy_fill(legacy(), obj), **{name: obj}),
+                     lambda: render_template(template, form=current(obj=obj), **{name: obj})),
+                    ('validate', lambda: legacy(formdata=data, meta={'csrf': False}).validate(),
+                     lambda: current(formdata=data, meta={'csrf': False}).validate()),
+                )
+                for step, old, new in steps:
+                    old_us = min(timeit.repeat(old, number=n, repeat=3)) / n * 1e6
+                    new_us = min(timeit.repeat(new, number=n, repeat=3)) / n * 1e6
+                    print('%-8s %-16s %10.1f %10.1f %7.1fx' % (name, step, old_us, new_us, old_us / new_us))
+    finally:
+        os.remove(DATABASE_PATH)
+    return 1 if failures else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,279 @@
+"""Drives every route of the app over a seeded database and reports
+throughput, latency percentiles and query counts per route.
+
+    python -m benchmarks.load_test [--shows 1k] [--seed 0] [--clients 1] [--requests 50]
+                                   [--database-uri postgresql://.../scratch_db] [--replica-uri ...]
+                                   [--baseline benchmarks/load_baseline.json [--write-baseline]]
+                                   [--fail-on-latency [--tolerance 2.0]]
+
+Seeds a dataset with dataset.generate() (into a throwaway SQLite file by
+default; a PostgreSQL database is wiped first, so only point it at a scratch
+one), then sends --requests requests to each route from --clients threads
+through the test client, writes included. With --replica-uri, GET requests
+read from that replica (a SQLite replica is copied from the primary after
+seeding). Every URL rule of the app must
+have a scenario here, so a new route fails the run until it gets one.
+Queries per request come from the profiler's Server-Timing header; the
+page cache stays on, as in production, and its hit rate is reported.
+
+With --baseline, the results are compared to a stored run: a route fails if
+it errors or sends more queries than before. A p95 latency grown past
+--tolerance times the baseline's (plus a few milliseconds for noise) is only
+reported, since the stored run may come from another machine; with
+--fail-on-latency, for a baseline recorded on this one, it fails too.
+--write-baseline stores this run instead.
+"""
+import argparse
+import itertools
+import json
+import os
+import re
+import sys
+import tempfile
+import threading
+import time
+from datetime import date, datetime, timedelta
+
+LATENCY_SLACK_MS = 5.0
+_QUERIES = re.compile(r'desc="(\d+) queries"')
+
+
+def scenarios(counts, anchor, bundles):
+    """(route, method, url(i), form data(i) or None) for every route;
+    bundles is the asset manifest."""
+    from dataset import GENRES, WORDS, CITIES
+
+    n_venues, n_artists = counts['venues'], counts['artists']
+
+    def venue(i):
+        return 1 + (i * 7919) % n_venues
+
+    def artist(i):
+        return 1 + (i * 7919) % n_artists
+
+    def genre(i):
+        return GENRES[i % 6]
+
+    def entity_form(i, kind):
+        city, state = CITIES[i % len(CITIES)]
+        data = {
+            'name': 'Load %s %d' % (kind, i), 'city': city, 'state': state, 'phone': '415-555-%04d' % i,
+            'genres': [genre(i), genre(i + 1)], 'image_link': 'https://images.example.com/load.jpg',
+            'facebook_link': 'https://www.facebook.com/load', 'website': 'https://load.example.com',
+            'seeking_description': 'Load test.',
+        }
+        if kind == 'venue':
+            data.update(address='1 Load St', seeking_talent='True')
+        else:
+            data.update(seeking_venue='False')
+        return data
+
+    def show_form(i):
+        # Past the seeded shows and three hours apart: never double-booked.
+        start = anchor + timedelta(days=400, hours=3 * i)
+        return {'artist_id': str(artist(i)), 'venue_id': str(venue(i)),
+                'start_time': start.strftime('%Y-%m-%d %H:%M:%S')}
+
+    month = anchor.strftime('%Y-%m')
+    return (
+        ('GET /', 'GET', lambda i: '/', None),
+        ('GET /venues', 'GET', lambda i: '/venues' if i % 2 else '/venues?upcoming=1&sort=next_show', None),
+        ('GET /venues/search', 'GET', lambda i: '/venues/search?search_term=' + WORDS[i % len(WORDS)], None),
+        ('POST /venues/search', 'POST', lambda i: '/venues/search', lambda i: {'search_term': WORDS[i % len(WORDS)]}),
+        ('GET /venues/genres/<genre>', 'GET', lambda i: '/venues/genres/' + genre(i), None),
+        ('GET /venues/<int:venue_id>', 'GET', lambda i: '/venues/%d' % venue(i), None),
+        ('GET /venues/<int:venue_id>/edit', 'GET', lambda i: '/venues/%d/edit' % venue(i), None),
+        ('POST /venues/<int:venue_id>/edit', 'POST', lambda i: '/venues/%d/edit' % venue(i),
+         lambda i: entity_form(i, 'venue')),
+        ('GET /venues/create', 'GET', lambda i: '/venues/create', None),
+        ('POST /venues/create', 'POST', lambda i: '/venues/create', lambda i: entity_form(i, 'venue')),
+        # The venues the create scenario added.
+        ('DELETE /venues/<int:venue_id>', 'DELETE', lambda i: '/venues/%d' % (n_venues + 1 + i), None),
+        ('GET /artists', 'GET', lambda i: '/artists' if i % 2 else '/artists?upcoming=1&sort=next_show', None),
+        ('GET /artists/search', 'GET', lambda i: '/artists/search?search_term=' + WORDS[i % len(WORDS)], None),
+        ('POST /artists/search', 'POST', lambda i: '/artists/search',
+         lambda i: {'search_term': WORDS[i % len(WORDS)]}),
+        ('GET /artists/genres/<genre>', 'GET', lambda i: '/artists/genres/' + genre(i), None),
+        ('GET /artists/<int:artist_id>', 'GET', lambda i: '/artists/%d' % artist(i), None),
+        ('GET /artists/<int:artist_id>/edit', 'GET', lambda i: '/artists/%d/edit' % artist(i), None),
+        ('POST /artists/<int:artist_id>/edit', 'POST', lambda i: '/artists/%d/edit' % artist(i),
+         lambda i: entity_form(i, 'artist')),
+        ('GET /artists/create', 'GET', lambda i: '/artists/create', None),
+        ('POST /artists/create', 'POST', lambda i: '/artists/create', lambda i: entity_form(i, 'artist')),
+        # The artists the create scenario added.
+        ('DELETE /artists/<int:artist_id>', 'DELETE', lambda i: '/artists/%d' % (n_artists + 1 + i), None),
+        ('GET /shows', 'GET', lambda i: '/shows', None),
+        ('GET /shows/create', 'GET', lambda i: '/shows/create', None),
+        ('POST /shows/create', 'POST', lambda i: '/shows/create', show_form),
+        ('GET /calendar', 'GET', lambda i: '/calendar?month=%s&day=%s' % (
+            month, (anchor + timedelta(days=i % 28)).strftime('%Y-%m-%d')), None),
+        ('GET /calendar.<any(json, ics):format>', 'GET', lambda i: '/calendar.%s?start=%s' % (
+            ('json', 'ics')[i % 2], (anchor + timedelta(days=i % 28)).strftime('%Y-%m-%d')), None),
+        ('GET /api/v1/venues', 'GET', lambda i: '/api/v1/venues?after=%d' % venue(i), None),
+        ('GET /api/v1/artists', 'GET', lambda i: '/api/v1/artists?ids=%d,%d' % (artist(i), artist(i + 1)), None),
+        ('GET /api/v1/shows', 'GET', lambda i: '/api/v1/shows', None),
+        ('GET /cache/stats', 'GET', lambda i: '/cache/stats', None),
+        ('GET /db/stats', 'GET', lambda i: '/db/stats', None),
+        ('GET /static/dist/<path:filename>', 'GET',
+         lambda i: '/static/dist/' + sorted(bundles.values())[i % len(bundles)], None),
+    )
+
+
+def routes_of(app):
+    return {
+        '%s %s' % (method, rule.rule)
+        for rule in app.url_map.iter_rules() if rule.endpoint != 'static'
+        for method in rule.methods - {'HEAD', 'OPTIONS'}
+    }
+
+
+def run_scenario(app, method, url, data, requests, clients):
+    """Sends requests requests from clients threads; returns the stats."""
+    counter = itertools.count()
+    lock = threading.Lock()
+    latencies, queries, statuses, hits = [], [], [], []
+
+    def client():
+        test_client = app.test_client()
+        while True:
+            i = next(counter)
+            if i >= requests:
+                return
+            start = time.perf_counter()
+            response = test_client.open(url(i), method=method, data=data(i) if data else None)
+            elapsed = time.perf_counter() - start
+            timing = _QUERIES.search(', '.join(response.headers.get_all('Server-Timing')))
+            with lock:
+                latencies.append(elapsed)
+                statuses.append(response.status_code)
+                queries.append(int(timing.group(1)) if timing else 0)
+                hits.append(response.headers.get('X-Cache') == 'HIT')
+
+    threads = [threading.Thread(target=client) for _ in range(clients)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+
+    from benchmarks.common import percentile
+    return {
+        'requests': len(latencies),
+        'errors': sum(1 for status in statuses if status >= 400),
+        'rps': round(len(latencies) / elapsed, 1),
+        'p50_ms': round(percentile(latencies, 0.5) * 1000, 2),
+        'p95_ms': round(percentile(latencies, 0.95) * 1000, 2),
+        'p99_ms': round(percentile(latencies, 0.99) * 1000, 2),
+        'queries': max(queries),
+        'cache_hits': round(sum(hits) / len(hits), 2),
+    }
+
+
+def compare(results, baseline, tolerance):
+    """Regressions of results against a stored run, as messages: errors and
+    query counts, then p95 latencies."""
+    problems, slower = [], []
+    for route, current in results.items():
+        previous = baseline['routes'].get(route)
+        if current['errors']:
+            problems.append('%s: %d errors' % (route, current['errors']))
+        if previous is None:
+            continue
+        if current['queries'] > previous['queries']:
+            problems.append('%s: %d queries per request, was %d' % (route, current['queries'], previous['queries']))
+        if current['p95_ms'] > previous['p95_ms'] * tolerance + LATENCY_SLACK_MS:
+            slower.append('%s: p95 %.1fms, was %.1fms' % (route, current['p95_ms'], previous['p95_ms']))
+    return problems, slower
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--database-uri')
+    parser.add_argument('--replica-uri', help='Read replica, e.g. a second SQLite file.')
+    parser.add_argument('--shows', default='1k', help='Dataset size, e.g. 1000, 100k or 1M.')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--clients', type=int, default=1)
+    parser.add_argument('--requests', type=int, default=50, help='Requests per route.')
+    parser.add_argument('--baseline', help='JSON file of a previous run to compare with.')
+    parser.add_argument('--write-baseline', action='store_true', help='Store this run as --baseline.')
+    parser.add_argument('--tolerance', type=float, default=2.0, help='Allowed p95 growth over the baseline.')
+    parser.add_argument('--fail-on-latency', action='store_true',
+                        help='Fail on p95 growth too; only for a baseline recorded on this machine.')
+    args = parser.parse_args(argv)
+
+    path = None
+    database_uri = args.database_uri
+    if database_uri is None:
+        handle, path = tempfile.mkstemp(suffix='.db')
+        os.close(handle)
+        database_uri = 'sqlite:///' + path
+    # config.py reads these when create_app() loads it: production settings,
+    # without the request log.
+    os.environ.update(DATABASE_URL=database_uri, DEBUG='0', LOG_FILE='', DB_REPLICA_URL=args.replica_uri or '')
+
+    from app import create_app
+    from assets import build
+    from benchmarks.common import reset_schema
+    from dataset import generate, parse_count
+    from model import db
+    from replicas import REPLICA_BIND, sync_sqlite_replica
+
+    # The migrations build the PostgreSQL schema.
+    app = create_app(WTF_CSRF_ENABLED=False, STATS_ENDPOINTS=True, DB_MIGRATIONS=True)
+    anchor = datetime.combine(date.today(), datetime.min.time())
+    try:
+        with app.app_context():
+            reset_schema()
+            seeding_start = time.perf_counter()
+            counts = generate(parse_count(args.shows), seed=args.seed, anchor=anchor)
+            print('Seeded %(venues)d venues, %(artists)d artists and %(shows)d shows' % counts,
+                  'in %.1fs' % (time.perf_counter() - seeding_start))
+            db.session.remove()
+            if args.replica_uri and args.replica_uri.startswith('sqlite'):
+                sync_sqlite_replica(db.engine, db.get_engine(app, bind=REPLICA_BIND))
+
+        plan = scenarios(counts, anchor, build(app.static_folder))
+        missing = routes_of(app) - {route for route, _, _, _ in plan}
+        results = {}
+        print('%-40s %5s %4s %8s %7s %7s %7s %7s %5s' % (
+            'route', 'reqs', 'err', 'req/s', 'p50 ms', 'p95 ms', 'p99 ms', 'queries', 'hits'))
+        for route, method, url, data in plan:
+            result = results[route] = run_scenario(app, method, url, data, args.requests, args.clients)
+            print('%-40s %5d %4d %8.1f %7.2f %7.2f %7.2f %7d %4.0f%%' % (
+                route, result['requests'], result['errors'], result['rps'], result['p50_ms'],
+                result['p95_ms'], result['p99_ms'], result['queries'], result['cache_hits'] * 100))
+    finally:
+        if path:
+            os.remove(path)
+
+    problems = ['%s: no scenario in benchmarks/load_test.py' % route for route in sorted(missing)]
+    config = {'shows': args.shows, 'seed': args.seed, 'clients': args.clients, 'requests': args.requests,
+              'dialect': database_uri.split(':', 1)[0], 'replica': bool(args.replica_uri)}
+    if args.baseline and args.write_baseline:
+        with open(args.baseline, 'w') as stream:
+            json.dump({'config': config, 'routes': results}, stream, indent=2, sort_keys=True)
+            stream.write('\n')
+        print('Wrote %s' % args.baseline)
+    elif args.baseline:
+        with open(args.baseline) as stream:
+            baseline = json.load(stream)
+        if baseline['config'] != config:
+            print('Note: the baseline was run with %s' % baseline['config'])
+        regressions, slower = compare(results, baseline, args.tolerance)
+        problems.extend(regressions)
+        if args.fail_on_latency:
+            problems.extend(slower)
+        else:
+            for message in slower:
+                print('SLOWER ' + message)
+    else:
+        problems.extend('%s: %d errors' % (route, result['errors']) for route, result in results.items()
+                        if result['errors'])
+    for problem in problems:
+        print('FAIL ' + problem)
+    return 1 if problems else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,143 @@
+"""Compares throughput of the default and a tuned connection pool under load.
+
+    python -m benchmarks.pool_load [--clients 200] [--requests 20] [--database-uri postgresql://.../scratch_db]
+
+Each client thread runs the /venues listing query plus a statement standing
+in for the rest of a page's database time (--db-time-ms; pg_sleep on
+PostgreSQL, a sleeping SQL function on SQLite) per request, with a fresh
+session each time as a request would. It prints throughput, latency
+percentiles and the pool metrics for SQLAlchemy's default QueuePool sizing
+and for the one given by --pool-size/--max-overflow.
+"""
+import argparse
+import itertools
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime, timedelta
+from sqlalchemy import event, exc
+from benchmarks.common import make_app, reset_schema, percentile
+from model import db, Show, Venue, Artist
+from pool_metrics import InstrumentedQueuePool
+from queries import venue_areas
+
+# SQLAlchemy's QueuePool defaults.
+DEFAULT_POOL = {'pool_size': 5, 'max_overflow': 10, 'pool_timeout': 30}
+
+
+def seed(n_venues=20, shows_per_venue=5):
+    rnd = random.Random(10)
+    now = datetime.now()
+    artist = Artist(name='Artist')
+    db.session.add(artist)
+    db.session.flush()
+    db.session.bulk_insert_mappings(Venue, [
+        {"id": i, "name": 'Venue %d' % i, "city": 'City %d' % (i % 20), "state": 'CA'}
+        for i in range(1, n_venues + 1)
+    ])
+    # The one artist plays one-hour shows in distinct hours.
+    hours = iter(rnd.sample(range(-30 * 24, 30 * 24), n_venues * shows_per_venue))
+    db.session.bulk_insert_mappings(Show, [
+        {"venue_id": i, "artist_id": artist.id, "start_time": now + timedelta(hours=hour),
+         "end_time": now + timedelta(hours=hour + 1)}
+        for i in range(1, n_venues + 1) for hour in itertools.islice(hours, shows_per_venue)
+    ])
+    db.session.commit()
+
+
+def run(database_uri, pool, clients, requests, db_time_ms):
+    options = dict(pool, poolclass=InstrumentedQueuePool)
+    if database_uri.startswith('sqlite'):
+        options['connect_args'] = {'check_same_thread': False}
+    app = make_app(database_uri, SQLALCHEMY_ENGINE_OPTIONS=options)
+    with app.app_context():
+        if db.engine.dialect.name == 'postgresql':
+            pause = 'SELECT pg_sleep(:ms / 1000.0)'
+        else:
+            @event.listens_for(db.engine, 'connect')
+            def add_sleep(dbapi_connection, record):
+                dbapi_connection.create_function('sleep_ms', 1, lambda ms: time.sleep(ms / 1000.0) or 0)
+            pause = 'SELECT sleep_ms(:ms)'
+        reset_schema()
+        seed()
+        db.session.remove()
+        db.engine.dispose()  # Start every run from an empty pool.
+        metrics = db.engine.pool.metrics
+
+    latencies = []
+    errors = []
+    lock = threading.Lock()
+    barrier = threading.Barrier(clients + 1)
+
+    def client():
+        with app.app_context():
+            barrier.wait()
+            for _ in range(requests):
+                start = time.perf_counter()
+                try:
+                    venue_areas()
+                    db.session.execute(pause, {'ms': db_time_ms})
+                except exc.TimeoutError as error:
+                    with lock:
+                        errors.append(error)
+                finally:
+                    db.session.remove()
+                with lock:
+                    latencies.append(time.perf_counter() - start)
+
+    threads = [threading.Thread(target=client) for _ in range(clients)]
+    for thread in threads:
+        thread.start()
+    barrier.wait()
+    start = time.perf_counter()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+
+    with app.app_context():
+        db.engine.dispose()
+    report = metrics.report()
+    print('pool_size=%-3d max_overflow=%-3d  %7.1f req/s  p50=%.0fms p95=%.0fms p99=%.0fms  timeouts=%d' % (
+        pool['pool_size'], pool['max_overflow'], (len(latencies) - len(errors)) / elapsed,
+        percentile(latencies, 0.5) * 1000, percentile(latencies, 0.95) * 1000, percentile(latencies, 0.99) * 1000,
+        len(errors)))
+    print('    checkout wait avg=%.1fms max=%.1fms  peak checked out=%d/%s  saturated checkouts=%d  '
+          'connects=%d closes=%d' % (
+              report['wait_avg_ms'], report['wait_max_ms'], report['peak_checked_out'], report['capacity'],
+              report['saturated_checkouts'], report['connects'], report['closes']))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--database-uri')
+    parser.add_argument('--clients', type=int, default=200)
+    parser.add_argument('--requests', type=int, default=20)
+    parser.add_argument('--db-time-ms', type=int, default=20)
+    parser.add_argument('--pool-size', type=int, default=40)
+    parser.add_argument('--max-overflow', type=int, default=40)
+    parser.add_argument('--pool-timeout', type=int, default=10)
+    args = parser.parse_args()
+
+    path = None
+    database_uri = args.database_uri
+    if database_uri is None:
+        # In-memory SQLite gives every connection its own database.
+        handle, path = tempfile.mkstemp(suffix='.db')
+        os.close(handle)
+        database_uri = 'sqlite:///' + path
+    tuned = {'pool_size': args.pool_size, 'max_overflow': args.max_overflow, 'pool_timeout': args.pool_timeout}
+    print('%d clients x %d requests, %dms of database time each' % (args.clients, args.requests, args.db_time_ms))
+    try:
+        for pool in (DEFAULT_POOL, tuned):
+            run(database_uri, pool, args.clients, args.requests, args.db_time_ms)
+    finally:
+        if path:
+            os.remove(path)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
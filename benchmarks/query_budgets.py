@@ -0,0 +1,93 @@
+"""Fails if a GET route goes over its query budget or repeats a statement.
+
+    python -m benchmarks.query_budgets
+
+Builds the app against a throwaway SQLite database with
+SQL_PROFILER_ENFORCE_BUDGETS on, seeds venues and artists with many shows
+each, so lazy loads inside loops show up, and requests every parameterless
+GET route plus the detail and edit pages. A route over its @query_budget
+raises QueryBudgetExceeded; statements repeated more than
+SQL_PROFILER_N_PLUS_ONE times are reported as N+1 loads.
+"""
+import logging
+import os
+import sys
+import tempfile
+from datetime import datetime, timedelta
+
+# config.py reads these when create_app() loads it.
+_handle, DATABASE_PATH = tempfile.mkstemp(suffix='.db')
+os.close(_handle)
+os.environ['DATABASE_URL'] = 'sqlite:///' + DATABASE_PATH
+os.environ['SQL_PROFILER_ENFORCE_BUDGETS'] = '1'
+
+from app import create_app  # noqa: E402
+from model import db, Show, Venue, Artist, Genre  # noqa: E402
+from profiler import QueryBudgetExceeded  # noqa: E402
+
+
+def seed(n_venues=5, n_artists=5, shows_each=30):
+    now = datetime.now()
+    genres = Genre.from_names(['Jazz', 'Blues', 'Folk'])
+    venues = [Venue(name='Venue %d' % i, city='City', state='CA', genres=genres) for i in range(n_venues)]
+    artists = [Artist(name='Artist %d' % i, city='City', state='CA', genres=genres) for i in range(n_artists)]
+    db.session.add_all(venues + artists)
+    db.session.flush()
+    db.session.add_all([
+        Show(venue_id=venue.id, artist_id=artists[n % n_artists].id,
+             start_time=now + timedelta(days=n - shows_each // 2, hours=3 * v))
+        for v, venue in enumerate(venues) for n in range(shows_each)
+    ])
+    db.session.commit()
+    return venues[0].id, artists[0].id
+
+
+class _Flagged(logging.Handler):
+    def __init__(self):
+        logging.Handler.__init__(self, logging.WARNING)
+        self.records = []
+
+    def emit(self, record):
+        if getattr(record, 'n_plus_one', None):
+            self.records.append(record)
+
+
+def main():
+    app = create_app(TESTING=True)
+    flagged = _Flagged()
+    logging.getLogger('fyyur.sql').addHandler(flagged)
+    try:
+        with app.app_context():
+            db.create_all()
+            venue_id, artist_id = seed()
+        urls = sorted(
+            rule.rule for rule in app.url_map.iter_rules()
+            if 'GET' in rule.methods and not rule.arguments and rule.endpoint != 'static'
+        ) + [
+            '/venues/%d' % venue_id, '/venues/%d?past_page=2' % venue_id, '/venues/%d/edit' % venue_id,
+            '/artists/%d' % artist_id, '/artists/%d/edit' % artist_id,
+            '/venues/genres/Jazz', '/artists/genres/Jazz',
+        ]
+        client = app.test_client()
+        failures = 0
+        for url in urls:
+            flagged.records = []
+            try:
+                response = client.get(url)
+            except QueryBudgetExceeded as error:
+                print('FAIL %-32s %s' % (url, error))
+                failures += 1
+                continue
+            timing = response.headers.get('Server-Timing', '')
+            if flagged.records:
+                failures += 1
+                print('FAIL %-32s N+1: %s' % (url, flagged.records[0].n_plus_one[0]['statement'][:80]))
+            else:
+                print('ok   %-32s %s %s' % (url, response.status_code, timing))
+    finally:
+        os.remove(DATABASE_PATH)
+    return 1 if failures else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
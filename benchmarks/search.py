@@ -0,0 +1,81 @@
+"""Compares search latency against the old ilike('%%term%%') scan at 100k rows.
+
+    python -m benchmarks.search [--database-uri postgresql://.../scratch_db]
+
+On SQLite this measures the in-memory inverted index; on PostgreSQL the
+GIN-indexed search_vector column created by the migrations.
+"""
+import argparse
+import random
+import sys
+from benchmarks.common import make_app, reset_schema, timed
+from model import db, Venue, Genre, venue_genres
+from search import search, invalidate_index, MemoryIndexes
+
+N_VENUES = 100000
+TERMS = ('jazz', 'blue moon', 'san fran', 'tavern', 'zzz')
+WORDS = ('Blue', 'Moon', 'Tavern', 'Hall', 'Room', 'Club', 'Park', 'Lounge', 'Garden', 'Cellar',
+         'House', 'Theatre', 'Bar', 'Stage', 'Den', 'Loft', 'Barn', 'Vault', 'Cafe', 'Dock')
+CITIES = (('San Francisco', 'CA'), ('New York', 'NY'), ('Austin', 'TX'), ('Seattle', 'WA'), ('Nashville', 'TN'))
+GENRES = ('Jazz', 'Blues', 'Folk', 'Rock n Roll', 'Hip-Hop', 'Classical', 'Reggae', 'Soul')
+
+
+def seed():
+    rnd = random.Random(4)
+    genres = Genre.from_names(GENRES)
+    db.session.add_all(genres)
+    db.session.flush()
+    venues, links = [], []
+    for i in range(1, N_VENUES + 1):
+        city, state = rnd.choice(CITIES)
+        venues.append({
+            "id": i,
+            "name": 'The %s %s %d' % (rnd.choice(WORDS), rnd.choice(WORDS), i),
+            "city": city,
+            "state": state,
+        })
+        links.extend({"venue_id": i, "genre_id": genre.id} for genre in rnd.sample(genres, 2))
+    for start in range(0, N_VENUES, 10000):
+        db.session.bulk_insert_mappings(Venue, venues[start:start + 10000])
+    db.session.execute(venue_genres.insert(), links)
+    db.session.commit()
+    invalidate_index()
+
+
+def ilike_search(term):
+    # The search_venues query this replaces, double-wrapped '%' included.
+    search_term = "%{}%".format(term)
+    return Venue.query.filter(Venue.name.ilike(f'%{search_term}%')).all()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--database-uri', default='sqlite://')
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    app = make_app(args.database_uri)
+    MemoryIndexes(app)
+    with app.app_context():
+        reset_schema()
+        seed()
+        timings = {}
+        with timed(timings, 'warmup'):
+            search(Venue, 'warmup')
+        print('%s, %d venues, first search (builds any in-memory index): %.1fms' % (
+            db.engine.dialect.name, N_VENUES, timings['warmup'] * 1000))
+        print('%-12s %12s %12s %10s' % ('term', 'ilike ms', 'search ms', 'matches'))
+        for term in TERMS:
+            for name, run in (('ilike', ilike_search), ('search', lambda t: search(Venue, t))):
+                with timed(timings, name):
+                    for _ in range(args.repeat):
+                        result = run(term)
+                db.session.remove()
+            print('%-12s %12.2f %12.2f %10d' % (
+                term, timings['ilike'] * 1000 / args.repeat, timings['search'] * 1000 / args.repeat,
+                result['count']))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
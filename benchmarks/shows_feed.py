@@ -0,0 +1,51 @@
+"""Measures statements and peak memory for one page of the /shows feed.
+
+    python -m benchmarks.shows_feed
+"""
+import sys
+import tracemalloc
+from datetime import datetime, timedelta
+from benchmarks.common import make_app, QueryCounter, timed
+from model import db, Show, Venue, Artist
+from queries import ShowFeed
+
+SIZES = (1000, 10000, 100000)
+
+
+def seed(n_shows):
+    start = datetime(2021, 1, 1)
+    venue = Venue(name='Venue', city='San Francisco', state='CA')
+    artist = Artist(name='Artist', image_link='https://example.com/artist.jpg')
+    db.session.add_all([venue, artist])
+    db.session.flush()
+    db.session.bulk_insert_mappings(Show, [
+        {"venue_id": venue.id, "artist_id": artist.id, "start_time": start + timedelta(minutes=i),
+         "end_time": start + timedelta(minutes=i + 1)}
+        for i in range(n_shows)
+    ])
+    db.session.commit()
+
+
+def main():
+    app = make_app()
+    with app.app_context():
+        for n_shows in SIZES:
+            db.drop_all()
+            db.create_all()
+            seed(n_shows)
+            # A cursor pointing at the middle of the table.
+            after = (datetime(2021, 1, 1) + timedelta(minutes=n_shows // 2), 0)
+            timings = {}
+            tracemalloc.start()
+            with QueryCounter(db.engine) as counter, timed(timings, 'page'):
+                tiles = sum(1 for _ in ShowFeed(after=after))
+            _, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+            print('shows=%-7d tiles=%-3d statements=%d peak=%.1fKiB %.2fms' % (
+                n_shows, tiles, counter.count, peak / 1024.0, timings['page'] * 1000))
+            db.session.remove()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
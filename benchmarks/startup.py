@@ -0,0 +1,90 @@
+"""Measures how long a worker takes to start and answer its first request.
+
+    python -m benchmarks.startup [--workers 4] [--runs 3] [--database-uri URI]
+
+Each worker is a fresh interpreter, as a gunicorn worker without
+--preload is: it imports app.py, calls create_app() with production
+settings (DEBUG off, so templates are precompiled) and requests the home
+page, then a form page, which is the first to need the forms. --workers of
+them start at once, --runs times. The database defaults to a PostgreSQL
+server that is not there: starting a worker must not need one. Fails if
+startup imported a module that should load lazily.
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from benchmarks.common import percentile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# Loaded on first use rather than by create_app().
+LAZY_MODULES = ('babel', 'dateutil', 'forms', 'wtforms', 'flask_wtf', 'flask_migrate', 'alembic')
+
+WORKER = '''
+import json, sys, time
+start = time.perf_counter()
+import app
+imported = time.perf_counter()
+application = app.create_app()
+created = time.perf_counter()
+loaded = sorted(name for name in %(lazy)r if name in sys.modules)
+client = application.test_client()
+status = client.get('/').status_code
+first_request = time.perf_counter()
+form_status = client.get('/venues/create').status_code
+first_form = time.perf_counter()
+print(json.dumps({
+    'import_ms': (imported - start) * 1000, 'create_app_ms': (created - imported) * 1000,
+    'first_request_ms': (first_request - created) * 1000, 'first_form_ms': (first_form - first_request) * 1000,
+    'status': [status, form_status], 'loaded': loaded}))
+'''
+
+
+def start_worker(env):
+    started = time.perf_counter()
+    output = subprocess.run([sys.executable, '-c', WORKER % {'lazy': LAZY_MODULES}], cwd=ROOT, env=env,
+                            stdout=subprocess.PIPE, stderr=subprocess.PIPE, universal_newlines=True)
+    if output.returncode:
+        raise RuntimeError('Worker failed:\n' + output.stderr)
+    result = json.loads(output.stdout.strip().splitlines()[-1])
+    # From fork to the first response, interpreter start included.
+    result['ready_ms'] = (time.perf_counter() - started) * 1000 - result['first_form_ms']
+    return result
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--workers', type=int, default=4)
+    parser.add_argument('--runs', type=int, default=3)
+    parser.add_argument('--database-uri', default='postgresql://fyyur@127.0.0.1:1/fyyur')
+    args = parser.parse_args(argv)
+
+    env = dict(os.environ, DATABASE_URL=args.database_uri, DEBUG='0', LOG_FILE='', DB_REPLICA_URL='',
+               PYTHONWARNINGS='ignore')
+    env.pop('FLASK_RUN_FROM_CLI', None)
+    results = []
+    with ThreadPoolExecutor(args.workers) as pool:
+        for _ in range(args.runs):
+            results.extend(pool.map(lambda _: start_worker(env), range(args.workers)))
+
+    failures = 0
+    print('%d workers x %d runs' % (args.workers, args.runs))
+    print('%-18s %8s %8s %8s' % ('', 'p50 ms', 'p95 ms', 'max ms'))
+    for key in ('import_ms', 'create_app_ms', 'first_request_ms', 'ready_ms', 'first_form_ms'):
+        values = [result[key] for result in results]
+        print('%-18s %8.1f %8.1f %8.1f' % (key[:-3], percentile(values, 0.5), percentile(values, 0.95), max(values)))
+    if any(status != 200 for result in results for status in result['status']):
+        print('FAIL: a worker answered %s' % sorted(set(s for result in results for s in result['status'])))
+        failures += 1
+    loaded = sorted(set(name for result in results for name in result['loaded']))
+    if loaded:
+        print('FAIL: loaded at startup: %s' % ', '.join(loaded))
+        failures += 1
+    return 1 if failures else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,98 @@
+"""Times template compilation and rendering /shows with 10k show tiles.
+
+    python -m benchmarks.template_render [--shows 10000]
+
+Compiles every template from source and then from a bytecode cache, as a
+fresh worker would, and renders pages/shows.html with the datetime filter
+as it was (start times as strings, dateutil parsing, Babel resolving the
+pattern and locale per call) and as it is now (datetime objects, cached
+pattern and locale). No database is needed.
+"""
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+from datetime import datetime, timedelta
+
+# config.py reads these when create_app() loads it.
+_handle, DATABASE_PATH = tempfile.mkstemp(suffix='.db')
+os.close(_handle)
+os.environ['DATABASE_URL'] = 'sqlite:///' + DATABASE_PATH
+os.environ['TEMPLATE_CACHE_DIR'] = ''
+os.environ['TEMPLATE_PRECOMPILE'] = '0'
+
+import babel.dates  # noqa: E402
+import dateutil.parser  # noqa: E402
+from jinja2 import FileSystemBytecodeCache  # noqa: E402
+from app import create_app  # noqa: E402
+from benchmarks.common import timed  # noqa: E402
+from templating import DATETIME_FORMATS, format_datetime, precompile_templates  # noqa: E402
+
+app = create_app()
+
+
+def legacy_format_datetime(value, format='medium'):
+    date = dateutil.parser.parse(value)
+    return babel.dates.format_datetime(date, DATETIME_FORMATS.get(format, format))
+
+
+def tiles(n_shows, as_strings):
+    start = datetime(2021, 1, 1, 20, 0)
+    for i in range(n_shows):
+        start_time = start + timedelta(minutes=i)
+        yield {
+            'venue_id': i % 100, 'venue_name': 'Venue %d' % (i % 100),
+            'artist_id': i % 250, 'artist_name': 'Artist %d' % (i % 250),
+            'artist_image_link': 'https://example.com/artist.jpg',
+            'start_time': start_time.strftime('%Y-%m-%dT%H:%M:%SZ') if as_strings else start_time,
+        }
+
+
+def compile_all(cache_dir):
+    env = app.create_jinja_environment()
+    env.filters.update(app.jinja_env.filters)
+    if cache_dir:
+        env.bytecode_cache = FileSystemBytecodeCache(cache_dir)
+    return len(precompile_templates(env))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--shows', type=int, default=10000)
+    args = parser.parse_args(argv)
+
+    cache_dir = tempfile.mkdtemp()
+    timings = {}
+    try:
+        with app.test_request_context('/shows'):
+            with timed(timings, 'compile from source'):
+                n_templates = compile_all(None)
+            compile_all(cache_dir)
+            with timed(timings, 'load from bytecode cache'):
+                compile_all(cache_dir)
+
+            for label, as_strings, datetime_filter in (
+                    ('render, old filter', True, legacy_format_datetime),
+                    ('render, new filter', False, format_datetime)):
+                app.jinja_env.filters['datetime'] = datetime_filter
+                template = app.jinja_env.get_template('pages/shows.html')
+                shows = list(tiles(args.shows, as_strings))
+                with timed(timings, label):
+                    body = template.render(shows=shows)
+                assert body.count('tile-show') == args.shows
+            app.jinja_env.filters['datetime'] = format_datetime
+    finally:
+        shutil.rmtree(cache_dir)
+        os.remove(DATABASE_PATH)
+
+    print('%d templates' % n_templates)
+    for label in ('compile from source', 'load from bytecode cache'):
+        print('%-26s %8.1f ms' % (label, timings[label] * 1000))
+    for label in ('render, old filter', 'render, new filter'):
+        print('%-26s %8.1f ms  %6.1f us/tile' % (label, timings[label] * 1000, timings[label] * 1e6 / args.shows))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,65 @@
+"""Checks that the /venues listing issues a constant number of statements.
+
+    python -m benchmarks.venues_query_count
+"""
+import itertools
+import random
+import sys
+from datetime import datetime, timedelta
+from benchmarks.common import make_app, QueryCounter, timed
+from model import db, Show, Venue, Artist
+from queries import venue_areas
+
+SIZES = (10, 100, 1000, 5000)
+CITIES = [('San Francisco', 'CA'), ('New York', 'NY'), ('Austin', 'TX'), ('Seattle', 'WA'), ('Chicago', 'IL')]
+
+
+def seed(n_venues, shows_per_venue=3):
+    rnd = random.Random(n_venues)
+    now = datetime.now()
+    artist = Artist(name='Benchmark Artist')
+    db.session.add(artist)
+    db.session.flush()
+    venues = []
+    for i in range(n_venues):
+        city, state = rnd.choice(CITIES)
+        venues.append(Venue(name='Venue %d' % i, city=city, state=state))
+    db.session.add_all(venues)
+    db.session.flush()
+    # The one artist plays one-minute shows in distinct minutes.
+    minutes = iter(rnd.sample(range(-60 * 24 * 60, 60 * 24 * 60), n_venues * shows_per_venue))
+    shows = [
+        Show(artist_id=artist.id, venue_id=venue.id, start_time=now + timedelta(minutes=minute),
+             end_time=now + timedelta(minutes=minute + 1))
+        for venue in venues for minute in itertools.islice(minutes, shows_per_venue)
+    ]
+    db.session.add_all(shows)
+    db.session.commit()
+
+
+def main():
+    app = make_app()
+    counts = {}
+    with app.app_context():
+        for n_venues in SIZES:
+            db.drop_all()
+            db.create_all()
+            seed(n_venues)
+            timings = {}
+            with QueryCounter(db.engine) as counter, timed(timings, 'venue_areas'):
+                areas = venue_areas()
+            listed = sum(len(area['venues']) for area in areas)
+            counts[n_venues] = counter.count
+            print('venues=%-6d listed=%-6d statements=%-3d %.2fms' % (
+                n_venues, listed, counter.count, timings['venue_areas'] * 1000))
+            db.session.remove()
+
+    if len(set(counts.values())) != 1:
+        print('FAIL: statement count grows with the number of venues')
+        return 1
+    print('OK: statement count is constant')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
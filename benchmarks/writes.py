@@ -0,0 +1,180 @@
+"""Measures write throughput under concurrent submissions.
+
+    python -m benchmarks.writes [--shows 1k] [--clients 8] [--requests 200] [--batch 5]
+                                [--database-uri postgresql://.../scratch_db]
+
+Seeds a dataset as benchmarks.load_test does (into a throwaway SQLite file
+by default; a PostgreSQL database is wiped first, so only point it at a
+scratch one), then:
+
+* posts the create and edit forms of the load test scenarios from --clients
+  threads, --requests per form, and prints writes per second, latency
+  percentiles and statements per write;
+* creates --requests venues with their first --batch shows through the
+  write service, once as a transaction per row and once as one unit per
+  venue, and prints rows written per second for both.
+
+The write service's retries and failures are reported for each run; with
+SQLite they are the writers that found the database locked.
+"""
+import argparse
+import itertools
+import logging
+import os
+import sys
+import tempfile
+import threading
+import time
+from datetime import date, datetime, timedelta
+
+# The POST scenarios of benchmarks.load_test that write through the service.
+FORMS = ('POST /venues/create', 'POST /venues/<int:venue_id>/edit', 'POST /artists/create',
+         'POST /artists/<int:artist_id>/edit', 'POST /shows/create')
+
+
+def concurrently(clients, requests, task):
+    """Runs task(i) for i in range(requests) from clients threads; returns
+    the elapsed time and each task's latency."""
+    counter = itertools.count()
+    lock = threading.Lock()
+    latencies = []
+
+    def client():
+        while True:
+            i = next(counter)
+            if i >= requests:
+                return
+            start = time.perf_counter()
+            task(i)
+            with lock:
+                latencies.append(time.perf_counter() - start)
+
+    threads = [threading.Thread(target=client) for _ in range(clients)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return time.perf_counter() - start, latencies
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--database-uri')
+    parser.add_argument('--shows', default='1k', help='Dataset size, e.g. 1000 or 100k.')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--clients', type=int, default=8)
+    parser.add_argument('--requests', type=int, default=200, help='Submissions per form.')
+    parser.add_argument('--batch', type=int, default=5, help='Shows written with each venue.')
+    args = parser.parse_args(argv)
+
+    path = None
+    database_uri = args.database_uri
+    if database_uri is None:
+        handle, path = tempfile.mkstemp(suffix='.db')
+        os.close(handle)
+        database_uri = 'sqlite:///' + path
+    # config.py reads these when create_app() loads it.
+    os.environ.update(DATABASE_URL=database_uri, DEBUG='0', LOG_FILE='', DB_REPLICA_URL='')
+
+    import writes
+    from app import create_app
+    from benchmarks.common import reset_schema, percentile
+    from benchmarks.load_test import scenarios, _QUERIES
+    from dataset import generate, parse_count
+    from forms import VenueForm
+    from model import db
+
+    app = create_app(WTF_CSRF_ENABLED=False, DB_MIGRATIONS=True)
+    write_stats = app.extensions['write_stats']
+    # The retries are counted below.
+    logging.getLogger('fyyur.writes').setLevel(logging.ERROR)
+    anchor = datetime.combine(date.today(), datetime.min.time())
+    failures = 0
+    try:
+        with app.app_context():
+            reset_schema()
+            counts = generate(parse_count(args.shows), seed=args.seed, anchor=anchor)
+            db.session.remove()
+        plan = dict((route, (method, url, data)) for route, method, url, data in scenarios(counts, anchor, {}))
+
+        print('%-36s %6s %4s %8s %7s %7s %7s %7s %7s' % (
+            'form', 'posts', 'err', 'writes/s', 'p50 ms', 'p95 ms', 'queries', 'retries', 'failed'))
+        for route in FORMS:
+            method, url, data = plan[route]
+            statuses, queries = [], []
+
+            def post(i):
+                response = app.test_client().open(url(i), method=method, data=data(i))
+                timing = _QUERIES.search(', '.join(response.headers.get_all('Server-Timing')))
+                statuses.append(response.status_code)
+                queries.append(int(timing.group(1)) if timing else 0)
+
+            before = write_stats.report()
+            elapsed, latencies = concurrently(args.clients, args.requests, post)
+            after = write_stats.report()
+            errors = sum(1 for status in statuses if status >= 400)
+            failed = after['failures'] - before['failures']
+            print('%-36s %6d %4d %8.1f %7.2f %7.2f %7d %7d %7d' % (
+                route, len(statuses), errors, len(statuses) / elapsed, percentile(latencies, 0.5) * 1000,
+                percentile(latencies, 0.95) * 1000, max(queries), after['retries'] - before['retries'], failed))
+            failures += errors + failed
+
+        form_data = plan['POST /venues/create'][2]
+        start = anchor + timedelta(days=800)
+        n_artists = counts['artists']
+
+        def show(i, k):
+            # Three hours apart: the artists are never double-booked.
+            return 1 + (i * args.batch + k) % n_artists, start + timedelta(hours=3 * (i * args.batch + k))
+
+        def separately(i):
+            with app.test_request_context():
+                form = VenueForm(formdata=_multidict(form_data(i)), meta={'csrf': False})
+                venue = writes.run(lambda work: work.save_venue(form))
+                venue_id = venue.id
+                for k in range(args.batch):
+                    artist_id, start_time = show(i, k)
+                    writes.run(lambda work: work.add_show(artist_id, venue_id, start_time))
+                db.session.remove()
+
+        def together(i):
+            def work(unit):
+                venue = unit.save_venue(form)
+                for k in range(args.batch):
+                    artist_id, start_time = show(i + args.requests, k)
+                    unit.add_show(artist_id, venue.id, start_time)
+            with app.test_request_context():
+                form = VenueForm(formdata=_multidict(form_data(i)), meta={'csrf': False})
+                writes.run(work)
+                db.session.remove()
+
+        print('\n%-36s %8s %8s %7s %7s %7s %7s' % (
+            'venue + %d shows' % args.batch, 'units/s', 'rows/s', 'p50 ms', 'p95 ms', 'retries', 'failed'))
+        for label, task in (('a transaction per row', separately), ('one unit per venue', together)):
+            before = write_stats.report()
+            elapsed, latencies = concurrently(args.clients, args.requests, task)
+            after = write_stats.report()
+            failed = after['failures'] - before['failures']
+            print('%-36s %8.1f %8.1f %7.2f %7.2f %7d %7d' % (
+                label, len(latencies) / elapsed, len(latencies) * (1 + args.batch) / elapsed,
+                percentile(latencies, 0.5) * 1000, percentile(latencies, 0.95) * 1000,
+                after['retries'] - before['retries'], failed))
+            failures += failed + args.requests - len(latencies)
+    finally:
+        if path:
+            os.remove(path)
+    return 1 if failures else 0
+
+
+def _multidict(data):
+    from werkzeug.datastructures import MultiDict
+    form = MultiDict()
+    for key, value in data.items():
+        for item in value if isinstance(value, list) else [value]:
+            form.add(key, item)
+    return form
+
+
+if __name__ == '__main__':
+    sys.exit(main())
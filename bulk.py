@@ -0,0 +1,370 @@
+# Bulk import and export.
+#
+# Files are read and written a chunk at a time, so memory stays flat however
+# long they are. Imported rows go through the same form classes as the HTML
+# forms; rows that fail validation or name a venue, artist or genre that
+# cannot be resolved are reported and skipped while the rest of the chunk is
+# inserted with one executemany per table (COPY for shows on PostgreSQL).
+# Exports read through server-side cursors.
+import csv
+import io
+import json
+import re
+from datetime import datetime
+from itertools import islice
+from sqlalchemy.exc import DBAPIError, SQLAlchemyError
+from werkzeug.datastructures import MultiDict
+from model import db, Venue, Artist, Show, Genre, venue_genres, artist_genres, refresh_show_counters, \
+    default_end_time, live
+from search import invalidate_index
+from writes import VENUE_FIELDS, ARTIST_FIELDS, form_values
+
+CHUNK_SIZE = 1000
+TIME_FORMAT = '%Y-%m-%d %H:%M:%S'
+
+SHOW_FIELDS = ('venue_id', 'venue_name', 'artist_id', 'artist_name', 'start_time', 'end_time')
+
+_GENRE_SEPARATOR = re.compile(r'\s*[;,]\s*')
+
+
+class Rejected(object):
+    """A row that was not imported: its line number, the row and why."""
+
+    def __init__(self, line, row, errors):
+        self.line = line
+        self.row = row
+        self.errors = errors
+
+    def as_dict(self):
+        return {'line': self.line, 'row': self.row, 'errors': self.errors}
+
+
+def read_rows(stream, format):
+    """Yields (line number, row dict) from a CSV or JSONL text stream."""
+    if format == 'csv':
+        reader = csv.DictReader(stream)
+        for row in reader:
+            yield reader.line_num, row
+    else:
+        for line, text in enumerate(stream, 1):
+            if text.strip():
+                try:
+                    row = json.loads(text)
+                except ValueError as error:
+                    row = {'__error__': str(error)}
+                if not isinstance(row, dict):
+                    row = {'__error__': 'Expected a JSON object.'}
+                yield line, row
+
+
+def _chunks(rows, size):
+    rows = iter(rows)
+    chunk = list(islice(rows, size))
+    while chunk:
+        yield chunk
+        chunk = list(islice(rows, size))
+
+
+def _genre_names(value):
+    if isinstance(value, (list, tuple)):
+        return [str(name).strip() for name in value if str(name).strip()]
+    return [name for name in _GENRE_SEPARATOR.split(value or '') if name]
+
+
+def _form_data(row, fields):
+    data = MultiDict()
+    for field in fields:
+        value = row.get(field)
+        if value is None:
+            continue
+        if field == 'genres':
+            for name in _genre_names(value):
+                data.add(field, name)
+        else:
+            data.add(field, str(value))
+    return data
+
+
+def validate(form_class, row, fields):
+    """Runs row through form_class; returns (form, errors)."""
+    form = form_class(formdata=_form_data(row, fields), meta={'csrf': False})
+    if form.validate():
+        return form, None
+    return form, dict((field, list(errors)) for field, errors in form.errors.items())
+
+
+def _resolve_names(model, names):
+    """Maps names to ids with one query; names may match several rows, the
+    lowest id wins."""
+    resolved = {}
+    if names:
+        for entity_id, name in db.session.query(model.id, model.name).filter(model.name.in_(names), live(model)) \
+                .order_by(model.id.desc()):
+            resolved[name] = entity_id
+    return resolved
+
+
+def _existing_ids(model, ids):
+    if not ids:
+        return set()
+    return set(entity_id for entity_id, in db.session.query(model.id).filter(model.id.in_(ids), live(model)))
+
+
+class Importer(object):
+    """Imports one kind of entity from a row iterator, a chunk at a time."""
+
+    def __init__(self, kind, chunk_size=CHUNK_SIZE):
+        self.kind = kind
+        self.chunk_size = chunk_size
+        self.imported = 0
+        self.rejected = []
+
+    def run(self, rows, on_reject=None):
+        for chunk in _chunks(rows, self.chunk_size):
+            rejected_before = len(self.rejected)
+            self._run_chunk(chunk)
+            self.rejected[rejected_before:] = sorted(self.rejected[rejected_before:], key=lambda rejected: rejected.line)
+            if on_reject is not None:
+                for rejected in self.rejected[rejected_before:]:
+                    on_reject(rejected)
+        invalidate_index()
+        return self
+
+    def _run_chunk(self, chunk):
+        # A chunk the database refuses (a double booking, say) is split in
+        # halves until the rows at fault are isolated and rejected alone.
+        rejected_before = len(self.rejected)
+        try:
+            imported = getattr(self, '_import_' + self.kind)(chunk)
+            db.session.commit()
+        except SQLAlchemyError as error:
+            db.session.rollback()
+            del self.rejected[rejected_before:]
+            if len(chunk) == 1:
+                line, row = chunk[0]
+                self._reject(line, row, {'__row__': [str(getattr(error, 'orig', error))]})
+            else:
+                self._run_chunk(chunk[:len(chunk) // 2])
+                self._run_chunk(chunk[len(chunk) // 2:])
+            return
+        self.imported += imported
+
+    def _reject(self, line, row, errors):
+        self.rejected.append(Rejected(line, row, errors))
+
+    def _valid_rows(self, chunk, form_class, fields, keep_position=False):
+        """Validated forms of the rows in chunk, rejecting the rest; with
+        keep_position, rejected rows yield None instead of being dropped."""
+        for line, row in chunk:
+            if '__error__' in row:
+                form, errors = None, {'__row__': [row['__error__']]}
+            else:
+                form, errors = validate(form_class, row, fields)
+            if errors:
+                self._reject(line, row, errors)
+                if keep_position:
+                    yield None
+            else:
+                yield form
+
+    def _import_entities(self, chunk, model, form_class, fields, association, flag):
+        forms = list(self._valid_rows(chunk, form_class, fields))
+        if not forms:
+            return 0
+        now = datetime.utcnow()
+        mappings = []
+        for form in forms:
+            mapping = form_values(form, fields, flag)
+            mapping['updated_at'] = now
+            mappings.append(mapping)
+        _insert_returning_ids(model, mappings)
+
+        genres = dict((genre.name, genre) for genre in Genre.from_names(
+            name for form in forms for name in form.genres.data))
+        db.session.flush()
+        entity_key = model.__tablename__ + '_id'
+        links = [{entity_key: mapping['id'], 'genre_id': genres[name].id}
+                 for mapping, form in zip(mappings, forms) for name in dict.fromkeys(form.genres.data)]
+        if links:
+            db.session.execute(association.insert(), links)
+        return len(mappings)
+
+    def _import_venues(self, chunk):
+        from forms import VenueForm
+        return self._import_entities(chunk, Venue, VenueForm, VENUE_FIELDS, venue_genres, 'seeking_talent')
+
+    def _import_artists(self, chunk):
+        from forms import ArtistForm
+        return self._import_entities(chunk, Artist, ArtistForm, ARTIST_FIELDS, artist_genres, 'seeking_venue')
+
+    def _import_shows(self, chunk):
+        # Names are resolved to ids for the whole chunk at once, then the
+        # rows are validated as ShowForm would.
+        venue_names = _resolve_names(Venue, set(row.get('venue_name') for _, row in chunk
+                                                if not row.get('venue_id') and row.get('venue_name')))
+        artist_names = _resolve_names(Artist, set(row.get('artist_name') for _, row in chunk
+                                                  if not row.get('artist_id') and row.get('artist_name')))
+        resolved = []
+        for line, row in chunk:
+            row, errors = dict(row), {}
+            for key, names in (('venue', venue_names), ('artist', artist_names)):
+                name = row.get(key + '_name')
+                if row.get(key + '_id') or not name:
+                    continue
+                if name in names:
+                    row[key + '_id'] = names[name]
+                else:
+                    errors[key + '_name'] = ['No %s named %r.' % (key, name)]
+            if errors:
+                self._reject(line, row, errors)
+            else:
+                resolved.append((line, row))
+
+        from forms import ShowForm
+        forms = self._valid_rows(resolved, ShowForm, SHOW_FIELDS, keep_position=True)
+        shows = [(form, line, row) for form, (line, row) in zip(forms, resolved) if form is not None]
+        venue_ids = _existing_ids(Venue, set(int(form.venue_id.data) for form, _, _ in shows))
+        artist_ids = _existing_ids(Artist, set(int(form.artist_id.data) for form, _, _ in shows))
+        now = datetime.utcnow()
+        mappings = []
+        for form, line, row in shows:
+            venue_id, artist_id = int(form.venue_id.data), int(form.artist_id.data)
+            errors = {}
+            if venue_id not in venue_ids:
+                errors['venue_id'] = ['No venue with id %d.' % venue_id]
+            if artist_id not in artist_ids:
+                errors['artist_id'] = ['No artist with id %d.' % artist_id]
+            if errors:
+                self._reject(line, row, errors)
+                continue
+            start_time = form.start_time.data
+            mappings.append({'venue_id': venue_id, 'artist_id': artist_id, 'start_time': start_time,
+                             'end_time': form.end_time.data or default_end_time(start_time), 'updated_at': now})
+        if not mappings:
+            return 0
+
+        if db.engine.dialect.name == 'postgresql':
+            _copy_shows(mappings)
+        else:
+            db.session.execute(Show.__table__.insert(), mappings)
+        # Show inserts bypass the ORM events; recount the touched rows.
+        connection = db.session.connection()
+        refresh_show_counters(connection, Venue, set(mapping['venue_id'] for mapping in mappings))
+        refresh_show_counters(connection, Artist, set(mapping['artist_id'] for mapping in mappings))
+        return len(mappings)
+
+
+def _insert_returning_ids(model, mappings):
+    """Inserts mappings and sets each one's 'id', which the genre links need.
+
+    PostgreSQL takes the chunk as one multi-row INSERT ... RETURNING, whose
+    rows come back in VALUES order; elsewhere SQLAlchemy inserts the rows
+    one by one to read the ids, which is cheap on in-process SQLite.
+    """
+    if db.engine.dialect.name == 'postgresql':
+        ids = db.session.execute(model.__table__.insert().values(mappings).returning(model.id)).fetchall()
+        for mapping, (entity_id,) in zip(mappings, ids):
+            mapping['id'] = entity_id
+    else:
+        db.session.bulk_insert_mappings(model, mappings, return_defaults=True)
+
+
+COPY_SHOWS = 'COPY show (venue_id, artist_id, start_time, end_time, updated_at) FROM STDIN WITH (FORMAT csv)'
+
+
+def _copy_shows(mappings):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    for mapping in mappings:
+        writer.writerow((mapping['venue_id'], mapping['artist_id'], mapping['start_time'].isoformat(' '),
+                         mapping['end_time'].isoformat(' '), mapping['updated_at'].isoformat(' ')))
+    buffer.seek(0)
+    connection = db.session.connection()
+    dbapi_error = connection.dialect.dbapi.Error
+    cursor = connection.connection.cursor()
+    try:
+        cursor.copy_expert(COPY_SHOWS, buffer)
+    except dbapi_error as error:
+        # The raw cursor bypasses SQLAlchemy's error wrapping; wrap it here
+        # so a refused chunk (a double booking) is rolled back and bisected
+        # like an INSERT would be.
+        raise DBAPIError.instance(COPY_SHOWS, None, error, dbapi_error, dialect=connection.dialect)
+    finally:
+        cursor.close()
+
+
+# Export.
+
+def _streamed(query, batch_size):
+    return query.yield_per(batch_size).execution_options(stream_results=True)
+
+
+def _genres_by_entity(model, batch_size):
+    """(entity id, [genre names]) for every entity with genres, by id."""
+    association = model.genres.property.secondary
+    entity_id = association.c[model.__tablename__ + '_id']
+    links = _streamed(db.session.query(entity_id, Genre.name)
+                      .join(Genre, Genre.id == association.c.genre_id)
+                      .order_by(entity_id, Genre.name), batch_size)
+    current, names = None, []
+    for owner, name in links:
+        if owner != current and names:
+            yield current, names
+            names = []
+        current = owner
+        names.append(name)
+    if names:
+        yield current, names
+
+
+def export_rows(kind, batch_size=CHUNK_SIZE):
+    """Yields every venue, artist or show as a row dict, in id order.
+
+    Venues and artists are merged with their genres from a second cursor
+    also in id order, so no more than a batch of either is held.
+    """
+    if kind == 'shows':
+        rows = _streamed(db.session.query(
+            Show.id, Show.venue_id, Venue.name.label('venue_name'),
+            Show.artist_id, Artist.name.label('artist_name'), Show.start_time, Show.end_time,
+        ).outerjoin(Venue, Venue.id == Show.venue_id).outerjoin(Artist, Artist.id == Show.artist_id)
+            .order_by(Show.id), batch_size)
+        for row in rows:
+            yield {'id': row.id, 'venue_id': row.venue_id, 'venue_name': row.venue_name,
+                   'artist_id': row.artist_id, 'artist_name': row.artist_name,
+                   'start_time': row.start_time.strftime(TIME_FORMAT), 'end_time': row.end_time.strftime(TIME_FORMAT)}
+        return
+
+    model, fields = (Venue, VENUE_FIELDS) if kind == 'venues' else (Artist, ARTIST_FIELDS)
+    columns = [model.id] + [getattr(model, field) for field in fields if field != 'genres']
+    genres = _genres_by_entity(model, batch_size)
+    next_genres = next(genres, None)
+    for row in _streamed(db.session.query(*columns).filter(live(model)).order_by(model.id), batch_size):
+        entity = dict(zip(['id'] + [field for field in fields if field != 'genres'], row))
+        while next_genres is not None and next_genres[0] < entity['id']:
+            next_genres = next(genres, None)
+        if next_genres is not None and next_genres[0] == entity['id']:
+            entity['genres'] = next_genres[1]
+        else:
+            entity['genres'] = []
+        yield entity
+
+
+def write_rows(rows, stream, format, fields):
+    if format == 'csv':
+        writer = csv.DictWriter(stream, fieldnames=fields, extrasaction='ignore')
+        writer.writeheader()
+        for row in rows:
+            if isinstance(row.get('genres'), list):
+                row = dict(row, genres=';'.join(row['genres']))
+            writer.writerow(row)
+    else:
+        for row in rows:
+            stream.write(json.dumps(row, default=str))
+            stream.write('\n')
+
+
+def export_fields(kind):
+    if kind == 'shows':
+        return ('id',) + SHOW_FIELDS
+    return ('id',) + (VENUE_FIELDS if kind == 'venues' else ARTIST_FIELDS)
@@ -0,0 +1,322 @@
+# Page cache.
+#
+# Rendered GET pages are cached under keys that embed a version token for
+# every scope the page depends on ('venues', 'venue:12', ...). Writes call
+# invalidate() with the scopes they touch, which swaps those tokens so every
+# dependent page misses on its next request; nothing has to enumerate keys.
+# Each app has its own PageCache in app.extensions['page_cache']; views are
+# marked with cached(), which looks it up when a request comes in.
+#
+# conditional() sits in front of that: it answers If-None-Match and
+# If-Modified-Since from the updated_at versions of the rows behind a page,
+# with one aggregate query and without rendering anything. The ETag it
+# computes is part of the page cache key too, so a cached body always
+# matches the ETag it is sent with, even when the versions moved without an
+# invalidation (a show starting, another worker's write to its own cache).
+#
+# A cached page keeps its compressed body too, which the compression
+# middleware sends on hits instead of compressing the page again.
+import functools
+import hashlib
+import pickle
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from datetime import datetime
+from flask import current_app, request, session, g, get_flashed_messages, make_response, Response
+from werkzeug.http import is_resource_modified
+from compression import PRECOMPRESSED, negotiate
+
+
+class LRUCache(object):
+    """In-process cache evicting the least recently used entry, with TTLs.
+
+    Each worker process has its own; use the Redis backend when several
+    workers must see each other's invalidations.
+    """
+
+    def __init__(self, max_entries=1024):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()  # key -> (expires at or None, value)
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            expires, value = entry
+            if expires is not None and expires <= time.time():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def get_many(self, keys):
+        return [self.get(key) for key in keys]
+
+    def set(self, key, value, ttl=None):
+        with self._lock:
+            self._entries[key] = (time.time() + ttl if ttl else None, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class RedisCache(object):
+    """Cache backend over any client with the redis-py get/set/mget/delete API."""
+
+    def __init__(self, client, prefix='fyyur:'):
+        self.client = client
+        self.prefix = prefix
+
+    def get(self, key):
+        value = self.client.get(self.prefix + key)
+        return None if value is None else pickle.loads(value)
+
+    def get_many(self, keys):
+        values = self.client.mget([self.prefix + key for key in keys])
+        return [None if value is None else pickle.loads(value) for value in values]
+
+    def set(self, key, value, ttl=None):
+        self.client.set(self.prefix + key, pickle.dumps(value), ex=ttl)
+
+    def delete(self, key):
+        self.client.delete(self.prefix + key)
+
+    def clear(self):
+        self.client.flushdb()
+
+
+class FakeRedis(object):
+    """In-process stand-in for a redis-py client, for tests and local runs."""
+
+    def __init__(self):
+        self._data = {}  # key -> (expires at or None, bytes)
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None or (entry[0] is not None and entry[0] <= time.time()):
+                self._data.pop(key, None)
+                return None
+            return entry[1]
+
+    def mget(self, keys):
+        return [self.get(key) for key in keys]
+
+    def set(self, key, value, ex=None):
+        with self._lock:
+            self._data[key] = (time.time() + ex if ex else None, value)
+        return True
+
+    def delete(self, *keys):
+        with self._lock:
+            return sum(self._data.pop(key, None) is not None for key in keys)
+
+    def flushdb(self):
+        with self._lock:
+            self._data.clear()
+        return True
+
+
+def _token(swapped_at):
+    """A fresh scope version token recording when it was swapped in."""
+    return '%d-%s' % (swapped_at, uuid.uuid4().hex)
+
+
+def _swapped_within(versions, seconds):
+    cutoff = time.time() - seconds
+    for version in versions:
+        swapped_at, _, rest = version.partition('-')
+        if rest and swapped_at.isdigit() and int(swapped_at) >= cutoff:
+            return True
+    return False
+
+
+class PageCache(object):
+    """Caches rendered pages per URL and invalidates them by scope.
+
+    Configured from CACHE_TYPE ('lru', 'redis', 'fakeredis' or 'null'),
+    CACHE_DEFAULT_TTL, CACHE_MAX_ENTRIES and CACHE_REDIS_URL.
+    """
+
+    def __init__(self, app=None):
+        self.backend = None
+        self.default_ttl = None
+        self.stats = {'hits': 0, 'misses': 0, 'bypasses': 0, 'invalidations': 0}
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        cache_type = app.config.get('CACHE_TYPE', 'lru')
+        if cache_type == 'lru':
+            self.backend = LRUCache(app.config.get('CACHE_MAX_ENTRIES', 1024))
+        elif cache_type == 'redis':
+            import redis
+            self.backend = RedisCache(redis.Redis.from_url(app.config['CACHE_REDIS_URL']))
+        elif cache_type == 'fakeredis':
+            self.backend = RedisCache(FakeRedis())
+        elif cache_type == 'null':
+            self.backend = None
+        else:
+            raise ValueError('Unknown CACHE_TYPE %r' % cache_type)
+        self.default_ttl = app.config.get('CACHE_DEFAULT_TTL', 300)
+        app.extensions['page_cache'] = self
+
+    def _versions(self, scopes):
+        keys = ['scope:' + scope for scope in scopes]
+        versions = self.backend.get_many(keys)
+        for i, version in enumerate(versions):
+            # A scope without a token (never seen, or evicted) gets a fresh
+            # one, so pages cached under an older token can never match.
+            if version is None:
+                versions[i] = _token(0)
+                self.backend.set(keys[i], versions[i])
+        return versions
+
+    def invalidate(self, *scopes):
+        """Makes every page depending on one of scopes miss from now on."""
+        if self.backend is None:
+            return
+        token = _token(time.time())
+        for scope in scopes:
+            self.backend.set('scope:' + scope, token)
+        self.stats['invalidations'] += len(scopes)
+
+    def clear(self):
+        if self.backend is not None:
+            self.backend.clear()
+
+    def serve(self, view, view_args, scopes, ttl=None):
+        """The response of view(**view_args) from the cache, rendered and
+        stored on a miss; see cached()."""
+        if self.backend is None or request.method != 'GET' or session.get('_flashes') or g.get('db_sticky'):
+            # Sticky reads are the writer's own: a page cached before its
+            # write, or rendered from a lagging replica, must not answer them.
+            self.stats['bypasses'] += 1
+            return view(**view_args)
+
+        versions = self._versions(scopes)
+        key = 'page:%s|%s|%s' % (request.full_path, '|'.join(versions), g.get('page_etag', ''))
+        entry = self.backend.get(key)
+        if entry is not None:
+            self.stats['hits'] += 1
+            g.cache_hit = True
+            body, status, mimetype = entry[:3]
+            self._offer_compressed(body, entry[3] if len(entry) > 3 else {})
+            response = Response(body, status=status, mimetype=mimetype)
+            response.headers['X-Cache'] = 'HIT'
+            return response
+
+        self.stats['misses'] += 1
+        response = make_response(view(**view_args))
+        max_lag = current_app.config.get('DB_REPLICA_MAX_LAG_SECONDS', 10)
+        if g.get('db_replica') and _swapped_within(versions, max_lag):
+            # Rendered from a replica that may not have the write behind the
+            # new token yet: storing it under that token would hide the
+            # write until the next invalidation.
+            self.stats['bypasses'] += 1
+        elif response.status_code == 200 and not response.is_streamed and not get_flashed_messages():
+            body = response.get_data()
+            variants = self._compressed_variants(body, response.mimetype)
+            self._offer_compressed(body, variants)
+            self.backend.set(key, (body, response.status_code, response.mimetype, variants), ttl or self.default_ttl)
+        response.headers['X-Cache'] = 'MISS'
+        return response
+
+    def _compressed_variants(self, body, mimetype):
+        """{encoding: compressed body} to keep with a page, so hits are not
+        compressed again: in this request's encoding, gzip if it has none."""
+        compression = current_app.extensions.get('compression')
+        encoding = negotiate(request.environ) or 'gzip'
+        compressed = compression.precompress(body, mimetype, encoding) if compression is not None else None
+        return {encoding: compressed} if compressed is not None else {}
+
+    def _offer_compressed(self, body, variants):
+        # The compression middleware sends it if the body goes out unchanged.
+        encoding = negotiate(request.environ)
+        if encoding in variants:
+            request.environ[PRECOMPRESSED] = (body, encoding, variants[encoding])
+
+    def report(self):
+        lookups = self.stats['hits'] + self.stats['misses']
+        report = dict(self.stats, hit_ratio=float(self.stats['hits']) / lookups if lookups else 0.0)
+        if isinstance(self.backend, LRUCache):
+            report['entries'] = len(self.backend)
+        return report
+
+
+def cached(*scopes, **options):
+    """Decorates a view whose page depends on scopes, kept in the current
+    app's page cache.
+
+    Scopes are format strings filled from the view arguments, e.g.
+    'venue:{venue_id}'. Responses that carry flashed messages, are
+    streamed or are not 200s are never stored.
+    """
+    ttl = options.get('ttl')
+
+    def decorator(view):
+        @functools.wraps(view)
+        def wrapper(**view_args):
+            g.cache_hit = False
+            page_cache = current_app.extensions.get('page_cache')
+            if page_cache is None:
+                return view(**view_args)
+            return page_cache.serve(view, view_args, [scope.format(**view_args) for scope in scopes], ttl)
+        return wrapper
+    return decorator
+
+
+def conditional(validators):
+    """Decorates a view to answer conditional GETs from version validators.
+
+    validators is called with the view arguments and returns a tuple of
+    version values (datetimes in UTC, counts), or None if there is no such
+    page. The ETag hashes the tuple and Last-Modified is its latest datetime,
+    so If-None-Match and If-Modified-Since get their 304 before the view
+    runs. Cache-Control comes from HTTP_CACHE_MAX_AGE (default 0, i.e.
+    revalidate on every use). Stacked over cached(), its ETag is part of
+    the page cache key.
+    """
+    def decorator(view):
+        @functools.wraps(view)
+        def wrapper(**view_args):
+            if request.method not in ('GET', 'HEAD') or session.get('_flashes'):
+                return view(**view_args)
+            versions = validators(**view_args)
+            if versions is None:
+                return view(**view_args)
+
+            etag = hashlib.sha1(repr(tuple(versions)).encode('utf-8')).hexdigest()
+            g.page_etag = etag
+            dates = [value for value in versions if isinstance(value, datetime)]
+            last_modified = max(dates) if dates else None
+            if is_resource_modified(request.environ, etag=etag, last_modified=last_modified):
+                response = make_response(view(**view_args))
+                if response.status_code != 200 or get_flashed_messages():
+                    return response
+            else:
+                response = Response(status=304)
+            response.set_etag(etag)
+            response.last_modified = last_modified
+            response.cache_control.public = True
+            response.cache_control.max_age = current_app.config.get('HTTP_CACHE_MAX_AGE', 0)
+            response.cache_control.must_revalidate = True
+            return response
+        return wrapper
+    return decorator
@@ -0,0 +1,254 @@
+# Commands.
+#
+# Maintenance tasks run as `flask fyyur <command>`, e.g. from cron.
+from datetime import date, datetime, timedelta
+import json
+import sys
+import click
+from flask import current_app
+from flask.cli import AppGroup
+from model import db, Show, roll_over_shows, archive_shows
+from queries import conflict_report
+from replicas import REPLICA_BIND, sync_sqlite_replica
+import assets
+import bulk
+import dataset
+from templating import precompile_templates
+
+fyyur_cli = AppGroup('fyyur', help='Fyyur maintenance commands.')
+
+
+def _page_cache():
+    """The page cache for a command to invalidate, None without one.
+
+    A command runs in its own process, so it can only reach the web
+    workers' pages through a shared backend; with any other it warns that
+    they stay cached until CACHE_DEFAULT_TTL.
+    """
+    page_cache = current_app.extensions.get('page_cache')
+    if page_cache is None or page_cache.backend is None:
+        return None
+    cache_type = current_app.config.get('CACHE_TYPE', 'lru')
+    if cache_type != 'redis':
+        click.echo('CACHE_TYPE is {}, which the web workers do not share: their cached pages are not cleared '
+                   'and refresh within CACHE_DEFAULT_TTL. Use CACHE_TYPE=redis.'.format(cache_type), err=True)
+    return page_cache
+
+
+@fyyur_cli.command('rollover')
+@click.option('--advance-index', is_flag=True,
+              help='On PostgreSQL, also move the ix_show_upcoming cutoff to today.')
+def rollover(advance_index):
+    """Moves shows that have begun from the upcoming to the past counters.
+
+    Run it every few minutes; between runs the listings' "upcoming" counts
+    and filters lag by at most the interval. The listings cached by the web
+    workers are only invalidated with CACHE_TYPE=redis; with an in-process
+    cache they lag by up to CACHE_DEFAULT_TTL more.
+    """
+    updated = roll_over_shows(db.session.connection(), datetime.now())
+    db.session.commit()
+    page_cache = _page_cache() if updated else None
+    if page_cache is not None:
+        page_cache.invalidate('venues', 'artists')
+    click.echo('Updated the show counters of {} venues and artists.'.format(updated))
+    if advance_index:
+        advance_upcoming_index()
+
+
+def advance_upcoming_index(cutoff=None):
+    """Rebuilds the partial ix_show_upcoming index over the shows after cutoff.
+
+    The index is built concurrently under a temporary name and swapped in,
+    so writes are not blocked while the shows before cutoff fall out of it.
+    """
+    if db.engine.dialect.name != 'postgresql':
+        click.echo('ix_show_upcoming only exists on PostgreSQL; skipped.')
+        return
+    cutoff = (cutoff or date.today()).isoformat()
+    with db.engine.connect().execution_options(isolation_level='AUTOCOMMIT') as connection:
+        connection.execute('DROP INDEX CONCURRENTLY IF EXISTS ix_show_upcoming_next')
+        connection.execute(
+            "CREATE INDEX CONCURRENTLY ix_show_upcoming_next ON show (venue_id, artist_id, start_time) "
+            "WHERE start_time > '{}'".format(cutoff))
+        connection.execute('DROP INDEX CONCURRENTLY IF EXISTS ix_show_upcoming')
+        connection.execute('ALTER INDEX ix_show_upcoming_next RENAME TO ix_show_upcoming')
+    click.echo('ix_show_upcoming now covers shows after {}.'.format(cutoff))
+
+
+@fyyur_cli.command('conflicts')
+def conflicts():
+    """Lists every pair of overlapping shows booked for one artist or venue.
+
+    Exits with status 1 when there are any, so it can gate a deploy.
+    """
+    rows = conflict_report()
+    for row in rows:
+        click.echo('{} {}: show {} ({} - {}) overlaps show {} ({} - {})'.format(
+            row.kind, row.owner_id, row.first_id, row.first_start, row.first_end,
+            row.second_id, row.second_start, row.second_end))
+    click.echo('{} conflicting pairs.'.format(len(rows)))
+    if rows:
+        sys.exit(1)
+
+
+@fyyur_cli.command('archive-shows')
+@click.option('--days', type=int, help='Archive shows that started this many days ago or more '
+                                       '[default: SHOW_ARCHIVE_DAYS].')
+@click.option('--batch-size', type=int, help='Shows moved per transaction [default: SHOW_ARCHIVE_BATCH_SIZE].')
+def archive(days, batch_size):
+    """Moves old past shows from show to show_history.
+
+    A batch is moved and committed at a time, so writers are never held up
+    for long. Archived shows no longer count or appear among a venue's or
+    an artist's past shows; the web workers' cached pages only drop them at
+    once with CACHE_TYPE=redis, otherwise within CACHE_DEFAULT_TTL.
+    """
+    days = current_app.config['SHOW_ARCHIVE_DAYS'] if days is None else days
+    batch_size = batch_size or current_app.config['SHOW_ARCHIVE_BATCH_SIZE']
+    # start_time holds local times.
+    cutoff = datetime.now() - timedelta(days=days)
+    archived = 0
+    while True:
+        moved = archive_shows(db.session.connection(), Show.start_time < cutoff, limit=batch_size)
+        db.session.commit()
+        if not moved:
+            break
+        archived += moved
+    page_cache = _page_cache() if archived else None
+    if page_cache is not None:
+        page_cache.clear()
+    click.echo('Archived {} shows that started before {:%Y-%m-%d %H:%M}.'.format(archived, cutoff))
+
+
+KINDS = click.Choice(['venues', 'artists', 'shows'])
+FORMATS = click.Choice(['csv', 'jsonl'])
+
+
+def _format_of(path, format):
+    if format:
+        return format
+    return 'jsonl' if path.endswith(('.jsonl', '.json')) else 'csv'
+
+
+def _open(path, mode):
+    # csv wants newline=''; click.open_file cannot pass it through.
+    if path == '-':
+        return click.get_text_stream('stdin' if mode == 'r' else 'stdout')
+    return open(path, mode, newline='', encoding='utf-8')
+
+
+@fyyur_cli.command('import')
+@click.argument('kind', type=KINDS)
+@click.argument('path', type=click.Path(exists=True, dir_okay=False, allow_dash=True))
+@click.option('--format', type=FORMATS, help='csv or jsonl; guessed from the file name by default.')
+@click.option('--chunk-size', default=bulk.CHUNK_SIZE, show_default=True,
+              help='Rows validated, inserted and committed together.')
+@click.option('--rejects', type=click.Path(dir_okay=False, writable=True),
+              help='Write the rejected rows and their errors here as JSON lines.')
+def import_rows(kind, path, format, chunk_size, rejects):
+    """Imports venues, artists or shows from a CSV or JSONL file.
+
+    Rows are checked with the same rules as the web forms. Genres are a
+    list (JSONL) or separated by ; or , (CSV). Shows name their venue and
+    artist by venue_id/artist_id or venue_name/artist_name. Invalid rows
+    are reported and skipped; the rest are imported.
+    """
+    format = _format_of(path, format)
+    rejects_file = open(rejects, 'w') if rejects else None
+
+    def report(rejected):
+        if rejects_file is not None:
+            rejects_file.write(json.dumps(rejected.as_dict(), default=str) + '\n')
+        else:
+            click.echo('line {}: {}'.format(rejected.line, json.dumps(rejected.errors)), err=True)
+
+    try:
+        with _open(path, 'r') as stream:
+            importer = bulk.Importer(kind, chunk_size).run(bulk.read_rows(stream, format), on_reject=report)
+    finally:
+        if rejects_file is not None:
+            rejects_file.close()
+    page_cache = current_app.extensions.get('page_cache')
+    if importer.imported and page_cache is not None:
+        # New shows change the detail pages of any number of venues and
+        # artists; drop everything rather than one scope per id.
+        if kind == 'shows':
+            page_cache.clear()
+        else:
+            page_cache.invalidate(kind)
+    click.echo('Imported {} {}, rejected {}.'.format(importer.imported, kind, len(importer.rejected)))
+    if importer.rejected:
+        sys.exit(1)
+
+
+@fyyur_cli.command('export')
+@click.argument('kind', type=KINDS)
+@click.argument('path', default='-', type=click.Path(dir_okay=False, writable=True, allow_dash=True))
+@click.option('--format', type=FORMATS, help='csv or jsonl; guessed from the file name by default.')
+@click.option('--batch-size', default=bulk.CHUNK_SIZE, show_default=True,
+              help='Rows fetched from the database at a time.')
+def export_rows(kind, path, format, batch_size):
+    """Exports every venue, artist or show to a CSV or JSONL file (- for stdout)."""
+    format = _format_of(path, format)
+    with _open(path, 'w') as stream:
+        bulk.write_rows(bulk.export_rows(kind, batch_size), stream, format, bulk.export_fields(kind))
+
+
+@fyyur_cli.command('compile-templates')
+def compile_templates():
+    """Compiles every template into the TEMPLATE_CACHE_DIR bytecode cache.
+
+    Run it as a build step so no worker compiles a template on a request.
+    """
+    if current_app.jinja_env.bytecode_cache is None:
+        raise click.ClickException('TEMPLATE_CACHE_DIR is not set.')
+    names = precompile_templates(current_app.jinja_env)
+    click.echo('Compiled {} templates into {}.'.format(len(names), current_app.config['TEMPLATE_CACHE_DIR']))
+
+
+@fyyur_cli.command('build-assets')
+def build_assets():
+    """Builds the hashed, minified and compressed asset bundles.
+
+    Run it as a build step; workers read the manifest when they start.
+    """
+    manifest = assets.build(current_app.static_folder)
+    if assets.brotli is None:
+        click.echo('brotli is not installed; only gzip copies were written.', err=True)
+    for name, filename in sorted(manifest.items()):
+        click.echo('{} -> {}'.format(name, filename))
+
+
+@fyyur_cli.command('sync-replica')
+def sync_replica():
+    """Copies a SQLite primary database into the SQLite DB_REPLICA_URL.
+
+    Stands in for replication when trying read replicas locally; the
+    replica's lag counts from the last copy.
+    """
+    if not (current_app.config.get('SQLALCHEMY_BINDS') or {}).get(REPLICA_BIND):
+        raise click.ClickException('DB_REPLICA_URL is not set.')
+    primary, replica = db.engine, db.get_engine(current_app, bind=REPLICA_BIND)
+    if primary.dialect.name != 'sqlite' or replica.dialect.name != 'sqlite':
+        raise click.ClickException('Only SQLite databases can be synced; use streaming replication otherwise.')
+    sync_sqlite_replica(primary, replica)
+    click.echo('Copied {} into {}.'.format(primary.url.database, replica.url.database))
+
+
+@fyyur_cli.command('seed')
+@click.option('--shows', default='1k', show_default=True, help='Number of shows, e.g. 1000, 100k or 1M.')
+@click.option('--seed', default=0, show_default=True, help='Random seed; the same seed gives the same data.')
+@click.option('--venues', type=int, help='Number of venues (default: one per 200 shows).')
+@click.option('--artists', type=int, help='Number of artists (default: one per 50 shows).')
+@click.option('--anchor', type=click.DateTime(['%Y-%m-%d']),
+              help='Day the upcoming shows start from (default: today).')
+def seed(shows, seed, venues, artists, anchor):
+    """Fills an empty database with a reproducible synthetic dataset."""
+    if not dataset.is_empty():
+        raise click.ClickException('The database already has venues, artists or shows.')
+    counts = dataset.generate(dataset.parse_count(shows), seed=seed, venues=venues, artists=artists, anchor=anchor)
+    page_cache = current_app.extensions.get('page_cache')
+    if page_cache is not None:
+        page_cache.clear()
+    click.echo('Seeded {venues} venues, {artists} artists and {shows} shows.'.format(**counts))
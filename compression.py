@@ -0,0 +1,249 @@
+# Response compression.
+#
+# CompressionMiddleware wraps the WSGI app and compresses responses with
+# brotli (when the brotli package is installed) or gzip, whichever the
+# client's Accept-Encoding prefers. Only COMPRESS_MIMETYPES are compressed,
+# and only from COMPRESS_MIN_SIZE bytes on; responses that already have a
+# Content-Encoding (the pre-compressed asset bundles), partial content and
+# Cache-Control: no-transform pass through. Streamed responses are
+# compressed chunk by chunk, each flushed so the client still gets the page
+# as it renders. A compressed response's ETag is made weak: the same page in
+# another encoding is the same resource, not the same bytes, and conditional
+# requests still match it. The 304 revalidating it carries the weak ETag too.
+#
+# The page cache keeps the compressed body with a cached page (see
+# Compression.precompress), and the middleware sends it instead of
+# compressing the page again on every hit.
+import gzip
+import itertools
+import threading
+import zlib
+from werkzeug.datastructures import Headers
+from werkzeug.http import parse_accept_header
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+ENCODINGS = ('br', 'gzip') if brotli is not None else ('gzip',)
+COMPRESSIBLE = ('text/html', 'text/css', 'text/plain', 'text/calendar', 'text/javascript', 'text/xml',
+                'application/javascript', 'application/json', 'application/xml', 'image/svg+xml')
+# WSGI environ key under which the page cache leaves (body, encoding, compressed body).
+PRECOMPRESSED = 'fyyur.precompressed'
+
+
+def negotiate(environ):
+    """The encoding to send a response in, or None."""
+    header = environ.get('HTTP_ACCEPT_ENCODING')
+    return parse_accept_header(header).best_match(ENCODINGS) if header else None
+
+
+class _Stream(object):
+    """Compresses a body a chunk at a time."""
+
+    def __init__(self, encoding, level, br_quality):
+        if encoding == 'br':
+            self._compressor = brotli.Compressor(quality=br_quality)
+            self.compress = lambda data: self._compressor.process(data) + self._compressor.flush()
+            self.finish = self._compressor.finish
+        else:
+            # wbits 31: a gzip header and trailer around the deflate stream.
+            self._compressor = zlib.compressobj(level, zlib.DEFLATED, 31)
+            self.compress = lambda data: self._compressor.compress(data) + self._compressor.flush(zlib.Z_SYNC_FLUSH)
+            self.finish = self._compressor.flush
+
+
+class Compression(object):
+    """Installs CompressionMiddleware around app.wsgi_app.
+
+    Configured from COMPRESS (on by default), COMPRESS_MIN_SIZE,
+    COMPRESS_MIMETYPES, COMPRESS_LEVEL (gzip) and COMPRESS_BR_QUALITY.
+    """
+
+    def __init__(self, app=None):
+        self.enabled = False
+        self._lock = threading.Lock()
+        self.stats = {'compressed': 0, 'reused': 0, 'streamed': 0, 'skipped': 0, 'bytes_in': 0, 'bytes_out': 0}
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.extensions['compression'] = self
+        self.enabled = app.config.get('COMPRESS', True)
+        if not self.enabled:
+            return
+        self.min_size = app.config.get('COMPRESS_MIN_SIZE', 1024)
+        self.mimetypes = frozenset(app.config.get('COMPRESS_MIMETYPES', COMPRESSIBLE))
+        self.level = app.config.get('COMPRESS_LEVEL', 6)
+        self.br_quality = app.config.get('COMPRESS_BR_QUALITY', 5)
+        app.wsgi_app = CompressionMiddleware(app.wsgi_app, self)
+
+    def compressible(self, mimetype, size=None):
+        return mimetype in self.mimetypes and (size is None or size >= self.min_size)
+
+    def compress(self, data, encoding):
+        if encoding == 'br':
+            return brotli.compress(data, quality=self.br_quality)
+        return gzip.compress(data, self.level, mtime=0)
+
+    def precompress(self, body, mimetype, encoding):
+        """body compressed in encoding, for the page cache to keep; None
+        when it would not be compressed."""
+        if not self.enabled or encoding is None or not self.compressible(mimetype, len(body)):
+            return None
+        return self.compress(body, encoding)
+
+    def stream(self, encoding):
+        return _Stream(encoding, self.level, self.br_quality)
+
+    def count(self, outcome, bytes_in=0, bytes_out=0):
+        with self._lock:
+            self.stats[outcome] += 1
+            self.stats['bytes_in'] += bytes_in
+            self.stats['bytes_out'] += bytes_out
+
+    def report(self):
+        with self._lock:
+            report = dict(self.stats, encodings=list(ENCODINGS))
+        report['ratio'] = float(report['bytes_out']) / report['bytes_in'] if report['bytes_in'] else None
+        return report
+
+
+class CompressionMiddleware(object):
+    def __init__(self, wsgi_app, compression):
+        self.wsgi_app = wsgi_app
+        self.compression = compression
+
+    def __call__(self, environ, start_response):
+        encoding = negotiate(environ) if environ['REQUEST_METHOD'] != 'HEAD' else None
+        captured = []
+
+        def capture(status, headers, exc_info=None):
+            if exc_info is not None and captured:
+                raise exc_info[1].with_traceback(exc_info[2])
+            captured[:] = [status, headers, exc_info]
+            return lambda data: pending.append(data)
+
+        pending = []
+        body = self.wsgi_app(environ, capture)
+        return _Response(self.compression, environ, encoding, start_response, captured, pending, body)
+
+
+class _Response(object):
+    """The body of one response, compressed on the way out as it allows."""
+
+    def __init__(self, compression, environ, encoding, start_response, captured, pending, body):
+        self.compression = compression
+        self.environ = environ
+        self.encoding = encoding
+        self.start_response = start_response
+        self.captured = captured
+        self.pending = pending
+        self.body = body
+
+    def close(self):
+        if hasattr(self.body, 'close'):
+            self.body.close()
+
+    def _plan(self):
+        """How to send the response: 'pass' it through, compress it 'whole'
+        (its length is known) or 'stream' it; and its headers."""
+        status, headers = self.captured[0], Headers(self.captured[1])
+        code = int(status.split(None, 1)[0])
+        mimetype = headers.get('Content-Type', '').split(';', 1)[0].strip().lower()
+        length = headers.get('Content-Length')
+        if code == 304 and self.encoding is not None:
+            self._revalidated(headers, mimetype)
+        if (code < 200 or code in (204, 206, 304) or 'Content-Encoding' in headers
+                or 'no-transform' in headers.get('Cache-Control', '')
+                or not self.compression.compressible(mimetype, None if length is None else int(length))):
+            return 'pass', headers
+        # Other clients may get this response compressed.
+        if 'accept-encoding' not in headers.get('Vary', '').lower():
+            headers.add('Vary', 'Accept-Encoding')
+        if self.encoding is None:
+            return 'pass', headers
+        return ('whole' if length is not None else 'stream'), headers
+
+    def _revalidated(self, headers, mimetype):
+        """Weakens the ETag of a 304 as the 200 it revalidates was weakened
+        when it went out compressed. A 304 usually has no Content-Type to
+        tell; the validator the client sent back does, and without one the
+        ETag is weakened as a compressible page's would be."""
+        etag = headers.get('ETag')
+        if not etag or etag.startswith('W/') or (mimetype and not self.compression.compressible(mimetype)):
+            return
+        sent = self.environ.get('HTTP_IF_NONE_MATCH', '')
+        if 'W/' + etag in sent or etag not in sent:
+            headers['ETag'] = 'W/' + etag
+            if 'accept-encoding' not in headers.get('Vary', '').lower():
+                headers.add('Vary', 'Accept-Encoding')
+
+    def _start(self, headers, encoding=None, length=None):
+        if encoding is not None:
+            headers['Content-Encoding'] = encoding
+            etag = headers.get('ETag')
+            if etag and not etag.startswith('W/'):
+                headers['ETag'] = 'W/' + etag
+            if length is None:
+                headers.remove('Content-Length')
+            else:
+                headers['Content-Length'] = str(length)
+        self.start_response(self.captured[0], headers.to_wsgi_list(), self.captured[2])
+
+    def __iter__(self):
+        chunks = iter(self.body)
+        # The headers are only known once the app has started its body.
+        first = list(self.pending)
+        for chunk in chunks:
+            if chunk:
+                first.append(chunk)
+                break
+        mode, headers = self._plan()
+        if mode == 'pass':
+            self._start(headers)
+            for chunk in itertools.chain(first, chunks):
+                yield chunk
+            self.compression.count('skipped')
+        elif mode == 'whole':
+            for chunk in self._whole(headers, b''.join(itertools.chain(first, chunks))):
+                yield chunk
+        else:
+            for chunk in self._stream(headers, first, chunks):
+                yield chunk
+
+    def _whole(self, headers, data):
+        precompressed = self.environ.get(PRECOMPRESSED)
+        if precompressed is not None and precompressed[1] == self.encoding and precompressed[0] == data:
+            compressed = precompressed[2]
+            self.compression.count('reused', len(data), len(compressed))
+        else:
+            compressed = self.compression.compress(data, self.encoding)
+            self.compression.count('compressed', len(data), len(compressed))
+        self._start(headers, self.encoding, len(compressed))
+        yield compressed
+
+    def _stream(self, headers, first, chunks):
+        # Hold the start back until there is enough of it to compress.
+        size = sum(len(chunk) for chunk in first)
+        while size < self.compression.min_size:
+            chunk = next(chunks, None)
+            if chunk is None:
+                self._start(headers)
+                yield b''.join(first)
+                self.compression.count('skipped')
+                return
+            first.append(chunk)
+            size += len(chunk)
+        stream = self.compression.stream(self.encoding)
+        self._start(headers, self.encoding)
+        bytes_in = bytes_out = 0
+        for chunk in itertools.chain(first, chunks):
+            if chunk:
+                compressed = stream.compress(chunk)
+                bytes_in, bytes_out = bytes_in + len(chunk), bytes_out + len(compressed)
+                yield compressed
+        compressed = stream.finish()
+        self.compression.count('streamed', bytes_in, bytes_out + len(compressed))
+        yield compressed
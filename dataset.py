@@ -0,0 +1,183 @@
+# Synthetic datasets.
+#
+# generate() fills an empty database with venues, artists and shows drawn
+# from a seeded random.Random, so a given (shows, seed, anchor) always gives
+# the same rows, for load tests and local development at any scale
+# (`flask fyyur seed --shows 1M`). The data is skewed the way real listings
+# are: a few cities and genres hold most venues and artists, some artists
+# and venues play far more often than others, and shows bunch up in the
+# evening. Shows are two hours long in three-hour slots, and a slot taken by
+# an artist or a venue is never handed out twice, so the data passes the
+# double-booking constraints. About 10% of the shows are upcoming.
+import itertools
+import random
+from datetime import datetime, time, timedelta
+from model import db, Venue, Artist, Show, Genre, venue_genres, artist_genres, refresh_show_counters
+from search import invalidate_index
+
+CHUNK_SIZE = 10000
+HISTORY_DAYS = 5 * 365
+AHEAD_DAYS = 183
+SLOT_HOURS = (13, 16, 19, 22)
+SLOT_WEIGHTS = (1, 2, 5, 3)
+SHOW_DURATION = timedelta(hours=2)
+
+# Most popular first; picked with Zipf-like weights.
+CITIES = (
+    ('New York', 'NY'), ('Los Angeles', 'CA'), ('Chicago', 'IL'), ('Houston', 'TX'), ('Phoenix', 'AZ'),
+    ('Philadelphia', 'PA'), ('San Antonio', 'TX'), ('San Diego', 'CA'), ('Dallas', 'TX'), ('San Jose', 'CA'),
+    ('Austin', 'TX'), ('Jacksonville', 'FL'), ('San Francisco', 'CA'), ('Columbus', 'OH'), ('Charlotte', 'NC'),
+    ('Indianapolis', 'IN'), ('Seattle', 'WA'), ('Denver', 'CO'), ('Washington', 'DC'), ('Boston', 'MA'),
+    ('Nashville', 'TN'), ('Detroit', 'MI'), ('Portland', 'OR'), ('Las Vegas', 'NV'), ('Memphis', 'TN'),
+    ('Louisville', 'KY'), ('Baltimore', 'MD'), ('Milwaukee', 'WI'), ('Albuquerque', 'NM'), ('New Orleans', 'LA'),
+)
+GENRES = (
+    'Rock n Roll', 'Pop', 'Hip-Hop', 'Alternative', 'Electronic', 'Jazz', 'R&B', 'Country', 'Folk', 'Blues',
+    'Soul', 'Punk', 'Heavy Metal', 'Reggae', 'Funk', 'Classical', 'Instrumental', 'Musical Theatre', 'Other',
+)
+WORDS = ('Blue', 'Red', 'Golden', 'Silver', 'Velvet', 'Electric', 'Midnight', 'Crystal', 'Wild', 'Lucky',
+         'Neon', 'Broken', 'Royal', 'Hidden', 'Howling', 'Paper', 'Iron', 'Little', 'Lonesome', 'Cosmic')
+VENUE_NOUNS = ('Room', 'Hall', 'Lounge', 'Tavern', 'Ballroom', 'Club', 'Theatre', 'Garden', 'Cellar', 'Barn')
+ARTIST_NOUNS = ('Owls', 'Rivers', 'Engines', 'Sparrows', 'Hearts', 'Wolves', 'Echoes', 'Saints', 'Comets',
+                'Strangers')
+
+
+def parse_count(text):
+    """'1000', '100k' or '1M' as an int."""
+    text = str(text).strip()
+    factor = {'k': 1000, 'm': 1000000}.get(text[-1:].lower(), 1)
+    return int(float(text[:-1] if factor > 1 else text) * factor)
+
+
+def _cum_weights(n, s):
+    """Cumulative Zipf weights (1 / rank ** s) for n items."""
+    return list(itertools.accumulate(1.0 / rank ** s for rank in range(1, n + 1)))
+
+
+class Generator(object):
+    """Draws the rows of one dataset; see generate()."""
+
+    def __init__(self, shows, seed=0, venues=None, artists=None, anchor=None):
+        self.n_shows = shows
+        self.n_venues = venues or max(shows // 200, 10)
+        self.n_artists = artists or max(shows // 50, 10)
+        self.anchor = anchor or datetime.combine(datetime.now().date(), time())
+        self.random = random.Random(seed)
+        self._city_weights = _cum_weights(len(CITIES), 1.0)
+        self._genre_weights = _cum_weights(len(GENRES), 1.0)
+
+    def _genres(self):
+        count = self.random.choice((1, 1, 2, 2, 3))
+        return set(self.random.choices(range(len(GENRES)), cum_weights=self._genre_weights, k=count))
+
+    def _phone(self):
+        return '%03d-%03d-%04d' % (self.random.randint(201, 989), self.random.randint(200, 999),
+                                   self.random.randint(0, 9999))
+
+    def venues(self):
+        """(row, genre indexes) for each venue."""
+        for id in range(1, self.n_venues + 1):
+            city, state = self.random.choices(CITIES, cum_weights=self._city_weights)[0]
+            yield {
+                'id': id,
+                'name': 'The %s %s %d' % (self.random.choice(WORDS), self.random.choice(VENUE_NOUNS), id),
+                'city': city, 'state': state,
+                'address': '%d %s St' % (self.random.randint(1, 9999), self.random.choice(WORDS)),
+                'phone': self._phone(),
+                'image_link': 'https://images.example.com/venues/%d.jpg' % id,
+                'facebook_link': 'https://www.facebook.com/venue%d' % id,
+                'website': 'https://venue%d.example.com' % id,
+                'seeking_talent': self.random.random() < 0.3,
+                'seeking_description': 'Looking for acts on weeknights.',
+            }, self._genres()
+
+    def artists(self):
+        """(row, genre indexes) for each artist."""
+        for id in range(1, self.n_artists + 1):
+            city, state = self.random.choices(CITIES, cum_weights=self._city_weights)[0]
+            yield {
+                'id': id,
+                'name': 'The %s %s %d' % (self.random.choice(WORDS), self.random.choice(ARTIST_NOUNS), id),
+                'city': city, 'state': state,
+                'phone': self._phone(),
+                'image_link': 'https://images.example.com/artists/%d.jpg' % id,
+                'facebook_link': 'https://www.facebook.com/artist%d' % id,
+                'website': 'https://artist%d.example.com' % id,
+                'seeking_venue': self.random.random() < 0.3,
+                'seeking_description': 'Booking for the next tour.',
+            }, self._genres()
+
+    def shows(self):
+        """A row for each show; no artist or venue gets a slot twice."""
+        rnd = self.random
+        # Popularity is by rank, and ranks are shuffled over the ids.
+        artist_ids = list(range(1, self.n_artists + 1))
+        venue_ids = list(range(1, self.n_venues + 1))
+        rnd.shuffle(artist_ids)
+        rnd.shuffle(venue_ids)
+        artist_weights = _cum_weights(self.n_artists, 0.5)
+        venue_weights = _cum_weights(self.n_venues, 0.4)
+        n_days = HISTORY_DAYS + AHEAD_DAYS
+        # Taken slots as slot * (n + 1) + id: one int per show and owner.
+        artist_slots, venue_slots = set(), set()
+        for _ in range(self.n_shows):
+            while True:
+                artist_id = rnd.choices(artist_ids, cum_weights=artist_weights)[0]
+                venue_id = rnd.choices(venue_ids, cum_weights=venue_weights)[0]
+                day = rnd.randrange(n_days)
+                hour = rnd.choices(range(len(SLOT_HOURS)), weights=SLOT_WEIGHTS)[0]
+                slot = day * len(SLOT_HOURS) + hour
+                artist_key = slot * (self.n_artists + 1) + artist_id
+                venue_key = slot * (self.n_venues + 1) + venue_id
+                if artist_key not in artist_slots and venue_key not in venue_slots:
+                    break
+            artist_slots.add(artist_key)
+            venue_slots.add(venue_key)
+            start_time = self.anchor + timedelta(days=day - HISTORY_DAYS, hours=SLOT_HOURS[hour])
+            yield {'artist_id': artist_id, 'venue_id': venue_id,
+                   'start_time': start_time, 'end_time': start_time + SHOW_DURATION}
+
+
+def _insert(connection, table, rows, chunk_size):
+    for chunk in iter(lambda: list(itertools.islice(rows, chunk_size)), []):
+        connection.execute(table.insert(), chunk)
+
+
+def _insert_entities(connection, model, links, owner_key, entities, genre_ids, chunk_size):
+    pairs = []
+
+    def rows():
+        for row, genres in entities:
+            pairs.extend({owner_key: row['id'], 'genre_id': genre_ids[genre]} for genre in genres)
+            yield row
+
+    _insert(connection, model.__table__, rows(), chunk_size)
+    _insert(connection, links, iter(pairs), chunk_size)
+
+
+def is_empty():
+    return not any(db.session.query(model.id).first() for model in (Venue, Artist, Show))
+
+
+def generate(shows, seed=0, venues=None, artists=None, anchor=None, chunk_size=CHUNK_SIZE):
+    """Fills the (empty) database with a dataset of shows shows and returns
+    the counts. Venues and artists default to one per 200 and 50 shows;
+    show times are spread around anchor, today by default."""
+    generator = Generator(shows, seed=seed, venues=venues, artists=artists, anchor=anchor)
+    genres = Genre.from_names(GENRES)
+    db.session.flush()
+    genre_ids = [genre.id for genre in genres]
+    connection = db.session.connection()
+    _insert_entities(connection, Venue, venue_genres, 'venue_id', generator.venues(), genre_ids, chunk_size)
+    _insert_entities(connection, Artist, artist_genres, 'artist_id', generator.artists(), genre_ids, chunk_size)
+    _insert(connection, Show.__table__, generator.shows(), chunk_size)
+    if connection.dialect.name == 'postgresql':
+        # The ids were given explicitly; move the sequences past them.
+        for table in ('venue', 'artist'):
+            connection.execute("SELECT setval(pg_get_serial_sequence('{0}', 'id'), "
+                               "(SELECT max(id) FROM {0}))".format(table))
+    for model in (Venue, Artist):
+        refresh_show_counters(connection, model)
+    db.session.commit()
+    invalidate_index()
+    return {'venues': generator.n_venues, 'artists': generator.n_artists, 'shows': generator.n_shows}
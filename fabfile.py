@@ -4,11 +4,14 @@ from fabric.contrib.console import confirm
 # prepare for deployment
 
 
+# Fails on errors and extra queries per route; p95 latencies against the
+# stored baseline, recorded on another machine, are only reported.
+LOAD_TEST = "python -m benchmarks.load_test --shows 1k --baseline benchmarks/load_baseline.json"
+
+
 def test():
     with settings(warn_only=True):
-        result = local(
-            "python test_tasks.py -v && python test_users.py -v", capture=True
-        )
+        result = local(LOAD_TEST)
     if result.failed and not confirm("Tests failed. Continue?"):
         abort("Aborted at user request.")
 
@@ -39,9 +42,7 @@ def heroku():
 
 
 def heroku_test():
-    local(
-        "heroku run python test_tasks.py -v && heroku run python test_users.py -v"
-    )
+    local("heroku run " + LOAD_TEST)
 
 
 def deploy():
@@ -1,119 +1,151 @@
 from datetime import datetime
-from flask_wtf import Form
+from flask_wtf import FlaskForm
+from markupsafe import Markup
 from wtforms import StringField, SelectField, SelectMultipleField, DateTimeField
-from wtforms.validators import DataRequired, URL, Regexp
+from wtforms.validators import DataRequired, URL, Regexp, Optional, ValidationError
+from wtforms.widgets import Select, html_params
+from model import SHOW_MAX_DURATION
 
 
-class ShowForm(Form):
+class Choices(tuple):
+    """An immutable table of (value, label) pairs shared by the forms, with
+    its values as a frozenset for validation and the rendered <option> list
+    cached per selection."""
+
+    max_cached = 1024
+
+    def __new__(cls, pairs):
+        return tuple.__new__(cls, pairs)
+
+    def __init__(self, pairs):
+        self.values = frozenset(value for value, _ in self)
+        self._options = tuple((value, Select.render_option(value, label, False),
+                               Select.render_option(value, label, True)) for value, label in self)
+        self._rendered = {}
+
+    def options(self, selected):
+        """The <option> elements, those whose value is in the frozenset
+        selected marked selected."""
+        html = self._rendered.get(selected)
+        if html is None:
+            html = Markup(''.join(on if value in selected else off for value, off, on in self._options))
+            if len(self._rendered) < self.max_cached:
+                self._rendered[selected] = html
+        return html
+
+
+STATE_CHOICES = Choices((state, state) for state in (
+    'AL', 'AK', 'AZ', 'AR', 'CA', 'CO', 'CT', 'DE', 'DC', 'FL', 'GA', 'HI', 'ID', 'IL', 'IN', 'IA', 'KS', 'KY',
+    'LA', 'ME', 'MT', 'NE', 'NV', 'NH', 'NJ', 'NM', 'NY', 'NC', 'ND', 'OH', 'OK', 'OR', 'MD', 'MA', 'MI', 'MN',
+    'MS', 'MO', 'PA', 'RI', 'SC', 'SD', 'TN', 'TX', 'UT', 'VT', 'VA', 'WA', 'WV', 'WI', 'WY',
+))
+GENRE_CHOICES = Choices((genre, genre) for genre in (
+    'Alternative', 'Blues', 'Classical', 'Country', 'Electronic', 'Folk', 'Funk', 'Hip-Hop', 'Heavy Metal',
+    'Instrumental', 'Jazz', 'Musical Theatre', 'Pop', 'Punk', 'R&B', 'Reggae', 'Rock n Roll', 'Soul', 'Other',
+))
+YES_NO_CHOICES = Choices((('True', 'yes'), ('False', 'no')))
+
+PHONE_PATTERN = r'^(([+]{0,1}\d{2})|\d?)[\s-]?[0-9]{2}[\s-]?[0-9]{3}[\s-]?[0-9]{4}$'
+
+
+class ChoicesSelect(Select):
+    """Renders a select from the cached options of the field's Choices."""
+
+    def __call__(self, field, **kwargs):
+        kwargs.setdefault('id', field.id)
+        if self.multiple:
+            kwargs['multiple'] = True
+        if 'required' not in kwargs and 'required' in getattr(field, 'flags', []):
+            kwargs['required'] = True
+        return Markup('<select %s>%s</select>' % (
+            html_params(name=field.name, **kwargs), field.choices.options(field.selected())))
+
+
+class ChoicesField(SelectField):
+    """A SelectField over a shared Choices table."""
+    widget = ChoicesSelect()
+
+    def __init__(self, label=None, validators=None, choices=None, **kwargs):
+        super(ChoicesField, self).__init__(label, validators, **kwargs)
+        # SelectField copies choices into a list; keep the shared table.
+        self.choices = choices
+
+    def selected(self):
+        return frozenset(() if self.data is None else (self.data,))
+
+    def pre_validate(self, form):
+        if self.data not in self.choices.values:
+            raise ValueError(self.gettext('Not a valid choice'))
+
+
+class MultipleChoicesField(SelectMultipleField):
+    """A SelectMultipleField over a shared Choices table."""
+    widget = ChoicesSelect(multiple=True)
+
+    def __init__(self, label=None, validators=None, choices=None, **kwargs):
+        super(MultipleChoicesField, self).__init__(label, validators, **kwargs)
+        self.choices = choices
+
+    def selected(self):
+        return frozenset(self.data or ())
+
+    def pre_validate(self, form):
+        for value in self.data or ():
+            if value not in self.choices.values:
+                raise ValueError(self.gettext("'%(value)s' is not a valid choice for this field") % dict(value=value))
+
+
+def genre_name(value):
+    """A submitted genre name, or the name of a Genre when filled from obj=."""
+    return getattr(value, 'name', value)
+
+
+class ShowForm(FlaskForm):
     artist_id = StringField(
-        'artist_id', validators=[DataRequired(),Regexp('\d$')]
+        'artist_id', validators=[DataRequired(), Regexp(r'^\d+$', message='Must be a numeric id.')]
     )
     venue_id = StringField(
-        'venue_id', validators=[DataRequired(),Regexp('\d$')]
+        'venue_id', validators=[DataRequired(), Regexp(r'^\d+$', message='Must be a numeric id.')]
     )
     start_time = DateTimeField(
         'start_time',
         validators=[DataRequired()],
         default= datetime.today()
     )
+    end_time = DateTimeField(
+        'end_time', validators=[Optional()]
+    )
+
+    def validate_end_time(self, field):
+        if field.data is None or self.start_time.data is None:
+            return
+        if field.data <= self.start_time.data:
+            raise ValidationError('The show must end after it starts.')
+        if field.data - self.start_time.data > SHOW_MAX_DURATION:
+            raise ValidationError('A show can last at most %d hours.' % (SHOW_MAX_DURATION.total_seconds() // 3600))
 
-class VenueForm(Form):
+class VenueForm(FlaskForm):
     name = StringField(
         'name', validators=[DataRequired()]
     )
     city = StringField(
         'city', validators=[DataRequired()]
     )
-    state = SelectField(
-        'state', validators=[DataRequired()], choices=[
-            ('AL', 'AL'),
-            ('AK', 'AK'),
-            ('AZ', 'AZ'),
-            ('AR', 'AR'),
-            ('CA', 'CA'),
-            ('CO', 'CO'),
-            ('CT', 'CT'),
-            ('DE', 'DE'),
-            ('DC', 'DC'),
-            ('FL', 'FL'),
-            ('GA', 'GA'),
-            ('HI', 'HI'),
-            ('ID', 'ID'),
-            ('IL', 'IL'),
-            ('IN', 'IN'),
-            ('IA', 'IA'),
-            ('KS', 'KS'),
-            ('KY', 'KY'),
-            ('LA', 'LA'),
-            ('ME', 'ME'),
-            ('MT', 'MT'),
-            ('NE', 'NE'),
-            ('NV', 'NV'),
-            ('NH', 'NH'),
-            ('NJ', 'NJ'),
-            ('NM', 'NM'),
-            ('NY', 'NY'),
-            ('NC', 'NC'),
-            ('ND', 'ND'),
-            ('OH', 'OH'),
-            ('OK', 'OK'),
-            ('OR', 'OR'),
-            ('MD', 'MD'),
-            ('MA', 'MA'),
-            ('MI', 'MI'),
-            ('MN', 'MN'),
-            ('MS', 'MS'),
-            ('MO', 'MO'),
-            ('PA', 'PA'),
-            ('RI', 'RI'),
-            ('SC', 'SC'),
-            ('SD', 'SD'),
-            ('TN', 'TN'),
-            ('TX', 'TX'),
-            ('UT', 'UT'),
-            ('VT', 'VT'),
-            ('VA', 'VA'),
-            ('WA', 'WA'),
-            ('WV', 'WV'),
-            ('WI', 'WI'),
-            ('WY', 'WY'),
-        ]
+    state = ChoicesField(
+        'state', validators=[DataRequired()], choices=STATE_CHOICES
     )
     address = StringField(
         'address', validators=[DataRequired()]
     )
     phone = StringField(
         'phone',
-        validators=[DataRequired(), Regexp('^(([+]{0,1}\d{2})|\d?)[\s-]?[0-9]{2}[\s-]?[0-9]{3}[\s-]?[0-9]{4}$',
-            message='Please add  valid phone number'
-        )]
+        validators=[DataRequired(), Regexp(PHONE_PATTERN, message='Please add  valid phone number')]
     )
     image_link = StringField(
         'image_link', validators=[URL()]
     )
-    genres = SelectMultipleField(
-
-        'genres', validators=[DataRequired()], choices=[
-            ('Alternative', 'Alternative'),
-            ('Blues', 'Blues'),
-            ('Classical', 'Classical'),
-            ('Country', 'Country'),
-            ('Electronic', 'Electronic'),
-            ('Folk', 'Folk'),
-            ('Funk', 'Funk'),
-            ('Hip-Hop', 'Hip-Hop'),
-            ('Heavy Metal', 'Heavy Metal'),
-            ('Instrumental', 'Instrumental'),
-            ('Jazz', 'Jazz'),
-            ('Musical Theatre', 'Musical Theatre'),
-            ('Pop', 'Pop'),
-            ('Punk', 'Punk'),
-            ('R&B', 'R&B'),
-            ('Reggae', 'Reggae'),
-            ('Rock n Roll', 'Rock n Roll'),
-            ('Soul', 'Soul'),
-            ('Other', 'Other'),
-        ]
+    genres = MultipleChoicesField(
+        'genres', validators=[DataRequired()], choices=GENRE_CHOICES, coerce=genre_name
     )
     facebook_link = StringField(
         'facebook_link', validators=[URL()]
@@ -122,114 +154,34 @@ class VenueForm(Form):
         'website', validators=[URL()]
     )
 
-    seeking_talent = SelectField(
-        'seeking_talent', validators=[DataRequired()],
-        choices=[
-            (True, 'yes'),
-            (False, 'no')
-        ]
+    seeking_talent = ChoicesField(
+        'seeking_talent', validators=[DataRequired()], choices=YES_NO_CHOICES
     )
     seeking_description = StringField(
         'seeking_description', validators=[DataRequired()]
     )
 
-class ArtistForm(Form):
+class ArtistForm(FlaskForm):
     name = StringField(
         'name', validators=[DataRequired()]
     )
     city = StringField(
         'city', validators=[DataRequired()]
     )
-    state = SelectField(
-        'state', validators=[DataRequired()],
-        choices=[
-            ('AL', 'AL'),
-            ('AK', 'AK'),
-            ('AZ', 'AZ'),
-            ('AR', 'AR'),
-            ('CA', 'CA'),
-            ('CO', 'CO'),
-            ('CT', 'CT'),
-            ('DE', 'DE'),
-            ('DC', 'DC'),
-            ('FL', 'FL'),
-            ('GA', 'GA'),
-            ('HI', 'HI'),
-            ('ID', 'ID'),
-            ('IL', 'IL'),
-            ('IN', 'IN'),
-            ('IA', 'IA'),
-            ('KS', 'KS'),
-            ('KY', 'KY'),
-            ('LA', 'LA'),
-            ('ME', 'ME'),
-            ('MT', 'MT'),
-            ('NE', 'NE'),
-            ('NV', 'NV'),
-            ('NH', 'NH'),
-            ('NJ', 'NJ'),
-            ('NM', 'NM'),
-            ('NY', 'NY'),
-            ('NC', 'NC'),
-            ('ND', 'ND'),
-            ('OH', 'OH'),
-            ('OK', 'OK'),
-            ('OR', 'OR'),
-            ('MD', 'MD'),
-            ('MA', 'MA'),
-            ('MI', 'MI'),
-            ('MN', 'MN'),
-            ('MS', 'MS'),
-            ('MO', 'MO'),
-            ('PA', 'PA'),
-            ('RI', 'RI'),
-            ('SC', 'SC'),
-            ('SD', 'SD'),
-            ('TN', 'TN'),
-            ('TX', 'TX'),
-            ('UT', 'UT'),
-            ('VT', 'VT'),
-            ('VA', 'VA'),
-            ('WA', 'WA'),
-            ('WV', 'WV'),
-            ('WI', 'WI'),
-            ('WY', 'WY'),
-        ]
+    state = ChoicesField(
+        'state', validators=[DataRequired()], choices=STATE_CHOICES
     )
 
     phone = StringField(
         'phone',
-        validators=[DataRequired(), Regexp('^(([+]{0,1}\d{2})|\d?)[\s-]?[0-9]{2}[\s-]?[0-9]{3}[\s-]?[0-9]{4}$',
-            message='Please add  valid phone number'
-        )]
+        validators=[DataRequired(), Regexp(PHONE_PATTERN, message='Please add  valid phone number')]
     )
 
     image_link = StringField(
         'image_link', validators=[URL()]
     )
-    genres = SelectMultipleField(
-        'genres', validators=[DataRequired()],
-        choices=[
-            ('Alternative', 'Alternative'),
-            ('Blues', 'Blues'),
-            ('Classical', 'Classical'),
-            ('Country', 'Country'),
-            ('Electronic', 'Electronic'),
-            ('Folk', 'Folk'),
-            ('Funk', 'Funk'),
-            ('Hip-Hop', 'Hip-Hop'),
-            ('Heavy Metal', 'Heavy Metal'),
-            ('Instrumental', 'Instrumental'),
-            ('Jazz', 'Jazz'),
-            ('Musical Theatre', 'Musical Theatre'),
-            ('Pop', 'Pop'),
-            ('Punk', 'Punk'),
-            ('R&B', 'R&B'),
-            ('Reggae', 'Reggae'),
-            ('Rock n Roll', 'Rock n Roll'),
-            ('Soul', 'Soul'),
-            ('Other', 'Other'),
-        ]
+    genres = MultipleChoicesField(
+        'genres', validators=[DataRequired()], choices=GENRE_CHOICES, coerce=genre_name
     )
     facebook_link = StringField(
         'facebook_link', validators=[URL()]
@@ -237,14 +189,9 @@ class ArtistForm(Form):
     website = StringField(
         'website', validators=[URL()]
     )
-    seeking_venue = SelectField(
-        'seeking_venue', validators=[DataRequired()],
-        choices=[
-            (True, 'yes'),
-            (False, 'no')
-        ]
+    seeking_venue = ChoicesField(
+        'seeking_venue', validators=[DataRequired()], choices=YES_NO_CHOICES
     )
     seeking_description = StringField(
         'seeking_description', validators=[DataRequired()]
     )
-
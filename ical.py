@@ -0,0 +1,61 @@
+# iCalendar (RFC 5545) output for the calendar.
+#
+# Show times are local wall-clock times without a zone, so events are
+# written with floating DTSTART values: a calendar app shows them at the
+# same clock time wherever it is.
+
+PRODID = '-//Fyyur//Calendar//EN'
+
+
+def _escape(text):
+    return (text or '').replace('\\', '\\\\').replace(';', '\\;').replace(',', '\\,').replace('\n', '\\n')
+
+
+def _fold(line):
+    """Splits a content line into 75-octet pieces, continuations indented."""
+    data = line.encode('utf-8')
+    if len(data) <= 75:
+        return line
+    pieces = []
+    while data:
+        size = 75 if not pieces else 74
+        # Never cut a UTF-8 sequence in two.
+        while size < len(data) and (data[size] & 0xC0) == 0x80:
+            size -= 1
+        pieces.append(data[:size].decode('utf-8'))
+        data = data[size:]
+    return '\r\n '.join(pieces)
+
+
+def _local(value):
+    return value.strftime('%Y%m%dT%H%M%S')
+
+
+def _utc(value):
+    return value.strftime('%Y%m%dT%H%M%SZ')
+
+
+def show_events(days, url_root, host='fyyur'):
+    """VEVENT lines for the shows of calendar_days()."""
+    for day in days:
+        for show in day['shows']:
+            location = ', '.join(part for part in (
+                show['venue_name'], show['venue_address'], show['venue_city'], show['venue_state']) if part)
+            yield 'BEGIN:VEVENT'
+            yield 'UID:show-%d@%s' % (show['id'], host)
+            yield 'DTSTAMP:' + _utc(show['updated_at'])
+            yield 'DTSTART:' + _local(show['start_time'])
+            yield 'DTEND:' + _local(show['end_time'])
+            yield 'SUMMARY:' + _escape('%s at %s' % (show['artist_name'], show['venue_name']))
+            yield 'LOCATION:' + _escape(location)
+            yield 'URL:%sartists/%d' % (url_root, show['artist_id'])
+            yield 'END:VEVENT'
+
+
+def calendar(events, name='Fyyur shows'):
+    """A VCALENDAR document around event lines, CRLF-terminated and folded."""
+    lines = ['BEGIN:VCALENDAR', 'VERSION:2.0', 'PRODID:' + PRODID, 'CALSCALE:GREGORIAN',
+             'X-WR-CALNAME:' + _escape(name)]
+    lines.extend(events)
+    lines.append('END:VCALENDAR')
+    return ''.join(_fold(line) + '\r\n' for line in lines)
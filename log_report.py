@@ -0,0 +1,104 @@
+"""Latency percentiles per endpoint from the JSON request logs.
+
+    python log_report.py fyyur.log fyyur.log.1 [--sort p99] [--json]
+
+Reads the fyyur.request records written by request_log.py (other records
+are skipped) and prints, for each route, the request count, error count,
+p50/p95/p99 latency, mean database time and cache hit ratio. Sampled
+records count 1/sample_rate times, so the numbers describe all requests.
+"""
+import argparse
+import gzip
+import json
+import sys
+
+COLUMNS = ('requests', 'errors', 'p50_ms', 'p95_ms', 'p99_ms', 'db_ms', 'cache_hits')
+
+
+def read_requests(paths):
+    for path in paths:
+        opener = gzip.open if path.endswith('.gz') else open
+        with opener(path, 'rt') as lines:
+            for line in lines:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    continue
+                if entry.get('logger') == 'fyyur.request' and 'latency_ms' in entry:
+                    yield entry
+
+
+def weighted_percentile(samples, fraction):
+    """samples is a sorted list of (value, weight) pairs."""
+    total = sum(weight for _, weight in samples)
+    threshold = fraction * total
+    seen = 0.0
+    for value, weight in samples:
+        seen += weight
+        if seen >= threshold:
+            return value
+    return samples[-1][0]
+
+
+def summarize(entries):
+    routes = {}
+    for entry in entries:
+        weight = 1.0 / (entry.get('sample_rate') or 1.0)
+        route = routes.setdefault(entry.get('route') or entry.get('path'), {
+            'latencies': [], 'requests': 0.0, 'errors': 0.0, 'db_ms': 0.0, 'db_weight': 0.0,
+            'cache_hits': 0.0, 'cache_weight': 0.0,
+        })
+        route['latencies'].append((entry['latency_ms'], weight))
+        route['requests'] += weight
+        if entry.get('status', 200) >= 500:
+            route['errors'] += weight
+        if entry.get('db_ms') is not None:
+            route['db_ms'] += entry['db_ms'] * weight
+            route['db_weight'] += weight
+        if entry.get('cache_hit') is not None:
+            route['cache_hits'] += weight if entry['cache_hit'] else 0.0
+            route['cache_weight'] += weight
+
+    report = {}
+    for name, route in routes.items():
+        latencies = sorted(route['latencies'])
+        report[name] = {
+            'requests': int(round(route['requests'])),
+            'errors': int(round(route['errors'])),
+            'p50_ms': weighted_percentile(latencies, 0.50),
+            'p95_ms': weighted_percentile(latencies, 0.95),
+            'p99_ms': weighted_percentile(latencies, 0.99),
+            'db_ms': route['db_ms'] / route['db_weight'] if route['db_weight'] else None,
+            'cache_hits': route['cache_hits'] / route['cache_weight'] if route['cache_weight'] else None,
+        }
+    return report
+
+
+def _cell(value):
+    if value is None:
+        return '-'
+    if isinstance(value, float):
+        return '%.1f' % value
+    return str(value)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('paths', nargs='+')
+    parser.add_argument('--sort', choices=COLUMNS, default='p99_ms')
+    parser.add_argument('--json', action='store_true', help='print the report as JSON')
+    args = parser.parse_args(argv)
+
+    report = summarize(read_requests(args.paths))
+    if args.json:
+        print(json.dumps(report, indent=2, sort_keys=True))
+        return 0
+    width = max([len('route')] + [len(name) for name in report])
+    print(('%-*s' % (width, 'route')) + ''.join('%12s' % column for column in COLUMNS))
+    for name, row in sorted(report.items(), key=lambda item: -(item[1][args.sort] or 0)):
+        print(('%-*s' % (width, name)) + ''.join('%12s' % _cell(row[column]) for column in COLUMNS))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
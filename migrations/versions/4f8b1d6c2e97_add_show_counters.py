@@ -0,0 +1,57 @@
+"""add show counters
+
+Adds the maintained upcoming_shows_count, past_shows_count and next_show_at
+counters to venue and artist, and fills them in from the show table as of
+the upgrade. The app keeps them current from then on, with
+`flask fyyur rollover` moving begun shows from upcoming to past.
+
+Revision ID: 4f8b1d6c2e97
+Revises: 7e1c4a9f2d63
+Create Date: 2026-10-18 19:45:37.646489
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '4f8b1d6c2e97'
+down_revision = '7e1c4a9f2d63'
+branch_labels = None
+depends_on = None
+
+
+TABLES = ('venue', 'artist')
+
+
+def recount(table, now):
+    shows = 'FROM show WHERE show.{0}_id = {0}.id AND show.start_time {1} {2}'
+    return (
+        'UPDATE {0} SET upcoming_shows_count = (SELECT count(*) %s), '
+        'past_shows_count = (SELECT count(*) %s), '
+        'next_show_at = (SELECT min(show.start_time) %s)' % (
+            shows.format(table, '>', now), shows.format(table, '<=', now), shows.format(table, '>', now))
+    ).format(table)
+
+
+def upgrade():
+    # start_time holds local times.
+    if op.get_bind().dialect.name == 'postgresql':
+        now = 'LOCALTIMESTAMP'
+    else:
+        now = "datetime('now', 'localtime')"
+    for table in TABLES:
+        op.add_column(table, sa.Column('upcoming_shows_count', sa.Integer(), server_default='0', nullable=False))
+        op.add_column(table, sa.Column('past_shows_count', sa.Integer(), server_default='0', nullable=False))
+        op.add_column(table, sa.Column('next_show_at', sa.DateTime(), nullable=True))
+        op.create_index(op.f('ix_{0}_next_show_at'.format(table)), table, ['next_show_at'], unique=False)
+        op.execute(recount(table, now))
+
+
+def downgrade():
+    for table in reversed(TABLES):
+        op.drop_index(op.f('ix_{0}_next_show_at'.format(table)), table_name=table)
+        with op.batch_alter_table(table) as batch_op:
+            batch_op.drop_column('next_show_at')
+            batch_op.drop_column('past_shows_count')
+            batch_op.drop_column('upcoming_shows_count')
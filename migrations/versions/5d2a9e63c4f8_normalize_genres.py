@@ -0,0 +1,162 @@
+"""normalize genres
+
+Moves the JSON-dumped venue.genres/artist.genres strings into a genre table
+with venue_genres/artist_genres association tables, backfilling existing
+rows. On PostgreSQL the search_vector triggers now read genre names through
+the association tables, which get triggers of their own.
+
+Revision ID: 5d2a9e63c4f8
+Revises: 8c4e2b7a1d05
+Create Date: 2026-10-18 20:10:41.118230
+
+"""
+import json
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '5d2a9e63c4f8'
+down_revision = '8c4e2b7a1d05'
+branch_labels = None
+depends_on = None
+
+TABLES = ('venue', 'artist')
+
+
+def parse_genres(value):
+    # Rows hold either a JSON list or, for artists, the raw form value.
+    for char in '[]{}"':
+        value = value.replace(char, '')
+    return [name.strip() for name in value.split(',') if name.strip()]
+
+
+def genre_list(table, row):
+    return (
+        "(SELECT string_agg(genre.name, ' ') FROM {0}_genres "
+        "JOIN genre ON genre.id = {0}_genres.genre_id WHERE {0}_genres.{0}_id = {1}.id)"
+    ).format(table, row)
+
+
+def search_document(table, row, genres=None):
+    return (
+        "setweight(to_tsvector('simple', coalesce({0}.name, '')), 'A') || "
+        "setweight(to_tsvector('simple', coalesce({0}.city, '') || ' ' || coalesce({0}.state, '')), 'B') || "
+        "setweight(to_tsvector('simple', coalesce({1}, '')), 'C')"
+    ).format(row, genres or genre_list(table, row))
+
+
+def create_search_trigger(table, columns, document):
+    op.execute("""
+        CREATE OR REPLACE FUNCTION {0}_search_vector_update() RETURNS trigger AS $$
+        BEGIN
+            NEW.search_vector := {1};
+            RETURN NEW;
+        END
+        $$ LANGUAGE plpgsql
+    """.format(table, document))
+    op.execute("""
+        CREATE TRIGGER {0}_search_vector_update
+        BEFORE INSERT OR UPDATE OF {1} ON {0}
+        FOR EACH ROW EXECUTE PROCEDURE {0}_search_vector_update()
+    """.format(table, columns))
+
+
+def upgrade():
+    bind = op.get_bind()
+    genre = op.create_table('genre',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('name', sa.String(length=120), nullable=False),
+    sa.PrimaryKeyConstraint('id'),
+    sa.UniqueConstraint('name')
+    )
+    associations = {}
+    for table in TABLES:
+        associations[table] = op.create_table('{0}_genres'.format(table),
+        sa.Column('{0}_id'.format(table), sa.Integer(), nullable=False),
+        sa.Column('genre_id', sa.Integer(), nullable=False),
+        sa.ForeignKeyConstraint(['{0}_id'.format(table)], ['{0}.id'.format(table)], ondelete='CASCADE'),
+        sa.ForeignKeyConstraint(['genre_id'], ['genre.id'], ),
+        sa.PrimaryKeyConstraint('{0}_id'.format(table), 'genre_id')
+        )
+        op.create_index('ix_{0}_genres_genre_id_{0}_id'.format(table), '{0}_genres'.format(table),
+                        ['genre_id', '{0}_id'.format(table)], unique=False)
+
+    # Backfill.
+    parsed = {}
+    for table in TABLES:
+        rows = bind.execute(sa.text("SELECT id, genres FROM {0} WHERE genres IS NOT NULL".format(table)))
+        parsed[table] = [(row_id, parse_genres(genres)) for row_id, genres in rows]
+    names = sorted({name for rows in parsed.values() for _, row_genres in rows for name in row_genres})
+    if names:
+        op.bulk_insert(genre, [{'name': name} for name in names])
+    genre_ids = dict((name, genre_id) for genre_id, name in bind.execute(sa.text("SELECT id, name FROM genre")))
+    for table in TABLES:
+        links = [{'{0}_id'.format(table): row_id, 'genre_id': genre_ids[name]}
+                 for row_id, row_genres in parsed[table] for name in dict.fromkeys(row_genres)]
+        if links:
+            op.bulk_insert(associations[table], links)
+
+    if bind.dialect.name != 'postgresql':
+        for table in TABLES:
+            with op.batch_alter_table(table) as batch_op:
+                batch_op.drop_column('genres')
+        return
+
+    for table in TABLES:
+        # The old trigger depends on the genres column.
+        op.execute("DROP TRIGGER {0}_search_vector_update ON {0}".format(table))
+        op.drop_column(table, 'genres')
+        create_search_trigger(table, 'name, city, state', search_document(table, 'NEW'))
+        op.execute("""
+            CREATE FUNCTION {0}_genres_search_vector_update() RETURNS trigger AS $$
+            DECLARE
+                changed_id integer;
+            BEGIN
+                IF TG_OP = 'DELETE' THEN
+                    changed_id := OLD.{0}_id;
+                ELSE
+                    changed_id := NEW.{0}_id;
+                END IF;
+                UPDATE {0} SET search_vector = {1} WHERE {0}.id = changed_id;
+                RETURN NULL;
+            END
+            $$ LANGUAGE plpgsql
+        """.format(table, search_document(table, table)))
+        op.execute("""
+            CREATE TRIGGER {0}_genres_search_vector_update
+            AFTER INSERT OR DELETE ON {0}_genres
+            FOR EACH ROW EXECUTE PROCEDURE {0}_genres_search_vector_update()
+        """.format(table))
+        op.execute("UPDATE {0} SET search_vector = {1}".format(table, search_document(table, table)))
+
+
+def downgrade():
+    bind = op.get_bind()
+    postgres = bind.dialect.name == 'postgresql'
+    if postgres:
+        for table in TABLES:
+            op.execute("DROP TRIGGER {0}_genres_search_vector_update ON {0}_genres".format(table))
+            op.execute("DROP FUNCTION {0}_genres_search_vector_update()".format(table))
+            op.execute("DROP TRIGGER {0}_search_vector_update ON {0}".format(table))
+
+    lengths = {'venue': 120, 'artist': 500}
+    for table in TABLES:
+        with op.batch_alter_table(table) as batch_op:
+            batch_op.add_column(sa.Column('genres', sa.String(length=lengths[table]), nullable=True))
+        genres = {}
+        for row_id, name in bind.execute(sa.text(
+                "SELECT {0}_genres.{0}_id, genre.name FROM {0}_genres "
+                "JOIN genre ON genre.id = {0}_genres.genre_id ORDER BY genre.name".format(table))):
+            genres.setdefault(row_id, []).append(name)
+        for row_id, names in genres.items():
+            bind.execute(sa.text("UPDATE {0} SET genres = :genres WHERE id = :id".format(table)),
+                         genres=json.dumps(names), id=row_id)
+        if postgres:
+            create_search_trigger(table, 'name, city, state, genres',
+                                  search_document(table, 'NEW', genres='NEW.genres'))
+            op.execute("UPDATE {0} SET search_vector = {1}".format(
+                table, search_document(table, table, genres='{0}.genres'.format(table))))
+        op.drop_index('ix_{0}_genres_genre_id_{0}_id'.format(table), table_name='{0}_genres'.format(table))
+        op.drop_table('{0}_genres'.format(table))
+    op.drop_table('genre')
@@ -0,0 +1,46 @@
+"""add version columns
+
+Adds updated_at to venue, artist and show, the versions behind the ETag and
+Last-Modified headers, with the indexes the max-version queries read from.
+Existing rows are stamped with the time of the upgrade.
+
+Revision ID: 7e1c4a9f2d63
+Revises: 2b9f6d3e8a40
+Create Date: 2026-10-18 19:43:19.051971
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '7e1c4a9f2d63'
+down_revision = '2b9f6d3e8a40'
+branch_labels = None
+depends_on = None
+
+TABLES = ('venue', 'artist', 'show')
+
+
+def upgrade():
+    if op.get_bind().dialect.name == 'postgresql':
+        now = "timezone('utc', now())"
+    else:
+        now = 'CURRENT_TIMESTAMP'
+    for table in TABLES:
+        op.add_column(table, sa.Column('updated_at', sa.DateTime(), nullable=True))
+        op.execute('UPDATE "{0}" SET updated_at = {1}'.format(table, now))
+        with op.batch_alter_table(table) as batch_op:
+            batch_op.alter_column('updated_at', existing_type=sa.DateTime(), nullable=False)
+        op.create_index(op.f('ix_{0}_updated_at'.format(table)), table, ['updated_at'], unique=False)
+    op.create_index('ix_show_venue_id_updated_at', 'show', ['venue_id', 'updated_at'], unique=False)
+    op.create_index('ix_show_artist_id_updated_at', 'show', ['artist_id', 'updated_at'], unique=False)
+
+
+def downgrade():
+    op.drop_index('ix_show_artist_id_updated_at', table_name='show')
+    op.drop_index('ix_show_venue_id_updated_at', table_name='show')
+    for table in reversed(TABLES):
+        op.drop_index(op.f('ix_{0}_updated_at'.format(table)), table_name=table)
+        with op.batch_alter_table(table) as batch_op:
+            batch_op.drop_column('updated_at')
@@ -0,0 +1,63 @@
+"""add search vectors
+
+Adds a weighted tsvector column to venue and artist, kept up to date by a
+BEFORE INSERT/UPDATE trigger and indexed with GIN. PostgreSQL only: on other
+databases search.py uses its in-memory index and this revision is a no-op.
+
+Revision ID: 8c4e2b7a1d05
+Revises: 3a1f0c2d9b71
+Create Date: 2026-10-18 19:45:12.402117
+
+"""
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+
+# revision identifiers, used by Alembic.
+revision = '8c4e2b7a1d05'
+down_revision = '3a1f0c2d9b71'
+branch_labels = None
+depends_on = None
+
+TABLES = ('venue', 'artist')
+
+
+def search_document(row):
+    return (
+        "setweight(to_tsvector('simple', coalesce({0}.name, '')), 'A') || "
+        "setweight(to_tsvector('simple', coalesce({0}.city, '') || ' ' || coalesce({0}.state, '')), 'B') || "
+        "setweight(to_tsvector('simple', coalesce({0}.genres, '')), 'C')"
+    ).format(row)
+
+
+def upgrade():
+    if op.get_bind().dialect.name != 'postgresql':
+        return
+    for table in TABLES:
+        op.add_column(table, sa.Column('search_vector', postgresql.TSVECTOR(), nullable=True))
+        op.execute("""
+            CREATE FUNCTION {0}_search_vector_update() RETURNS trigger AS $$
+            BEGIN
+                NEW.search_vector := {1};
+                RETURN NEW;
+            END
+            $$ LANGUAGE plpgsql
+        """.format(table, search_document('NEW')))
+        op.execute("""
+            CREATE TRIGGER {0}_search_vector_update
+            BEFORE INSERT OR UPDATE OF name, city, state, genres ON {0}
+            FOR EACH ROW EXECUTE PROCEDURE {0}_search_vector_update()
+        """.format(table))
+        op.execute("UPDATE {0} SET search_vector = {1}".format(table, search_document(table)))
+        op.create_index('ix_{0}_search_vector'.format(table), table, ['search_vector'], postgresql_using='gin')
+
+
+def downgrade():
+    if op.get_bind().dialect.name != 'postgresql':
+        return
+    for table in TABLES:
+        op.drop_index('ix_{0}_search_vector'.format(table), table_name=table)
+        op.execute("DROP TRIGGER {0}_search_vector_update ON {0}".format(table))
+        op.execute("DROP FUNCTION {0}_search_vector_update()".format(table))
+        op.drop_column(table, 'search_vector')
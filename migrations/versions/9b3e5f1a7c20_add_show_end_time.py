@@ -0,0 +1,98 @@
+"""add show end time
+
+Adds show.end_time, filled in as start_time plus two hours, and stops an
+artist or a venue from being booked for two overlapping shows. On
+PostgreSQL that is a pair of exclusion constraints over tsrange(start_time,
+end_time), which need the btree_gist extension; on SQLite, triggers that
+look for an overlap through the (artist_id|venue_id, start_time) indexes.
+No show may last more than 24 hours, which keeps those lookups bounded.
+
+Existing double bookings make the PostgreSQL upgrade fail; they are listed
+in the error.
+
+Revision ID: 9b3e5f1a7c20
+Revises: 4f8b1d6c2e97
+Create Date: 2026-10-18 20:14:02.118734
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '9b3e5f1a7c20'
+down_revision = '4f8b1d6c2e97'
+branch_labels = None
+depends_on = None
+
+
+OVERLAPS = '''
+SELECT '{0}', earlier.{0}_id, earlier.id, later.id
+FROM show AS earlier JOIN show AS later
+  ON later.{0}_id = earlier.{0}_id AND later.start_time >= earlier.start_time AND later.start_time < earlier.end_time
+ AND (later.start_time > earlier.start_time OR later.id > earlier.id)'''
+
+SQLITE_TRIGGER = '''
+CREATE TRIGGER show_no_overlap_{event} BEFORE {trigger_event} ON show
+BEGIN
+    SELECT RAISE(ABORT, 'show lasts longer than 24 hours')
+    WHERE julianday(NEW.end_time) - julianday(NEW.start_time) > 1;
+    SELECT RAISE(ABORT, 'artist is already booked at that time')
+    WHERE EXISTS (SELECT 1 FROM show WHERE artist_id = NEW.artist_id AND id IS NOT NEW.id
+                  AND start_time > datetime(NEW.start_time, '-1 day') AND start_time < NEW.end_time
+                  AND end_time > NEW.start_time);
+    SELECT RAISE(ABORT, 'venue is already booked at that time')
+    WHERE EXISTS (SELECT 1 FROM show WHERE venue_id = NEW.venue_id AND id IS NOT NEW.id
+                  AND start_time > datetime(NEW.start_time, '-1 day') AND start_time < NEW.end_time
+                  AND end_time > NEW.start_time);
+END'''
+SQLITE_TRIGGER_EVENTS = (('insert', 'INSERT'), ('update', 'UPDATE OF artist_id, venue_id, start_time, end_time'))
+
+
+def upgrade():
+    postgresql = op.get_bind().dialect.name == 'postgresql'
+    op.add_column('show', sa.Column('end_time', sa.DateTime(), nullable=True))
+    if postgresql:
+        op.execute("UPDATE show SET end_time = start_time + interval '2 hours'")
+    else:
+        # datetime() drops the fraction SQLAlchemy writes; put it back so
+        # the text comparisons in the triggers line up.
+        op.execute("UPDATE show SET end_time = datetime(start_time, '+2 hours') || substr(start_time, 20)")
+    with op.batch_alter_table('show') as batch_op:
+        batch_op.alter_column('end_time', existing_type=sa.DateTime(), nullable=False)
+        batch_op.create_check_constraint('ck_show_end_time', 'end_time > start_time')
+
+    if postgresql:
+        # Offline (--sql) there is no data to check.
+        if not op.get_context().as_sql:
+            conflicts = op.get_bind().execute(
+                OVERLAPS.format('artist') + ' UNION ALL ' + OVERLAPS.format('venue') + ' LIMIT 20').fetchall()
+            if conflicts:
+                raise RuntimeError('Double-booked shows must be moved before upgrading: ' + ', '.join(
+                    '{} {}: shows {} and {}'.format(*conflict) for conflict in conflicts))
+        op.execute('CREATE EXTENSION IF NOT EXISTS btree_gist')
+        op.create_check_constraint('ck_show_max_duration', 'show', "end_time <= start_time + interval '24 hours'")
+        for owner in ('artist', 'venue'):
+            op.execute(
+                'ALTER TABLE show ADD CONSTRAINT ex_show_{0}_overlap '
+                'EXCLUDE USING gist ({0}_id WITH =, tsrange(start_time, end_time) WITH &&)'.format(owner))
+    else:
+        for event, trigger_event in SQLITE_TRIGGER_EVENTS:
+            op.execute(SQLITE_TRIGGER.format(event=event, trigger_event=trigger_event))
+
+
+def downgrade():
+    postgresql = op.get_bind().dialect.name == 'postgresql'
+    if postgresql:
+        for owner in ('venue', 'artist'):
+            op.drop_constraint('ex_show_{0}_overlap'.format(owner), 'show')
+        op.drop_constraint('ck_show_max_duration', 'show')
+    else:
+        for event, _ in SQLITE_TRIGGER_EVENTS:
+            op.execute('DROP TRIGGER IF EXISTS show_no_overlap_{}'.format(event))
+    with op.batch_alter_table('show') as batch_op:
+        # SQLite CHECK constraints are not reflected, so the copied table
+        # loses ck_show_end_time anyway.
+        if postgresql:
+            batch_op.drop_constraint('ck_show_end_time', type_='check')
+        batch_op.drop_column('end_time')
@@ -1,50 +1,366 @@
 # Models.
-from flask_sqlalchemy import SQLAlchemy
-db = SQLAlchemy()
+from datetime import datetime, timedelta
+from sqlalchemy import DDL, and_, case, event, func, inspect, or_
+from replicas import RoutingSQLAlchemy
+# Like flask_sqlalchemy.SQLAlchemy, but GET requests may read from a replica.
+db = RoutingSQLAlchemy()
+
+# Shows without an end time last SHOW_DEFAULT_DURATION. No show may last
+# longer than SHOW_MAX_DURATION, so a show overlapping a time t started
+# after t - SHOW_MAX_DURATION, which keeps overlap lookups index ranges.
+SHOW_DEFAULT_DURATION = timedelta(hours=2)
+SHOW_MAX_DURATION = timedelta(hours=24)
+
+
+def version_column():
+    """UTC time of the last change to a row, the basis of HTTP validators."""
+    return db.Column(db.DateTime, nullable=False, index=True, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+
+# With SOFT_DELETE, deleting a venue or an artist sets its deleted_at and
+# keeps the row; every read filters on live(). The indexes the listings use
+# are partial over the live rows, so deleted ones cost them nothing.
+LIVE = 'deleted_at IS NULL'
+
+
+def live(model):
+    """Criterion matching the venues or artists that are not deleted."""
+    return model.deleted_at.is_(None)
+
+
+def live_index(name, *columns):
+    return db.Index(name, *columns, postgresql_where=db.text(LIVE), sqlite_where=db.text(LIVE))
+
+
+venue_genres = db.Table(
+    'venue_genres',
+    db.Column('venue_id', db.Integer, db.ForeignKey('venue.id', ondelete='CASCADE'), primary_key=True),
+    db.Column('genre_id', db.Integer, db.ForeignKey('genre.id'), primary_key=True),
+    db.Index('ix_venue_genres_genre_id_venue_id', 'genre_id', 'venue_id'),
+)
+
+artist_genres = db.Table(
+    'artist_genres',
+    db.Column('artist_id', db.Integer, db.ForeignKey('artist.id', ondelete='CASCADE'), primary_key=True),
+    db.Column('genre_id', db.Integer, db.ForeignKey('genre.id'), primary_key=True),
+    db.Index('ix_artist_genres_genre_id_artist_id', 'genre_id', 'artist_id'),
+)
+
+
+class Genre(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    name = db.Column(db.String(120), nullable=False, unique=True)
+
+    @classmethod
+    def from_names(cls, names):
+        """The genres called names, creating the ones that do not exist yet."""
+        names = list(dict.fromkeys(name.strip() for name in names if name and name.strip()))
+        if not names:
+            return []
+        genres = {genre.name: genre for genre in cls.query.filter(cls.name.in_(names))}
+        for name in names:
+            if name not in genres:
+                genres[name] = cls(name=name)
+                db.session.add(genres[name])
+        return [genres[name] for name in names]
+
+    def __repr__(self):
+        return '<Genre: {}  - {} >'.format(self.id, self.name)
 
 
 class Venue(db.Model):
+    __table_args__ = (
+        live_index('ix_venue_live_state_city', 'state', 'city', 'name', 'id'),
+    )
+
     id = db.Column(db.Integer, primary_key=True)
-    name = db.Column(db.String)
+    name = db.Column(db.String, index=True)
     city = db.Column(db.String(120))
     state = db.Column(db.String(120))
     address = db.Column(db.String(120))
     phone = db.Column(db.String(120))
     image_link = db.Column(db.String(500))
     facebook_link = db.Column(db.String(120))
-    genres = db.Column(db.String(120))
+    genres = db.relationship("Genre", secondary=venue_genres, lazy="selectin", order_by=Genre.name)
     website = db.Column(db.String(500))
     seeking_talent = db.Column(db.Boolean)
     seeking_description = db.Column(db.String(120))
-    shows = db.relationship("Show", backref="venue", lazy=True)
+    # Never nulled out by the ORM: shows go with their venue (see writes.py).
+    shows = db.relationship("Show", backref=db.backref("venue", lazy="joined"), lazy="dynamic",
+                            passive_deletes=True)
+    upcoming_shows_count = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    past_shows_count = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    next_show_at = db.Column(db.DateTime, index=True)
+    updated_at = version_column()
+    deleted_at = db.Column(db.DateTime)
 
     def __repr__(self):
         return '<Venue: {}  - {} >'.format(self.id, self.name)
 
 
 class Artist(db.Model):
+    __table_args__ = (
+        live_index('ix_artist_live_name', 'name', 'id'),
+    )
+
     id = db.Column(db.Integer, primary_key=True)
-    name = db.Column(db.String(500))
+    name = db.Column(db.String(500), index=True)
     city = db.Column(db.String(500))
     state = db.Column(db.String(500))
     phone = db.Column(db.String(500))
-    genres = db.Column(db.String(500))
+    genres = db.relationship("Genre", secondary=artist_genres, lazy="selectin", order_by=Genre.name)
     website = db.Column(db.String(500))
     image_link = db.Column(db.String(500))
     facebook_link = db.Column(db.String(500))
     seeking_venue = db.Column(db.Boolean)
     seeking_description = db.Column(db.String(500))
-    shows = db.relationship("Show", backref="artist", lazy=True)
+    shows = db.relationship("Show", backref=db.backref("artist", lazy="joined"), lazy="dynamic",
+                            passive_deletes=True)
+    upcoming_shows_count = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    past_shows_count = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    next_show_at = db.Column(db.DateTime, index=True)
+    updated_at = version_column()
+    deleted_at = db.Column(db.DateTime)
 
     def __repr__(self):
         return '<Artist: {}  - {} >'.format(self.id, self.name)
 
 
 class Show(db.Model):
+    __table_args__ = (
+        db.Index('ix_show_venue_id_start_time', 'venue_id', 'start_time'),
+        db.Index('ix_show_artist_id_start_time', 'artist_id', 'start_time'),
+        db.Index('ix_show_start_time_id', 'start_time', 'id'),
+        db.Index('ix_show_venue_id_updated_at', 'venue_id', 'updated_at'),
+        db.Index('ix_show_artist_id_updated_at', 'artist_id', 'updated_at'),
+        db.CheckConstraint('end_time > start_time', name='ck_show_end_time'),
+    )
+
     id = db.Column(db.Integer, primary_key=True)
-    artist_id = db.Column(db.Integer, db.ForeignKey('artist.id'), nullable=False)
-    venue_id = db.Column(db.Integer, db.ForeignKey('venue.id'), nullable=True)
+    artist_id = db.Column(db.Integer, db.ForeignKey('artist.id', ondelete='CASCADE'), nullable=False)
+    venue_id = db.Column(db.Integer, db.ForeignKey('venue.id', ondelete='CASCADE'), nullable=True)
     start_time = db.Column(db.DateTime, nullable=False)
+    end_time = db.Column(db.DateTime, nullable=False, default=lambda context: default_end_time(
+        context.get_current_parameters()['start_time']))
+    updated_at = version_column()
 
     def __repr__(self):
         return '<Show: {}  - {}  >'.format(self.id, self.start_time)
+
+
+def default_end_time(start_time):
+    return start_time + SHOW_DEFAULT_DURATION
+
+
+class ShowHistory(db.Model):
+    """Shows moved out of the show table by archive_shows(): old past shows,
+    and the shows of soft-deleted venues and artists. No foreign keys, so
+    the history outlives what it refers to."""
+    __tablename__ = 'show_history'
+    __table_args__ = (
+        db.Index('ix_show_history_venue_id_start_time', 'venue_id', 'start_time'),
+        db.Index('ix_show_history_artist_id_start_time', 'artist_id', 'start_time'),
+    )
+
+    id = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    artist_id = db.Column(db.Integer, nullable=False)
+    venue_id = db.Column(db.Integer)
+    start_time = db.Column(db.DateTime, nullable=False)
+    end_time = db.Column(db.DateTime, nullable=False)
+    updated_at = db.Column(db.DateTime, nullable=False)
+    archived_at = db.Column(db.DateTime, nullable=False)
+
+
+# An artist or a venue cannot hold two shows at once. PostgreSQL enforces it
+# with exclusion constraints over [start_time, end_time) ranges (btree_gist
+# supplies the = on the ids), SQLite with triggers that look for an overlap
+# through the (artist_id|venue_id, start_time) indexes. Migration
+# 9b3e5f1a7c20 creates the same objects on existing databases.
+for _statement in (
+    'CREATE EXTENSION IF NOT EXISTS btree_gist',
+    "ALTER TABLE show ADD CONSTRAINT ck_show_max_duration CHECK (end_time <= start_time + interval '24 hours')",
+    'ALTER TABLE show ADD CONSTRAINT ex_show_artist_overlap '
+    'EXCLUDE USING gist (artist_id WITH =, tsrange(start_time, end_time) WITH &&)',
+    'ALTER TABLE show ADD CONSTRAINT ex_show_venue_overlap '
+    'EXCLUDE USING gist (venue_id WITH =, tsrange(start_time, end_time) WITH &&)',
+):
+    event.listen(Show.__table__, 'after_create', DDL(_statement).execute_if(dialect='postgresql'))
+
+SQLITE_OVERLAP_TRIGGER = '''
+CREATE TRIGGER show_no_overlap_{event} BEFORE {trigger_event} ON show
+BEGIN
+    SELECT RAISE(ABORT, 'show lasts longer than 24 hours')
+    WHERE julianday(NEW.end_time) - julianday(NEW.start_time) > 1;
+    SELECT RAISE(ABORT, 'artist is already booked at that time')
+    WHERE EXISTS (SELECT 1 FROM show WHERE artist_id = NEW.artist_id AND id IS NOT NEW.id
+                  AND start_time > datetime(NEW.start_time, '-1 day') AND start_time < NEW.end_time
+                  AND end_time > NEW.start_time);
+    SELECT RAISE(ABORT, 'venue is already booked at that time')
+    WHERE EXISTS (SELECT 1 FROM show WHERE venue_id = NEW.venue_id AND id IS NOT NEW.id
+                  AND start_time > datetime(NEW.start_time, '-1 day') AND start_time < NEW.end_time
+                  AND end_time > NEW.start_time);
+END'''
+for _event, _trigger_event in (('insert', 'INSERT'),
+                               ('update', 'UPDATE OF artist_id, venue_id, start_time, end_time')):
+    event.listen(Show.__table__, 'after_create', DDL(SQLITE_OVERLAP_TRIGGER.format(
+        event=_event, trigger_event=_trigger_event)).execute_if(dialect='sqlite'))
+
+
+def show_overlaps(artist_id, venue_id, start_time, end_time, exclude_id=None):
+    """Criteria matching the shows of the artist or the venue that overlap
+    [start_time, end_time): two index range scans, whatever the history."""
+    window = and_(Show.start_time > start_time - SHOW_MAX_DURATION, Show.start_time < end_time,
+                  Show.end_time > start_time)
+    criteria = or_(and_(Show.artist_id == artist_id, window), and_(Show.venue_id == venue_id, window))
+    if exclude_id is not None:
+        criteria = and_(criteria, Show.id != exclude_id)
+    return criteria
+
+
+# Versions have to move whenever a page built from a row could change.
+# Genre changes only touch the association tables, so they bump the entity's
+# version themselves, and a venue or artist shown on the other side's show
+# tiles bumps those pages when its name or picture changes. Shows bump the
+# venues and artists they belong to through the counters below. Core
+# updates do not fire ORM events, so none of this recurses.
+
+def _touch_genres_owner(target, value, *args):
+    target.updated_at = datetime.utcnow()
+
+
+for _model in (Venue, Artist):
+    for _event in ('append', 'remove'):
+        event.listen(_model.genres, _event, _touch_genres_owner)
+
+
+def _touch(connection, model, ids):
+    connection.execute(model.__table__.update().where(model.id.in_(ids)).values(updated_at=datetime.utcnow()))
+
+
+def _touch_tile_pages(model, own_fk, other_model, other_fk):
+    def after_update(mapper, connection, target):
+        state = inspect(target)
+        if state.attrs.name.history.has_changes() or state.attrs.image_link.history.has_changes():
+            _touch(connection, other_model,
+                   db.select([other_fk]).where(own_fk == target.id).distinct())
+    event.listen(model, 'after_update', after_update)
+
+
+_touch_tile_pages(Venue, Show.venue_id, Artist, Show.artist_id)
+_touch_tile_pages(Artist, Show.artist_id, Venue, Show.venue_id)
+
+
+# Show counters. Venues and artists keep their upcoming and past show
+# counts and their next show's start, so listings never read the Show table.
+# Inserts bump them in the same flush; deletes and moves recount the rows
+# involved, and roll_over_shows() recounts rows whose next show has begun.
+# Being Core updates they also bump updated_at, which the page versions
+# rely on.
+
+def _counted_fk(model):
+    return Show.venue_id if model is Venue else Show.artist_id
+
+
+def show_counters(model, now):
+    """SET clause recounting the show counters of model rows as of now."""
+    fk = _counted_fk(model)
+    upcoming = and_(fk == model.id, Show.start_time > now)
+    return {
+        'upcoming_shows_count': db.select([func.count(Show.id)]).where(upcoming).as_scalar(),
+        'past_shows_count': db.select([func.count(Show.id)])
+            .where(and_(fk == model.id, Show.start_time <= now)).as_scalar(),
+        'next_show_at': db.select([func.min(Show.start_time)]).where(upcoming).as_scalar(),
+    }
+
+
+def refresh_show_counters(connection, model, ids=None, now=None):
+    """Recounts the counters of the model rows with ids, or of every row."""
+    statement = model.__table__.update().values(show_counters(model, now or datetime.now()))
+    if ids is not None:
+        ids = [id for id in ids if id is not None]
+        if not ids:
+            return
+        statement = statement.where(model.id.in_(ids))
+    connection.execute(statement)
+
+
+def roll_over_shows(connection, now=None):
+    """Moves shows that have begun since the last run from the upcoming to
+    the past counters. Returns the number of venues and artists updated."""
+    now = now or datetime.now()
+    updated = 0
+    for model in (Venue, Artist):
+        updated += connection.execute(
+            model.__table__.update().where(model.next_show_at <= now).values(show_counters(model, now))
+        ).rowcount
+    return updated
+
+
+# Archive. Past shows older than SHOW_ARCHIVE_DAYS are moved to
+# show_history by `flask fyyur archive-shows`, a batch per transaction, so
+# the show table and its indexes only hold what pages list. Archived shows
+# drop out of the past show counts and pages.
+
+HISTORY_COLUMNS = ('id', 'artist_id', 'venue_id', 'start_time', 'end_time', 'updated_at')
+# Ids per INSERT ... SELECT and DELETE, under SQLite's variable limit.
+ARCHIVE_CHUNK_SIZE = 500
+
+
+def archive_shows(connection, criteria, limit=None, now=None):
+    """Moves the shows matching criteria (up to limit, oldest first) into
+    show_history and recounts their venues and artists. Returns how many
+    were moved."""
+    now = now or datetime.utcnow()
+    query = db.select([Show.id, Show.venue_id, Show.artist_id]).where(criteria).order_by(Show.start_time, Show.id)
+    rows = connection.execute(query.limit(limit) if limit else query).fetchall()
+    history = ShowHistory.__table__
+    columns = [Show.__table__.c[name] for name in HISTORY_COLUMNS]
+    for start in range(0, len(rows), ARCHIVE_CHUNK_SIZE):
+        ids = [row.id for row in rows[start:start + ARCHIVE_CHUNK_SIZE]]
+        connection.execute(history.insert().from_select(
+            list(HISTORY_COLUMNS) + ['archived_at'],
+            db.select(columns + [db.literal(now, db.DateTime)]).where(Show.id.in_(ids))))
+        connection.execute(Show.__table__.delete().where(Show.id.in_(ids)))
+    refresh_show_counters(connection, Venue, set(row.venue_id for row in rows))
+    refresh_show_counters(connection, Artist, set(row.artist_id for row in rows))
+    return len(rows)
+
+
+@event.listens_for(Show, 'after_insert')
+def _count_new_show(mapper, connection, target):
+    if not isinstance(target.start_time, datetime):
+        # Left as the submitted string; let the database parse it.
+        for model in (Venue, Artist):
+            refresh_show_counters(connection, model, [getattr(target, _counted_fk(model).key)])
+        return
+    upcoming = target.start_time > datetime.now()
+    for model in (Venue, Artist):
+        owner_id = getattr(target, _counted_fk(model).key)
+        if owner_id is None:
+            continue
+        if upcoming:
+            values = {
+                model.upcoming_shows_count: model.upcoming_shows_count + 1,
+                model.next_show_at: case([(or_(model.next_show_at.is_(None), model.next_show_at > target.start_time),
+                                           target.start_time)], else_=model.next_show_at),
+            }
+        else:
+            values = {model.past_shows_count: model.past_shows_count + 1}
+        connection.execute(model.__table__.update().where(model.id == owner_id).values(values))
+
+
+@event.listens_for(Show, 'after_delete')
+def _uncount_deleted_show(mapper, connection, target):
+    refresh_show_counters(connection, Venue, [target.venue_id])
+    refresh_show_counters(connection, Artist, [target.artist_id])
+
+
+@event.listens_for(Show, 'after_update')
+def _recount_moved_show(mapper, connection, target):
+    state = inspect(target)
+    if not state.attrs.start_time.history.has_changes() and not state.attrs.venue_id.history.has_changes() \
+            and not state.attrs.artist_id.history.has_changes():
+        return
+    for model in (Venue, Artist):
+        history = getattr(state.attrs, _counted_fk(model).key).history
+        refresh_show_counters(connection, model, list(history.deleted) + [getattr(target, _counted_fk(model).key)])
@@ -0,0 +1,105 @@
+# Connection pool metrics.
+#
+# InstrumentedQueuePool is SQLAlchemy's QueuePool with counters for how long
+# checkouts wait for a connection, how close the pool runs to its limit and
+# how often connections are opened and closed. config.py selects it through
+# SQLALCHEMY_ENGINE_OPTIONS['poolclass']; /db/stats reports the counters.
+import threading
+import time
+from sqlalchemy import event, exc
+from sqlalchemy.pool import QueuePool
+
+# Upper bounds, in milliseconds, of the checkout wait histogram buckets.
+WAIT_BUCKETS_MS = (1, 5, 10, 50, 100, 500, 1000, 5000)
+
+
+class PoolMetrics(object):
+    """Thread-safe counters for one pool."""
+
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self._lock = threading.Lock()
+        self.checkouts = 0
+        self.timeouts = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+        self.wait_buckets = [0] * (len(WAIT_BUCKETS_MS) + 1)
+        self.checked_out = 0
+        self.peak_checked_out = 0
+        self.saturated_checkouts = 0
+        self.connects = 0
+        self.closes = 0
+        self.invalidations = 0
+
+    def checkout(self, wait):
+        wait_ms = wait * 1000
+        bucket = next((i for i, bound in enumerate(WAIT_BUCKETS_MS) if wait_ms <= bound), len(WAIT_BUCKETS_MS))
+        with self._lock:
+            self.checkouts += 1
+            self.wait_total += wait
+            self.wait_max = max(self.wait_max, wait)
+            self.wait_buckets[bucket] += 1
+            self.checked_out += 1
+            self.peak_checked_out = max(self.peak_checked_out, self.checked_out)
+            if self.capacity and self.checked_out >= self.capacity:
+                self.saturated_checkouts += 1
+
+    def timeout(self, wait):
+        with self._lock:
+            self.timeouts += 1
+            self.wait_total += wait
+            self.wait_max = max(self.wait_max, wait)
+
+    def checkin(self):
+        with self._lock:
+            self.checked_out -= 1
+
+    def count(self, name):
+        with self._lock:
+            setattr(self, name, getattr(self, name) + 1)
+
+    def report(self):
+        with self._lock:
+            buckets = dict(('<=%dms' % bound, n) for bound, n in zip(WAIT_BUCKETS_MS, self.wait_buckets))
+            buckets['>%dms' % WAIT_BUCKETS_MS[-1]] = self.wait_buckets[-1]
+            waits = self.checkouts + self.timeouts
+            return {
+                'capacity': self.capacity,
+                'checked_out': self.checked_out,
+                'peak_checked_out': self.peak_checked_out,
+                'saturation': float(self.checked_out) / self.capacity if self.capacity else None,
+                'checkouts': self.checkouts,
+                'saturated_checkouts': self.saturated_checkouts,
+                'timeouts': self.timeouts,
+                'wait_avg_ms': self.wait_total * 1000 / waits if waits else 0.0,
+                'wait_max_ms': self.wait_max * 1000,
+                'wait_histogram': buckets,
+                'connects': self.connects,
+                'closes': self.closes,
+                'invalidations': self.invalidations,
+            }
+
+
+class InstrumentedQueuePool(QueuePool):
+    """QueuePool that records checkout waits, saturation and churn in .metrics."""
+
+    def __init__(self, creator, pool_size=5, max_overflow=10, **kw):
+        super(InstrumentedQueuePool, self).__init__(creator, pool_size=pool_size, max_overflow=max_overflow, **kw)
+        # A negative max_overflow means no limit.
+        self.metrics = PoolMetrics(pool_size + max_overflow if max_overflow >= 0 else None)
+        event.listen(self, 'checkin', lambda dbapi_connection, record: self.metrics.checkin())
+        event.listen(self, 'connect', lambda dbapi_connection, record: self.metrics.count('connects'))
+        event.listen(self, 'close', lambda dbapi_connection, record: self.metrics.count('closes'))
+        event.listen(self, 'invalidate', lambda dbapi_connection, record, error: self.metrics.count('invalidations'))
+
+    def _do_get(self):
+        # _do_get is where QueuePool blocks for a free slot, so timing it
+        # gives the checkout wait without timing the query afterwards.
+        start = time.perf_counter()
+        try:
+            connection = super(InstrumentedQueuePool, self)._do_get()
+        except exc.TimeoutError:
+            self.metrics.timeout(time.perf_counter() - start)
+            raise
+        self.metrics.checkout(time.perf_counter() - start)
+        return connection
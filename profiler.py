@@ -0,0 +1,163 @@
+# SQL profiler.
+#
+# Times every statement a request sends through SQLAlchemy's
+# before/after_cursor_execute hooks and reports the totals in a Server-Timing
+# header, a log record and, optionally, a panel appended to HTML pages. The
+# same statement shape running more than SQL_PROFILER_N_PLUS_ONE times in
+# one request is reported as a likely N+1 lazy load. Views can declare a
+# query budget with @query_budget(n); with SQL_PROFILER_ENFORCE_BUDGETS set
+# (in tests) a request going over it raises QueryBudgetExceeded.
+import logging
+import re
+import time
+from collections import Counter
+from flask import current_app, g, has_request_context, request
+from markupsafe import escape
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+logger = logging.getLogger('fyyur.sql')
+
+_STRING = re.compile(r"'(?:[^']|'')*'")
+_NUMBER = re.compile(r'\b\d+(?:\.\d+)?\b')
+_PARAMETER_LIST = re.compile(r'\((?:\s*(?:\?|%s|%\(\w+\)s|:\w+)\s*,)+\s*(?:\?|%s|%\(\w+\)s|:\w+)\s*\)')
+_SPACE = re.compile(r'\s+')
+
+
+def normalize(statement):
+    """The shape of a statement: literals and parameter lists collapsed."""
+    shape = _STRING.sub('?', statement)
+    shape = _NUMBER.sub('?', shape)
+    shape = _PARAMETER_LIST.sub('(?)', shape)
+    return _SPACE.sub(' ', shape).strip()
+
+
+class QueryBudgetExceeded(AssertionError):
+    pass
+
+
+def query_budget(statements):
+    """Declares the most statements a view may send per request.
+
+    Put it right under @app.route so it marks the registered view.
+    """
+    def decorator(view):
+        view.query_budget = statements
+        return view
+    return decorator
+
+
+class RequestProfile(object):
+    """Statements sent while handling one request."""
+
+    def __init__(self):
+        self.count = 0
+        self.duration = 0.0
+        self.shapes = Counter()
+        self.shape_durations = Counter()
+
+    def record(self, statement, duration):
+        shape = normalize(statement)
+        self.count += 1
+        self.duration += duration
+        self.shapes[shape] += 1
+        self.shape_durations[shape] += duration
+
+    def repeated(self, threshold):
+        """(shape, count) of the statements run more than threshold times."""
+        return [(shape, n) for shape, n in self.shapes.most_common() if n > threshold]
+
+
+def _current_profile():
+    if has_request_context():
+        return getattr(g, 'sql_profile', None)
+    return None
+
+
+@event.listens_for(Engine, 'before_cursor_execute')
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if _current_profile() is not None:
+        conn.info.setdefault('sql_profile_start', []).append(time.perf_counter())
+
+
+@event.listens_for(Engine, 'after_cursor_execute')
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    profile = _current_profile()
+    starts = conn.info.get('sql_profile_start')
+    if profile is not None and starts:
+        profile.record(statement, time.perf_counter() - starts.pop())
+
+
+class SQLProfiler(object):
+    """Profiles the statements of every request of an app.
+
+    Configured from SQL_PROFILER (on/off), SQL_PROFILER_N_PLUS_ONE,
+    SQL_PROFILER_PANEL and SQL_PROFILER_ENFORCE_BUDGETS.
+    """
+
+    def __init__(self, app=None):
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.extensions['sql_profiler'] = self
+        if not app.config.get('SQL_PROFILER', True):
+            return
+        app.before_request(self._start)
+        app.after_request(self._finish)
+
+    def _start(self):
+        g.sql_profile = RequestProfile()
+        g.request_started = time.perf_counter()
+
+    def _finish(self, response):
+        profile = g.get('sql_profile')
+        if profile is None:
+            return response
+        config = current_app.config
+        elapsed = time.perf_counter() - g.request_started
+        repeated = profile.repeated(config.get('SQL_PROFILER_N_PLUS_ONE', 5))
+
+        response.headers.add('Server-Timing', 'db;dur=%.1f;desc="%d queries"' % (profile.duration * 1000, profile.count))
+        response.headers.add('Server-Timing', 'app;dur=%.1f' % (elapsed * 1000))
+
+        record = {
+            'route': request.endpoint,
+            'method': request.method,
+            'path': request.path,
+            'status': response.status_code,
+            'queries': profile.count,
+            'db_ms': round(profile.duration * 1000, 2),
+        }
+        if repeated:
+            record['n_plus_one'] = [{'statement': shape, 'count': n} for shape, n in repeated]
+            logger.warning('possible N+1 queries in %s', request.endpoint, extra=record)
+        else:
+            logger.debug('sql %s', request.endpoint, extra=record)
+
+        view = current_app.view_functions.get(request.endpoint)
+        budget = getattr(view, 'query_budget', None)
+        if budget is not None and profile.count > budget:
+            message = '%s sent %d statements, over its budget of %d' % (request.endpoint, profile.count, budget)
+            if config.get('SQL_PROFILER_ENFORCE_BUDGETS'):
+                raise QueryBudgetExceeded(message)
+            logger.warning(message, extra=record)
+
+        if config.get('SQL_PROFILER_PANEL') and response.mimetype == 'text/html' and not response.is_streamed:
+            body = response.get_data(as_text=True)
+            if '</body>' in body:
+                response.set_data(body.replace('</body>', self._panel(profile, repeated) + '</body>', 1))
+        return response
+
+    @staticmethod
+    def _panel(profile, repeated):
+        flagged = set(shape for shape, _ in repeated)
+        rows = ''.join(
+            '<tr%s><td>%d</td><td>%.1f</td><td><code>%s</code></td></tr>' % (
+                ' class="danger"' if shape in flagged else '', n, profile.shape_durations[shape] * 1000, escape(shape))
+            for shape, n in profile.shapes.most_common()
+        )
+        return (
+            '<div id="sql-profiler" class="container"><h4>SQL: %d statements, %.1fms%s</h4>'
+            '<table class="table table-condensed"><tr><th>Runs</th><th>ms</th><th>Statement</th></tr>%s</table></div>'
+        ) % (profile.count, profile.duration * 1000, ', possible N+1' if repeated else '', rows)
@@ -0,0 +1,495 @@
+# Queries.
+from datetime import date, datetime
+from sqlalchemy import and_, func, inspect, literal, or_, tuple_
+from sqlalchemy.orm import aliased, defaultload, lazyload
+from model import db, Show, Venue, Artist, Genre, artist_genres, show_overlaps, live
+
+SHOWS_PER_PAGE = 24
+GENRE_RESULTS_PER_PAGE = 20
+FEED_PAGE_SIZE = 60
+FEED_MAX_PAGE_SIZE = 500
+API_PAGE_SIZE = 50
+CALENDAR_MAX_DAYS = 366
+CURSOR_FORMAT = '%Y%m%d%H%M%S%f'
+
+
+LISTING_SORTS = ('name', 'next_show')
+
+
+def _listing_order(model, sort):
+    if sort == 'next_show':
+        # Venues and artists without upcoming shows go last.
+        return [model.next_show_at.is_(None), model.next_show_at, model.name, model.id]
+    return [model.name, model.id]
+
+
+def venue_areas(upcoming_only=False, sort='name'):
+    """Venues grouped by (city, state) with their upcoming show counts.
+
+    The counts are the maintained counters on Venue, so one statement over
+    the venue table does, ordered by area so the rows are grouped in a
+    single pass. upcoming_only keeps the venues with upcoming shows; sort is
+    'name' or 'next_show' within each area.
+    """
+    venues = db.session.query(Venue.city, Venue.state, Venue.id, Venue.name, Venue.upcoming_shows_count) \
+        .filter(live(Venue))
+    if upcoming_only:
+        venues = venues.filter(Venue.upcoming_shows_count > 0)
+    rows = venues.order_by(Venue.state, Venue.city, *_listing_order(Venue, sort)).all()
+
+    areas = []
+    area = None
+    for city, state, venue_id, name, upcoming in rows:
+        if area is None or (area["city"], area["state"]) != (city, state):
+            area = {"city": city, "state": state, "venues": []}
+            areas.append(area)
+        area["venues"].append({"id": venue_id, "name": name, "num_upcoming_shows": upcoming})
+    return areas
+
+
+def artist_list(upcoming_only=False, sort='name'):
+    """Artists with their upcoming show counts, read from the counters."""
+    artists = db.session.query(Artist.id, Artist.name, Artist.upcoming_shows_count).filter(live(Artist))
+    if upcoming_only:
+        artists = artists.filter(Artist.upcoming_shows_count > 0)
+    return [{"id": artist_id, "name": name, "num_upcoming_shows": upcoming}
+            for artist_id, name, upcoming in artists.order_by(*_listing_order(Artist, sort))]
+
+
+def _count_shows(fk, now, upcoming):
+    """Correlated scalar subquery counting the upcoming or past shows of an entity."""
+    when = Show.start_time > now if upcoming else Show.start_time <= now
+    return db.session.query(func.count(Show.id)).filter(fk, when).as_scalar()
+
+
+def _show_page(shows, now, upcoming, page, per_page):
+    if upcoming:
+        shows = shows.filter(Show.start_time > now).order_by(Show.start_time, Show.id)
+    else:
+        shows = shows.filter(Show.start_time <= now).order_by(Show.start_time.desc(), Show.id.desc())
+    return shows.limit(per_page).offset((page - 1) * per_page).all()
+
+
+def _artist_tile(show):
+    return {
+        "artist_id": show.artist.id,
+        "artist_name": show.artist.name,
+        "artist_image_link": show.artist.image_link,
+        "start_time": show.start_time,
+    }
+
+
+def _venue_tile(show):
+    return {
+        "venue_id": show.venue.id,
+        "venue_name": show.venue.name,
+        "venue_image_link": show.venue.image_link,
+        "start_time": show.start_time,
+    }
+
+
+def _pager(page, per_page, count):
+    return {"page": page, "has_prev": page > 1, "has_next": page * per_page < count}
+
+
+def venue_detail(venue_id, upcoming_page=1, past_page=1, per_page=SHOWS_PER_PAGE, now=None):
+    """Detail page data for a venue, or None if it does not exist.
+
+    Four statements whatever the number of shows: the venue with both show
+    counts, its genres, then one page each of upcoming and past shows with
+    their artist joined in.
+    """
+    now = now or datetime.now()
+    upcoming_page, past_page = max(upcoming_page, 1), max(past_page, 1)
+    row = db.session.query(
+        Venue,
+        _count_shows(Show.venue_id == Venue.id, now, upcoming=True),
+        _count_shows(Show.venue_id == Venue.id, now, upcoming=False),
+    ).filter(Venue.id == venue_id, live(Venue)).first()
+    if row is None:
+        return None
+    venue, upcoming_count, past_count = row
+
+    # Show.venue is this venue, already in the identity map; the artists'
+    # genres are not shown on the tiles.
+    shows = venue.shows.options(lazyload(Show.venue), defaultload(Show.artist).lazyload(Artist.genres))
+    upcoming_shows = [_artist_tile(show) for show in _show_page(shows, now, True, upcoming_page, per_page)]
+    past_shows = [_artist_tile(show) for show in _show_page(shows, now, False, past_page, per_page)]
+    return {
+        "id": venue.id,
+        "name": venue.name,
+        "genres": [genre.name for genre in venue.genres],
+        "address": venue.address,
+        "city": venue.city,
+        "state": venue.state,
+        "phone": venue.phone,
+        "website": venue.website,
+        "facebook_link": venue.facebook_link,
+        "seeking_talent": venue.seeking_talent,
+        "seeking_description": venue.seeking_description,
+        "image_link": venue.image_link,
+        "upcoming_shows": upcoming_shows,
+        "past_shows": past_shows,
+        "past_shows_count": past_count,
+        "upcoming_shows_count": upcoming_count,
+        "upcoming_shows_page": _pager(upcoming_page, per_page, upcoming_count),
+        "past_shows_page": _pager(past_page, per_page, past_count),
+    }
+
+
+def artist_detail(artist_id, upcoming_page=1, past_page=1, per_page=SHOWS_PER_PAGE, now=None):
+    """Detail page data for an artist, or None if it does not exist.
+
+    Same shape as venue_detail, with each show's venue joined in.
+    """
+    now = now or datetime.now()
+    upcoming_page, past_page = max(upcoming_page, 1), max(past_page, 1)
+    row = db.session.query(
+        Artist,
+        _count_shows(Show.artist_id == Artist.id, now, upcoming=True),
+        _count_shows(Show.artist_id == Artist.id, now, upcoming=False),
+    ).filter(Artist.id == artist_id, live(Artist)).first()
+    if row is None:
+        return None
+    artist, upcoming_count, past_count = row
+
+    shows = artist.shows.options(lazyload(Show.artist), defaultload(Show.venue).lazyload(Venue.genres))
+    upcoming_shows = [_venue_tile(show) for show in _show_page(shows, now, True, upcoming_page, per_page)]
+    past_shows = [_venue_tile(show) for show in _show_page(shows, now, False, past_page, per_page)]
+    return {
+        "id": artist.id,
+        "name": artist.name,
+        "genres": [genre.name for genre in artist.genres],
+        "city": artist.city,
+        "state": artist.state,
+        "phone": artist.phone,
+        "website": artist.website,
+        "facebook_link": artist.facebook_link,
+        "seeking_venue": artist.seeking_venue,
+        "seeking_description": artist.seeking_description,
+        "image_link": artist.image_link,
+        "upcoming_shows": upcoming_shows,
+        "past_shows": past_shows,
+        "past_shows_count": past_count,
+        "upcoming_shows_count": upcoming_count,
+        "upcoming_shows_page": _pager(upcoming_page, per_page, upcoming_count),
+        "past_shows_page": _pager(past_page, per_page, past_count),
+    }
+
+
+def browse_genre(model, genre, state=None, page=1, per_page=GENRE_RESULTS_PER_PAGE):
+    """Venues or artists with a genre, optionally in one state, by name.
+
+    Resolved through the genre name index and the (genre_id, entity_id)
+    index of the association table rather than by scanning the entities.
+    """
+    page = max(page, 1)
+    association = model.genres.property.secondary
+    entity_id = association.c[model.__tablename__ + '_id']
+    results = db.session.query(model.id, model.name, model.city, model.state) \
+        .join(association, entity_id == model.id) \
+        .join(Genre, Genre.id == association.c.genre_id) \
+        .filter(Genre.name == genre, live(model))
+    if state:
+        results = results.filter(model.state == state)
+    count = results.count()
+    rows = results.order_by(model.name, model.id).limit(per_page).offset((page - 1) * per_page).all()
+    return {
+        "count": count,
+        "data": [{"id": row.id, "name": row.name, "city": row.city, "state": row.state} for row in rows],
+        "page": page,
+        "has_prev": page > 1,
+        "has_next": page * per_page < count,
+    }
+
+
+def _latest(column, *criteria):
+    return db.session.query(func.max(column)).filter(*criteria).as_scalar()
+
+
+def _local_to_utc(value):
+    # start_time holds local wall-clock times while versions are UTC.
+    return value and datetime.utcfromtimestamp(value.timestamp())
+
+
+def entity_version(model, entity_id, now=None):
+    """Validators of a venue or artist page, or None if it does not exist.
+
+    The entity's own version, the latest version among its shows and the
+    start of its latest show to have begun, which is when the page last
+    moved a show from upcoming to past. One statement answered from the
+    (fk, updated_at) and (fk, start_time) indexes.
+    """
+    now = now or datetime.now()
+    fk = Show.venue_id if model is Venue else Show.artist_id
+    row = db.session.query(
+        model.updated_at,
+        _latest(Show.updated_at, fk == model.id),
+        _latest(Show.start_time, fk == model.id, Show.start_time <= now),
+    ).filter(model.id == entity_id, live(model)).first()
+    if row is None:
+        return None
+    updated_at, shows_updated_at, last_started = row
+    return updated_at, shows_updated_at, _local_to_utc(last_started)
+
+
+def listing_version(model):
+    """Validators of a list of venues or artists: their latest version and
+    count. Show counts live on the rows, so their versions cover them."""
+    return tuple(db.session.query(func.max(model.updated_at), func.count(model.id)).filter(live(model)).one())
+
+
+def feed_version():
+    """Validators of the /shows feed, whose tiles also carry venue and artist fields."""
+    return db.session.query(
+        func.max(Show.updated_at), _latest(Venue.updated_at), _latest(Artist.updated_at)
+    ).one()
+
+
+def encode_cursor(start_time, show_id):
+    return '{}_{}'.format(start_time.strftime(CURSOR_FORMAT), show_id)
+
+
+def decode_cursor(cursor):
+    """Returns the (start_time, id) a cursor points after, or None if it is malformed."""
+    try:
+        stamp, show_id = cursor.split('_')
+        return datetime.strptime(stamp, CURSOR_FORMAT), int(show_id)
+    except (AttributeError, ValueError):
+        return None
+
+
+class ShowFeed(object):
+    """One keyset page of shows ordered by (start_time, id).
+
+    Rows are fetched and turned into tiles while the feed is iterated, so a
+    streamed template never holds more than a batch of them. Once iteration
+    is over, next_cursor points after the last tile if there are more shows.
+    """
+
+    def __init__(self, after=None, limit=FEED_PAGE_SIZE, batch_size=100):
+        self.after = after
+        self.limit = max(1, min(limit, FEED_MAX_PAGE_SIZE))
+        self.batch_size = batch_size
+        self.next_cursor = None
+
+    def query(self):
+        shows = db.session.query(
+            Show.id, Show.start_time,
+            Venue.id.label('venue_id'), Venue.name.label('venue_name'),
+            Artist.id.label('artist_id'), Artist.name.label('artist_name'),
+            Artist.image_link.label('artist_image_link'),
+        ).join(Venue, Venue.id == Show.venue_id).join(Artist, Artist.id == Show.artist_id)
+        if self.after is not None:
+            shows = shows.filter(tuple_(Show.start_time, Show.id) > tuple_(*self.after))
+        # One extra row tells whether there is a next page.
+        return shows.order_by(Show.start_time, Show.id).limit(self.limit + 1)
+
+    def __iter__(self):
+        self.next_cursor = None
+        last = None
+        for n, row in enumerate(self.query().yield_per(self.batch_size)):
+            if n == self.limit:
+                self.next_cursor = encode_cursor(last.start_time, last.id)
+                break
+            last = row
+            yield {
+                'venue_id': row.venue_id,
+                'venue_name': row.venue_name,
+                'artist_id': row.artist_id,
+                'artist_name': row.artist_name,
+                'artist_image_link': row.artist_image_link,
+                'start_time': row.start_time
+            }
+
+
+# Calendar.
+#
+# Shows starting in a [start, end) range of local times, found with a range
+# scan of ix_show_start_time_id, optionally narrowed to a venue city/state
+# and to artists playing a genre.
+
+def _in_range(query, start, end, city=None, state=None, genre=None, venue_joined=False):
+    query = query.filter(Show.start_time >= start, Show.start_time < end)
+    if (city or state) and not venue_joined:
+        query = query.join(Venue, Venue.id == Show.venue_id)
+    if city:
+        query = query.filter(Venue.city == city)
+    if state:
+        query = query.filter(Venue.state == state)
+    if genre:
+        query = query.join(artist_genres, artist_genres.c.artist_id == Show.artist_id) \
+            .join(Genre, Genre.id == artist_genres.c.genre_id).filter(Genre.name == genre)
+    return query
+
+
+def calendar_days(start, end, city=None, state=None, genre=None):
+    """The shows in range grouped by day: [{"date", "shows"}] in time order.
+
+    One statement; the rows come back ordered by start time, so the days are
+    cut in a single pass.
+    """
+    shows = db.session.query(
+        Show.id, Show.start_time, Show.end_time, Show.updated_at,
+        Venue.id.label('venue_id'), Venue.name.label('venue_name'), Venue.address.label('venue_address'),
+        Venue.city.label('venue_city'), Venue.state.label('venue_state'),
+        Artist.id.label('artist_id'), Artist.name.label('artist_name'),
+        Artist.image_link.label('artist_image_link'),
+    ).join(Venue, Venue.id == Show.venue_id).join(Artist, Artist.id == Show.artist_id)
+    shows = _in_range(shows, start, end, city, state, genre, venue_joined=True)
+
+    days = []
+    day = None
+    for row in shows.order_by(Show.start_time, Show.id):
+        if day is None or day["date"] != row.start_time.date():
+            day = {"date": row.start_time.date(), "shows": []}
+            days.append(day)
+        day["shows"].append(row._asdict())
+    return days
+
+
+def calendar_counts(start, end, city=None, state=None, genre=None):
+    """{date: number of shows} for the days in range that have shows, from
+    one GROUP BY statement."""
+    day = func.date(Show.start_time).label('day')
+    counts = _in_range(db.session.query(day, func.count(Show.id)).select_from(Show), start, end, city, state, genre)
+    # SQLite's date() returns text.
+    return dict((value if isinstance(value, date) else date.fromisoformat(value), n)
+                for value, n in counts.group_by(day))
+
+
+# Booking conflicts.
+
+def show_conflicts(artist_id, venue_id, start_time, end_time, exclude_id=None):
+    """The shows that the artist or the venue already has during
+    [start_time, end_time), earliest first."""
+    return db.session.query(Show.id, Show.artist_id, Show.venue_id, Show.start_time, Show.end_time) \
+        .filter(show_overlaps(artist_id, venue_id, start_time, end_time, exclude_id)) \
+        .order_by(Show.start_time, Show.id).all()
+
+
+def booking_parties(artist_id, venue_id):
+    """Whether the artist and the venue of a new show exist and are not
+    deleted, as a pair of booleans from one statement."""
+    return db.session.query(
+        db.session.query(Artist.id).filter(Artist.id == artist_id, live(Artist)).exists(),
+        db.session.query(Venue.id).filter(Venue.id == venue_id, live(Venue)).exists(),
+    ).one()
+
+
+def conflict_report():
+    """Every pair of overlapping shows of the same artist or venue.
+
+    One statement: the show table joined to itself on the artist and on the
+    venue. Each pair is found once, from the show that starts first, by a
+    range scan of the (artist_id|venue_id, start_time) index between that
+    show's start and end.
+    """
+    earlier, later = aliased(Show, name='earlier'), aliased(Show, name='later')
+
+    def pairs(kind, fk):
+        return db.session.query(
+            literal(kind).label('kind'), getattr(earlier, fk).label('owner_id'),
+            earlier.id.label('first_id'), earlier.start_time.label('first_start'), earlier.end_time.label('first_end'),
+            later.id.label('second_id'), later.start_time.label('second_start'),
+            later.end_time.label('second_end'),
+        ).select_from(earlier).join(later, and_(
+            getattr(later, fk) == getattr(earlier, fk),
+            later.start_time >= earlier.start_time, later.start_time < earlier.end_time,
+            or_(later.start_time > earlier.start_time, later.id > earlier.id),
+        ))
+
+    rows = pairs('artist', 'artist_id').union_all(pairs('venue', 'venue_id')).all()
+    return sorted(rows, key=lambda row: (row.first_start, row.first_id, row.kind, row.second_id))
+
+
+# API rows.
+#
+# The JSON API selects only the columns a client asks for and returns plain
+# dicts built from the result tuples; no model objects are loaded.
+
+def _column_fields(model):
+    # Only live rows are served, so deleted_at would always be null.
+    return dict((attr.key, getattr(model, attr.key)) for attr in inspect(model).column_attrs
+                if attr.key != 'deleted_at')
+
+
+_ShowVenue = aliased(Venue, name='show_venue')
+_ShowArtist = aliased(Artist, name='show_artist')
+
+API_FIELDS = {
+    Venue: dict(_column_fields(Venue), genres=None),
+    Artist: dict(_column_fields(Artist), genres=None),
+    Show: dict(
+        _column_fields(Show),
+        venue_name=_ShowVenue.name.label('venue_name'),
+        venue_image_link=_ShowVenue.image_link.label('venue_image_link'),
+        artist_name=_ShowArtist.name.label('artist_name'),
+        artist_image_link=_ShowArtist.image_link.label('artist_image_link'),
+    ),
+}
+
+
+def _genre_names(model, ids):
+    """{id: [genre names]} for the venues or artists with ids, in one statement."""
+    association = model.genres.property.secondary
+    owner = association.c[model.__tablename__ + '_id']
+    names = dict((entity_id, []) for entity_id in ids)
+    if ids:
+        rows = db.session.query(owner, Genre.name).join(Genre, Genre.id == association.c.genre_id) \
+            .filter(owner.in_(ids)).order_by(owner, Genre.name)
+        for entity_id, name in rows:
+            names[entity_id].append(name)
+    return names
+
+
+def api_rows(model, fields, after=None, limit=API_PAGE_SIZE, ids=None):
+    """A page of venues, artists or shows as dicts holding only fields.
+
+    fields are keys of API_FIELDS[model]; id is always included. Pages are
+    keyed on id for venues and artists and on (start_time, id) for shows;
+    after is the key of the last row of the previous page. With ids, the
+    rows with those ids are returned instead, in one statement. Returns the
+    rows and the key after which the next page starts, or None if this was
+    the last. Genres take one more statement for the whole page.
+    """
+    available = API_FIELDS[model]
+    fields = ['id'] + [field for field in dict.fromkeys(fields) if field != 'id']
+    columns = [available[field] for field in fields if available[field] is not None]
+    query = db.session.query(*columns)
+    if model is not Show:
+        query = query.filter(live(model))
+    if model is Show:
+        names = set(fields)
+        if names & {'venue_name', 'venue_image_link'}:
+            query = query.join(_ShowVenue, _ShowVenue.id == Show.venue_id)
+        if names & {'artist_name', 'artist_image_link'}:
+            query = query.join(_ShowArtist, _ShowArtist.id == Show.artist_id)
+        # The page key is read from the rows, so select it even when it is
+        # not asked for.
+        query = query.add_columns(Show.start_time.label('_start_time'))
+        order = [Show.start_time, Show.id]
+    else:
+        order = [model.id]
+
+    if ids is not None:
+        query = query.filter(model.id.in_(ids)).order_by(*order)
+        rows, next_after = query.all(), None
+    else:
+        if after is not None:
+            query = query.filter(tuple_(*order) > tuple_(*after) if model is Show else model.id > after)
+        # One extra row tells whether there is a next page.
+        rows = query.order_by(*order).limit(limit + 1).all()
+        next_after = None
+        if len(rows) > limit:
+            rows = rows[:limit]
+            last = rows[-1]
+            next_after = (last._start_time, last.id) if model is Show else last.id
+
+    selected = [field for field in fields if available[field] is not None]
+    items = [dict(zip(selected, row)) for row in rows]
+    if 'genres' in fields:
+        genres = _genre_names(model, [item['id'] for item in items])
+        for item in items:
+            item['genres'] = genres[item['id']]
+    return items, next_after
@@ -0,0 +1,163 @@
+# Read replica routing.
+#
+# With DB_REPLICA_URL set, the 'replica' bind points at a read replica and
+# GET and HEAD requests read from it; flushes, and every statement of any
+# other request, go to the primary. A write request leaves a short-lived
+# cookie (DB_REPLICA_STICKY_SECONDS) that keeps the client's reads on the
+# primary, so it sees its own writes while the replica catches up; the
+# page cache is skipped for those reads too (g.db_sticky).
+#
+# The replica's lag is checked at most every DB_REPLICA_LAG_CHECK_SECONDS
+# per process: PostgreSQL reports how long ago it replayed the last
+# transaction, a SQLite replica (see `flask fyyur sync-replica`) when it was
+# last copied. While the lag is over DB_REPLICA_MAX_LAG_SECONDS, or for
+# DB_REPLICA_RETRY_SECONDS after the replica could not be reached, reads go
+# to the primary too.
+import logging
+import threading
+import time
+from flask import g, has_request_context, request
+from flask_sqlalchemy import SignallingSession, SQLAlchemy
+from sqlalchemy import orm
+from sqlalchemy.exc import DBAPIError
+
+REPLICA_BIND = 'replica'
+STICKY_COOKIE = 'fyyur_primary'
+
+logger = logging.getLogger('fyyur.replica')
+
+LAG_QUERIES = {
+    # NULL when the server is not replaying WAL, i.e. is not a replica.
+    'postgresql': 'SELECT COALESCE(EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()), 0)',
+    # user_version holds the time of the last sync, 0 if never synced.
+    'sqlite': "SELECT CASE WHEN user_version > 0 THEN strftime('%s', 'now') - user_version ELSE 0 END "
+              "FROM pragma_user_version",
+}
+
+
+def reading_from_replica():
+    return has_request_context() and g.get('db_replica', False)
+
+
+class RoutingSession(SignallingSession):
+    """Sends the reads of requests routed to the replica to the replica bind."""
+
+    def __init__(self, db, **options):
+        self.db = db
+        SignallingSession.__init__(self, db, **options)
+
+    def get_bind(self, mapper=None, clause=None):
+        if reading_from_replica() and not self._flushing:
+            return self.db.get_engine(self.app, bind=REPLICA_BIND)
+        return SignallingSession.get_bind(self, mapper, clause)
+
+
+class RoutingSQLAlchemy(SQLAlchemy):
+    def create_session(self, options):
+        return orm.sessionmaker(class_=RoutingSession, db=self, **options)
+
+
+class ReplicaRouter(object):
+    """Decides per request whether reads go to the replica.
+
+    Configured from SQLALCHEMY_BINDS['replica'] (set from DB_REPLICA_URL;
+    without it everything uses the primary), DB_REPLICA_MAX_LAG_SECONDS,
+    DB_REPLICA_LAG_CHECK_SECONDS, DB_REPLICA_RETRY_SECONDS and
+    DB_REPLICA_STICKY_SECONDS.
+    """
+
+    def __init__(self, db, app=None):
+        self.db = db
+        self.app = None
+        self._lock = threading.Lock()
+        self._checked_at = None
+        self._available = False
+        self.lag = None
+        self.stats = {'replica_reads': 0, 'primary_reads': 0, 'sticky_reads': 0, 'fallbacks': 0,
+                      'errors': 0}
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.extensions['replica_router'] = self
+        if not (app.config.get('SQLALCHEMY_BINDS') or {}).get(REPLICA_BIND):
+            return
+        self.app = app
+        self.max_lag = app.config.get('DB_REPLICA_MAX_LAG_SECONDS', 10)
+        self.check_interval = app.config.get('DB_REPLICA_LAG_CHECK_SECONDS', 1)
+        self.retry_interval = app.config.get('DB_REPLICA_RETRY_SECONDS', 30)
+        self.sticky_seconds = app.config.get('DB_REPLICA_STICKY_SECONDS', self.max_lag)
+        app.before_request(self._route)
+        app.after_request(self._stick)
+
+    @property
+    def enabled(self):
+        return self.app is not None
+
+    def measure_lag(self):
+        """The replica's lag in seconds; raises if it cannot be reached."""
+        engine = self.db.get_engine(self.app, bind=REPLICA_BIND)
+        query = LAG_QUERIES.get(engine.dialect.name)
+        if query is None:
+            return 0.0
+        with engine.connect() as connection:
+            return float(connection.execute(query).scalar() or 0)
+
+    def available(self):
+        """Whether the replica is reachable and within DB_REPLICA_MAX_LAG_SECONDS."""
+        now = time.monotonic()
+        with self._lock:
+            if self._checked_at is not None and now < self._checked_at:
+                return self._available
+            # One thread checks; the others keep the last answer meanwhile.
+            self._checked_at = now + self.check_interval
+        try:
+            lag = self.measure_lag()
+        except DBAPIError:
+            logger.warning('Read replica unreachable; reading from the primary for %ss.', self.retry_interval,
+                           exc_info=True)
+            with self._lock:
+                self.stats['errors'] += 1
+                self._checked_at = now + self.retry_interval
+                self.lag, self._available = None, False
+            return False
+        with self._lock:
+            if lag > self.max_lag and self._available:
+                logger.warning('Read replica %.1fs behind; reading from the primary.', lag)
+            self.lag, self._available = lag, lag <= self.max_lag
+            return self._available
+
+    def _route(self):
+        if request.method not in ('GET', 'HEAD'):
+            return
+        if request.cookies.get(STICKY_COOKIE):
+            g.db_sticky = True
+            self.stats['sticky_reads'] += 1
+        elif self.available():
+            g.db_replica = True
+            self.stats['replica_reads'] += 1
+        else:
+            self.stats['fallbacks'] += 1
+        if not g.get('db_replica'):
+            self.stats['primary_reads'] += 1
+
+    def _stick(self, response):
+        if request.method not in ('GET', 'HEAD', 'OPTIONS'):
+            response.set_cookie(STICKY_COOKIE, '1', max_age=self.sticky_seconds, httponly=True, samesite='Lax')
+        return response
+
+    def report(self):
+        return dict(self.stats, lag_seconds=self.lag, available=self._available, max_lag_seconds=self.max_lag)
+
+
+def sync_sqlite_replica(primary_engine, replica_engine):
+    """Copies a SQLite primary into a SQLite replica and stamps the time."""
+    source = primary_engine.raw_connection()
+    target = replica_engine.raw_connection()
+    try:
+        source.connection.backup(target.connection)
+        target.connection.execute('PRAGMA user_version = %d' % int(time.time()))
+        target.connection.commit()
+    finally:
+        source.close()
+        target.close()
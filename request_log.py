@@ -0,0 +1,151 @@
+# Request logging.
+#
+# Log records are put on an in-memory queue by the request threads and
+# written by a QueueListener thread, so a slow disk never holds up a
+# response. Records are JSON lines; every request adds one on the
+# fyyur.request logger with its route, status, latency, database time and
+# cache outcome. Successful requests can be sampled (LOG_SAMPLE_RATE);
+# errors and slow requests are always kept. log_report.py summarises the
+# files offline.
+#
+# app.logger and the fyyur loggers belong to the process, not to an app, so
+# every app logging to the same LOG_FILE shares one handler and listener:
+# building a second app does not write each record twice.
+import atexit
+import copy
+import json
+import logging
+import os
+import queue
+import random
+import threading
+import time
+from datetime import datetime
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler, TimedRotatingFileHandler
+from flask import g, request
+
+request_logger = logging.getLogger('fyyur.request')
+
+# LOG_FILE path -> the queue handler writing to it.
+_handlers = {}
+_handlers_lock = threading.Lock()
+
+# Attributes every LogRecord has; anything else was passed in extra=.
+_RECORD_ATTRIBUTES = set(vars(logging.LogRecord('', 0, '', 0, '', (), None))) | {'message', 'asctime'}
+
+
+class JSONFormatter(logging.Formatter):
+    """Formats a record as one JSON object, extra= fields included."""
+
+    def format(self, record):
+        entry = {
+            'ts': datetime.utcfromtimestamp(record.created).isoformat() + 'Z',
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+        }
+        for key, value in vars(record).items():
+            if key not in _RECORD_ATTRIBUTES:
+                entry[key] = value
+        if record.exc_info:
+            entry['exc'] = self.formatException(record.exc_info)
+        elif record.exc_text:
+            entry['exc'] = record.exc_text
+        return json.dumps(entry, default=str)
+
+
+class _RecordQueueHandler(QueueHandler):
+    def prepare(self, record):
+        # The queue stays in this process, so the record need not be made
+        # picklable; only what could change before the listener gets to it
+        # is resolved here: the message arguments and the traceback.
+        record = copy.copy(record)
+        record.msg, record.args = record.getMessage(), None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+
+def _file_handler(config):
+    if config.get('LOG_ROTATION', 'size') == 'time':
+        return TimedRotatingFileHandler(config['LOG_FILE'], when=config.get('LOG_ROTATE_WHEN', 'midnight'),
+                                        backupCount=config.get('LOG_BACKUP_COUNT', 7), utc=True)
+    return RotatingFileHandler(config['LOG_FILE'], maxBytes=config.get('LOG_MAX_BYTES', 10 * 1024 * 1024),
+                               backupCount=config.get('LOG_BACKUP_COUNT', 7))
+
+
+def _queue_handler(config):
+    """The queue handler of config's LOG_FILE, with its listener started
+    the first time."""
+    path = os.path.abspath(config['LOG_FILE'])
+    with _handlers_lock:
+        handler = _handlers.get(path)
+        if handler is None:
+            file_handler = _file_handler(config)
+            file_handler.setFormatter(JSONFormatter())
+            records = queue.Queue(-1)
+            listener = QueueListener(records, file_handler, respect_handler_level=True)
+            listener.start()
+            atexit.register(listener.stop)
+            handler = _handlers[path] = _RecordQueueHandler(records)
+        return handler
+
+
+class RequestLog(object):
+    """Queue-backed JSON logging for an app and one record per request.
+
+    Configured from LOG_FILE (no logging when empty), LOG_LEVEL,
+    LOG_ROTATION ('size' or 'time'), LOG_MAX_BYTES, LOG_ROTATE_WHEN,
+    LOG_BACKUP_COUNT, LOG_SAMPLE_RATE and LOG_SLOW_MS.
+    """
+
+    def __init__(self, app=None):
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.extensions['request_log'] = self
+        config = app.config
+        if not config.get('LOG_FILE'):
+            return
+        self.sample_rate = config.get('LOG_SAMPLE_RATE', 1.0)
+        self.slow = config.get('LOG_SLOW_MS', 1000) / 1000.0
+
+        handler = _queue_handler(config)
+        level = config.get('LOG_LEVEL', 'INFO')
+        for logger in (app.logger, logging.getLogger('fyyur')):
+            logger.setLevel(level)
+            if handler not in logger.handlers:
+                logger.addHandler(handler)
+
+        app.before_request(self._start)
+        app.after_request(self._log)
+
+    def _start(self):
+        g.log_started = time.perf_counter()
+
+    def _log(self, response):
+        started = g.get('log_started')
+        if started is None:
+            return response
+        latency = time.perf_counter() - started
+        # Successful, fast requests are sampled; the rate is logged so
+        # counts can be scaled back up.
+        sampled = response.status_code < 400 and latency < self.slow
+        sample_rate = self.sample_rate if sampled else 1.0
+        if sample_rate < 1.0 and random.random() >= sample_rate:
+            return response
+        profile = g.get('sql_profile')
+        request_logger.info('%s %s %s', request.method, request.path, response.status_code, extra={
+            'route': request.endpoint,
+            'method': request.method,
+            'path': request.path,
+            'status': response.status_code,
+            'latency_ms': round(latency * 1000, 2),
+            'db_ms': round(profile.duration * 1000, 2) if profile is not None else None,
+            'db_queries': profile.count if profile is not None else None,
+            'cache_hit': g.get('cache_hit'),
+            'sample_rate': sample_rate,
+        })
+        return response
@@ -0,0 +1,197 @@
+# Search.
+#
+# On PostgreSQL, venues and artists carry a trigger-maintained, GIN-indexed
+# `search_vector` column (see the add_search_vectors migration) and searches
+# are ranked with ts_rank. Other databases -- SQLite in tests and benchmarks --
+# fall back to an in-memory inverted index built from the same fields, kept
+# per app in app.extensions['memory_indexes'].
+import heapq
+import re
+import threading
+from bisect import bisect_left
+from flask import current_app
+from sqlalchemy import event, func, literal_column
+from model import db, Venue, Artist, Genre, live
+
+SEARCH_RESULTS_PER_PAGE = 20
+
+# Field weights, matching the A/B/C weights given to the search_vector parts.
+NAME_WEIGHT, LOCATION_WEIGHT, GENRE_WEIGHT = 4, 2, 1
+
+TOKEN_RE = re.compile(r'[^\W_]+', re.UNICODE)
+
+
+def tokenize(text):
+    return TOKEN_RE.findall((text or '').lower())
+
+
+class InvertedIndex(object):
+    """Maps tokens to the documents containing them, with prefix lookups."""
+
+    def __init__(self):
+        self.postings = {}  # token -> {doc id: weight}
+        self.docs = {}      # doc id -> summary returned with results
+        self._tokens = None
+
+    def add(self, doc_id, summary, fields):
+        """Indexes a document; fields is a list of (text, weight) pairs."""
+        self.docs[doc_id] = summary
+        for text, weight in fields:
+            for token in tokenize(text):
+                postings = self.postings.setdefault(token, {})
+                postings[doc_id] = max(postings.get(doc_id, 0), weight)
+        self._tokens = None
+
+    @property
+    def tokens(self):
+        """Every indexed token, sorted so prefixes map to a contiguous range."""
+        if self._tokens is None:
+            self._tokens = sorted(self.postings)
+        return self._tokens
+
+    def _prefix_matches(self, prefix):
+        """Best weight per document among the tokens starting with prefix."""
+        matches = {}
+        tokens = self.tokens
+        i = bisect_left(tokens, prefix)
+        while i < len(tokens) and tokens[i].startswith(prefix):
+            for doc_id, weight in self.postings[tokens[i]].items():
+                if weight > matches.get(doc_id, 0):
+                    matches[doc_id] = weight
+            i += 1
+        return matches
+
+    def search(self, term, offset=0, limit=None):
+        """Number of documents matching every token of term, and the ids of
+        the [offset:offset + limit] slice of them, best first."""
+        tokens = tokenize(term)
+        if not tokens:
+            return len(self.docs), self._top(self.docs, self._sort_key, offset, limit)
+        scores = None
+        for token in tokens:
+            matches = self._prefix_matches(token)
+            if scores is None:
+                scores = matches
+            else:
+                scores = {doc_id: score + matches[doc_id] for doc_id, score in scores.items() if doc_id in matches}
+            if not scores:
+                return 0, []
+        key = lambda doc_id: (-scores[doc_id],) + self._sort_key(doc_id)
+        return len(scores), self._top(scores, key, offset, limit)
+
+    @staticmethod
+    def _top(doc_ids, key, offset, limit):
+        # A partial sort is enough for one page of results.
+        if limit is None:
+            return sorted(doc_ids, key=key)[offset:]
+        return heapq.nsmallest(offset + limit, doc_ids, key=key)[offset:]
+
+    def _sort_key(self, doc_id):
+        return ((self.docs[doc_id]['name'] or '').lower(), doc_id)
+
+
+class MemoryIndexes(object):
+    """Lazily (re)built in-memory indexes, one per searchable model."""
+
+    def __init__(self, app=None):
+        self._lock = threading.Lock()
+        self._indexes = {}
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.extensions['memory_indexes'] = self
+
+    def invalidate(self, model=None):
+        with self._lock:
+            if model is None:
+                self._indexes.clear()
+            else:
+                self._indexes.pop(model, None)
+
+    def get(self, model):
+        with self._lock:
+            index = self._indexes.get(model)
+            if index is None:
+                index = self._indexes[model] = self._build(model)
+            return index
+
+    @staticmethod
+    def _build(model):
+        association = model.genres.property.secondary
+        entity_id = association.c[model.__tablename__ + '_id']
+        genres = {}
+        for doc_id, genre in db.session.query(entity_id, Genre.name) \
+                .join(Genre, Genre.id == association.c.genre_id):
+            genres.setdefault(doc_id, []).append(genre)
+
+        index = InvertedIndex()
+        for row in db.session.query(model.id, model.name, model.city, model.state).filter(live(model)) \
+                .yield_per(1000):
+            index.add(row.id, {"id": row.id, "name": row.name, "city": row.city, "state": row.state}, [
+                (row.name, NAME_WEIGHT),
+                (row.city, LOCATION_WEIGHT),
+                (row.state, LOCATION_WEIGHT),
+                (' '.join(genres.get(row.id, ())), GENRE_WEIGHT),
+            ])
+        return index
+
+
+def invalidate_index(model=None):
+    """Marks the current app's in-memory index of model, or of every model,
+    stale."""
+    indexes = current_app.extensions.get('memory_indexes')
+    if indexes is not None:
+        indexes.invalidate(model)
+
+
+def _invalidate_index(mapper, connection, target):
+    invalidate_index(type(target))
+
+
+# ORM writes mark the in-memory index stale; bulk and Core writes bypass
+# these hooks and must call invalidate_index() themselves.
+for _model in (Venue, Artist):
+    for _event in ('after_insert', 'after_update', 'after_delete'):
+        event.listen(_model, _event, _invalidate_index)
+
+
+def _search_postgres(model, term, offset, limit):
+    vector = literal_column('%s.search_vector' % model.__tablename__)
+    results = db.session.query(model.id, model.name, model.city, model.state).filter(live(model))
+    tokens = tokenize(term)
+    if tokens:
+        tsquery = func.to_tsquery('simple', ' & '.join(token + ':*' for token in tokens))
+        results = results.filter(vector.op('@@')(tsquery)) \
+            .order_by(func.ts_rank(vector, tsquery).desc(), model.name, model.id)
+    else:
+        results = results.order_by(model.name, model.id)
+    count = results.order_by(None).count()
+    rows = results.limit(limit).offset(offset).all()
+    return count, [{"id": row.id, "name": row.name, "city": row.city, "state": row.state} for row in rows]
+
+
+def _search_memory(model, term, offset, limit):
+    index = current_app.extensions['memory_indexes'].get(model)
+    count, ids = index.search(term, offset, limit)
+    return count, [index.docs[doc_id] for doc_id in ids]
+
+
+def search(model, term, page=1, per_page=SEARCH_RESULTS_PER_PAGE):
+    """Ranked, paginated search over the name, city, state and genres of model.
+
+    Every word of term has to prefix-match one of those fields.
+    """
+    page = max(page, 1)
+    if db.engine.dialect.name == 'postgresql':
+        backend = _search_postgres
+    else:
+        backend = _search_memory
+    count, data = backend(model, term, (page - 1) * per_page, per_page)
+    return {
+        "count": count,
+        "data": data,
+        "page": page,
+        "has_prev": page > 1,
+        "has_next": page * per_page < count,
+    }
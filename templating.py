@@ -0,0 +1,69 @@
+# Templates.
+#
+# Compiled templates are kept in a Jinja bytecode cache on disk
+# (TEMPLATE_CACHE_DIR), shared by every worker and kept across restarts, so
+# a template is compiled once per deploy rather than once per process.
+# `flask fyyur compile-templates` fills it as a build step, and with
+# TEMPLATE_PRECOMPILE each worker loads every template at startup instead of
+# on its first request for it.
+#
+# The datetime filter formats datetimes with Babel. Queries hand it
+# datetime objects; strings are still parsed for older callers. The Babel
+# pattern and locale are resolved once per (format, locale); Babel itself is
+# imported on the first use, not when a worker starts.
+import os
+from datetime import date, datetime, timezone
+from jinja2 import FileSystemBytecodeCache
+
+DATETIME_FORMATS = {
+    'full': "EEEE MMMM, d, y 'at' h:mma",
+    'medium': "EE MM, dd, y h:mma",
+}
+
+_datetime_formats = {}
+
+
+def _datetime_format(format, locale):
+    key = (format, locale)
+    compiled = _datetime_formats.get(key)
+    if compiled is None:
+        from babel import Locale
+        from babel.dates import LC_TIME, parse_pattern
+        pattern = parse_pattern(DATETIME_FORMATS.get(format, format))
+        compiled = _datetime_formats[key] = (pattern, Locale.parse(locale or LC_TIME))
+    return compiled
+
+
+def format_datetime(value, format='medium', locale=None):
+    """The datetime filter: value is a datetime, a date or a string dateutil
+    can parse; format is 'full', 'medium' or a Babel pattern."""
+    if isinstance(value, date) and not isinstance(value, datetime):
+        value = datetime.combine(value, datetime.min.time())
+    elif not isinstance(value, datetime):
+        import dateutil.parser
+        value = dateutil.parser.parse(value)
+    if value.tzinfo is None:
+        # As babel.dates.format_datetime does: naive values are taken as UTC.
+        value = value.replace(tzinfo=timezone.utc)
+    pattern, locale = _datetime_format(format, locale)
+    return pattern.apply(value, locale)
+
+
+def precompile_templates(env, extensions=('html',)):
+    """Loads (compiling if needed) every template of env; returns their names."""
+    names = env.list_templates(extensions=extensions)
+    for name in names:
+        env.get_template(name)
+    return names
+
+
+def init_templates(app):
+    """Installs the bytecode cache and filters on app, from TEMPLATE_CACHE_DIR
+    (no cache when empty) and TEMPLATE_PRECOMPILE."""
+    cache_dir = app.config.get('TEMPLATE_CACHE_DIR')
+    if cache_dir:
+        os.makedirs(cache_dir, exist_ok=True)
+        app.jinja_env.bytecode_cache = FileSystemBytecodeCache(cache_dir)
+    app.jinja_env.filters['datetime'] = format_datetime
+    if app.config.get('TEMPLATE_PRECOMPILE'):
+        precompile_templates(app.jinja_env)
@@ -0,0 +1,232 @@
+# Write service.
+#
+# The write handlers describe a change as a function of a UnitOfWork and
+# hand it to run(), which calls it in one transaction and commits:
+#
+#     venue = run(lambda work: work.save_venue(form))
+#
+# save_venue() and save_artist() map a validated form onto a new or an
+# existing row, genres included, and add_show() books a show. Each flushes,
+# so the ids of new rows come back from their INSERT (RETURNING on
+# PostgreSQL) and the next write of the same unit can refer to them: a
+# venue and its first shows are one transaction. delete() removes a venue
+# or an artist with its shows in a few set-based statements (with
+# SOFT_DELETE, marks it deleted and moves its shows to show_history
+# instead). Nothing is read back after the commit. The page cache scopes a
+# unit touched are invalidated once it has committed.
+#
+# A transaction that fails on a serialization failure or a deadlock (or, on
+# SQLite, a database locked past the busy timeout), or that finds rows it
+# read changed by a concurrent one (two edits replacing the genres of the
+# same venue), is rolled back and the whole unit runs again, up to
+# DB_WRITE_ATTEMPTS times in all, after DB_WRITE_BACKOFF_MS doubled on each
+# retry and jittered so that colliding writers do not collide again.
+import logging
+import random
+import threading
+import time
+from datetime import datetime
+from flask import current_app
+from sqlalchemy.exc import DBAPIError, OperationalError
+from sqlalchemy.orm.exc import StaleDataError
+from model import db, Venue, Artist, Show, Genre, default_end_time, live, archive_shows, refresh_show_counters
+from search import invalidate_index
+
+VENUE_FIELDS = ('name', 'city', 'state', 'address', 'phone', 'genres', 'image_link', 'facebook_link', 'website',
+                'seeking_talent', 'seeking_description')
+ARTIST_FIELDS = ('name', 'city', 'state', 'phone', 'genres', 'image_link', 'facebook_link', 'website',
+                 'seeking_venue', 'seeking_description')
+# Model -> (form fields, the yes/no field among them).
+ENTITY_FIELDS = {Venue: (VENUE_FIELDS, 'seeking_talent'), Artist: (ARTIST_FIELDS, 'seeking_venue')}
+
+# serialization_failure and deadlock_detected.
+RETRY_SQLSTATES = ('40001', '40P01')
+# exclusion_violation: the show overlap constraints on PostgreSQL.
+EXCLUSION_VIOLATION = '23P01'
+
+logger = logging.getLogger('fyyur.writes')
+
+
+def form_values(form, fields, flag):
+    """Column values of the validated form, genres left out."""
+    values = dict((field, form[field].data) for field in fields if field not in ('genres', flag))
+    values[flag] = form[flag].data == 'True'
+    return values
+
+
+def _counterpart_ids(model, entity_id):
+    """Ids of the artists a venue has shows with, or of an artist's venues."""
+    own, other = (Show.venue_id, Show.artist_id) if model is Venue else (Show.artist_id, Show.venue_id)
+    return [other_id for other_id, in db.session.query(other).filter(own == entity_id).distinct()]
+
+
+def _scopes(model, entity_id, counterpart_ids):
+    kind, other = ('venue', 'artist') if model is Venue else ('artist', 'venue')
+    return [kind + 's', 'shows', '%s:%s' % (kind, entity_id)] + ['%s:%s' % (other, other_id)
+                                                               for other_id in counterpart_ids]
+
+
+def venue_scopes(venue_id):
+    """Cache scopes of the pages showing a venue, its artists' pages included."""
+    return _scopes(Venue, venue_id, _counterpart_ids(Venue, venue_id))
+
+
+def artist_scopes(artist_id):
+    """Cache scopes of the pages showing an artist, its venues' pages included."""
+    return _scopes(Artist, artist_id, _counterpart_ids(Artist, artist_id))
+
+
+def retryable(error):
+    """Whether running the transaction again may succeed."""
+    if isinstance(error, StaleDataError):
+        return True
+    if getattr(getattr(error, 'orig', None), 'pgcode', None) in RETRY_SQLSTATES:
+        return True
+    return isinstance(error, OperationalError) and 'database is locked' in str(error.orig)
+
+
+def double_booking(error):
+    """Whether an IntegrityError is the database refusing overlapping shows
+    (an exclusion constraint on PostgreSQL, a trigger on SQLite)."""
+    orig = getattr(error, 'orig', None)
+    if getattr(orig, 'pgcode', None) is not None:
+        return orig.pgcode == EXCLUSION_VIOLATION
+    return 'already booked' in str(orig)
+
+
+class UnitOfWork(object):
+    """The writes of one transaction and the cache scopes they touch."""
+
+    def __init__(self):
+        self.scopes = set()
+
+    def save_venue(self, form, venue=None):
+        """A new venue from form, or venue updated from it."""
+        return self._save(Venue, form, venue)
+
+    def save_artist(self, form, artist=None):
+        """A new artist from form, or artist updated from it."""
+        return self._save(Artist, form, artist)
+
+    def _save(self, model, form, entity):
+        fields, flag = ENTITY_FIELDS[model]
+        # Looked up before the entity changes, which would autoflush it: a
+        # new row then goes out as one INSERT with its genre links.
+        genres = Genre.from_names(form.genres.data)
+        values = form_values(form, fields, flag)
+        if entity is None:
+            entity = model(genres=genres, **values)
+            db.session.add(entity)
+            self.scopes.add(model.__tablename__ + 's')
+        else:
+            self.scopes.update((venue_scopes if model is Venue else artist_scopes)(entity.id))
+            for field, value in values.items():
+                setattr(entity, field, value)
+            entity.genres = genres
+        db.session.flush()
+        return entity
+
+    def add_show(self, artist_id, venue_id, start_time, end_time=None):
+        show = Show(artist_id=artist_id, venue_id=venue_id, start_time=start_time,
+                    end_time=end_time or default_end_time(start_time))
+        db.session.add(show)
+        db.session.flush()
+        self.scopes.update(('shows', 'venues', 'artists', 'venue:%s' % venue_id, 'artist:%s' % artist_id))
+        return show
+
+    def delete(self, model, entity_id):
+        """Deletes the venue or artist entity_id and its shows; False if
+        there is no such (live) row.
+
+        Nothing is loaded: PostgreSQL cascades the shows and genre links
+        of the row it deletes; SQLite, which does not enforce foreign keys
+        here, gets a DELETE per table. The other side's counters are
+        recounted in one UPDATE.
+        """
+        connection = db.session.connection()
+        now = datetime.utcnow()
+        soft = current_app.config.get('SOFT_DELETE')
+        other_model = Artist if model is Venue else Venue
+        own = Show.venue_id if model is Venue else Show.artist_id
+        counterpart_ids = _counterpart_ids(model, entity_id)
+        row = model.__table__.update().values(deleted_at=now, updated_at=now) if soft else model.__table__.delete()
+        if not connection.execute(row.where(model.id == entity_id).where(live(model))).rowcount:
+            return False
+        if soft:
+            # Recounts both sides, this row down to no shows.
+            archive_shows(connection, own == entity_id, now=now)
+        else:
+            if db.engine.dialect.name != 'postgresql':
+                association = model.genres.property.secondary
+                connection.execute(Show.__table__.delete().where(own == entity_id))
+                connection.execute(association.delete().where(
+                    association.c[model.__tablename__ + '_id'] == entity_id))
+            refresh_show_counters(connection, other_model, counterpart_ids)
+        invalidate_index(model)
+        self.scopes.update(_scopes(model, entity_id, counterpart_ids))
+        # The other side's listings show its show counts.
+        self.scopes.add(other_model.__tablename__ + 's')
+        return True
+
+
+def run(work, attempts=None, backoff_ms=None):
+    """work(unit) in one transaction, committed; returns what work returns.
+
+    Retries on the errors retryable() accepts and raises the others (and
+    the last retryable one) after rolling back.
+    """
+    config = current_app.config
+    attempts = attempts or config.get('DB_WRITE_ATTEMPTS', 3)
+    backoff_ms = config.get('DB_WRITE_BACKOFF_MS', 20) if backoff_ms is None else backoff_ms
+    for attempt in range(1, attempts + 1):
+        unit = UnitOfWork()
+        try:
+            result = work(unit)
+            db.session.commit()
+        except (DBAPIError, StaleDataError) as error:
+            db.session.rollback()
+            if attempt == attempts or not retryable(error):
+                _count('failures')
+                raise
+            _count('retries')
+            delay = backoff_ms * 2 ** (attempt - 1) * random.uniform(0.5, 1.5) / 1000.0
+            logger.warning('Write conflict (%s); retrying in %.0f ms.', getattr(error, 'orig', error), delay * 1000)
+            time.sleep(delay)
+            continue
+        except BaseException:
+            # Not a database error (an abort(404), say): nothing to retry.
+            db.session.rollback()
+            raise
+        _count('transactions')
+        page_cache = current_app.extensions.get('page_cache')
+        if page_cache is not None and unit.scopes:
+            page_cache.invalidate(*sorted(unit.scopes))
+        return result
+
+
+def _count(outcome):
+    write_stats = current_app.extensions.get('write_stats')
+    if write_stats is not None:
+        write_stats.count(outcome)
+
+
+class WriteStats(object):
+    """Counts the transactions run() commits, retries and gives up on, per
+    app in app.extensions['write_stats']."""
+
+    def __init__(self, app=None):
+        self._lock = threading.Lock()
+        self.stats = {'transactions': 0, 'retries': 0, 'failures': 0}
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.extensions['write_stats'] = self
+
+    def count(self, outcome):
+        with self._lock:
+            self.stats[outcome] += 1
+
+    def report(self):
+        with self._lock:
+            return dict(self.stats)